@@ -5,21 +5,28 @@
 
 Even if you’re not billing yet, tracking is non-optional.
 
-Simple token estimator (good enough)
+Token estimator (reservation only)
 `
-def estimate_tokens(messages):
-    return sum(len(m["content"].split()) for m in messages)
+from gateway.token_budget import estimate_tokens
 `
+Counts ~4 characters per token. It only sizes the up-front reservation
+for TOKENS_PER_MINUTE; the bill is settled with Ollama's real
+prompt_eval_count + eval_count (see gateway/token_budget.py).
 
 ---
 
-Track usage in Redis
+Track usage (batched, off the request path)
 `
-def record_usage(api_key, model, tokens):
-    r.hincrby(f"usage:{api_key}", f"{model}:tokens", tokens)
-    r.hincrby(f"usage:{api_key}", f"{model}:requests", 1)
+from gateway.usage import UsageAggregator
+
+usage = UsageAggregator.from_env()   # USAGE_SINK=redis|sqlite|jsonl|none
+usage.record(api_key, model, prompt_tokens, completion_tokens)
 `
-Call this after every successful completion.
+record() only bumps in-process counters; a background task flushes them
+to the sink in one batch every USAGE_FLUSH_MS or USAGE_FLUSH_EVENTS
+records, and once more on shutdown. The Redis sink still writes
+usage:<api_key> hashes with <model>:tokens / <model>:requests fields,
+in a single pipeline.
 
 
 Cost mapping (future-proof)
@@ -6,6 +6,7 @@ This is a FastAPI server that acts as an OpenAI-compatible gateway to Ollama.
 
 import os
 import logging
+import time
 from typing import Optional, Dict, Any
 
 import uvicorn
@@ -16,13 +17,12 @@ from fastapi.responses import JSONResponse
 # Import project modules
 from app.rate_limit import check_rate_limit, RateLimitConfig
 from app.ollama_client import OllamaClient
-from app.auth import validate_api_key, get_api_key_info
+from gateway.cache import cache_key
+from gateway.coalesce import Coalescer
+from gateway.keys import KeyRegistry, extract_api_key
+from gateway.logs import setup_logging_from_env, stop_logging
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Set up logging (JSON through a background writer; see gateway/logs.py)
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
@@ -44,21 +44,32 @@ app.add_middleware(
 # Initialize clients and configuration
 ollama_client = OllamaClient()
 rate_limit_config = RateLimitConfig()
+coalescer = Coalescer()
+keys = KeyRegistry.from_env({})
 
 @app.middleware("http")
 async def logging_middleware(request: Request, call_next):
-    """Log all incoming requests."""
-    logger.info(f"Incoming request: {request.method} {request.url}")
-    logger.info(f"Headers: {dict(request.headers)}")
-    
+    """Log one line per request: method, path, status and duration.
+
+    Query strings and headers are left out; they can carry credentials.
+    """
+    started = time.perf_counter()
     response = await call_next(request)
-    logger.info(f"Response status: {response.status_code}")
-    
+    logger.info(
+        "request",
+        extra={
+            "route": request.url.path,
+            "method": request.method,
+            "status": response.status_code,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+    )
     return response
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize resources on application startup."""
+    setup_logging_from_env()
     logger.info("Starting AI Gateway for Ollama...")
     
     # Check if Ollama is available
@@ -71,6 +82,11 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Failed to connect to Ollama: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush queued log records."""
+    stop_logging()
+
 @app.get("/")
 async def root():
     """Root endpoint with API information."""
@@ -111,8 +127,7 @@ async def list_models(authorization: Optional[str] = Header(None)):
     """
     # Validate API key if provided
     if authorization:
-        api_key_info = validate_api_key(authorization)
-        if not api_key_info:
+        if keys.lookup(extract_api_key(authorization)) is None:
             raise HTTPException(status_code=401, detail="Invalid API key")
     
     try:
@@ -136,16 +151,16 @@ async def chat_completions(
     This endpoint accepts requests in OpenAI format and proxies them to Ollama.
     """
     # Validate API key
-    api_key_info = None
+    policy = None
     if authorization:
-        api_key_info = validate_api_key(authorization)
-        if not api_key_info:
+        policy = keys.lookup(extract_api_key(authorization))
+        if policy is None:
             raise HTTPException(status_code=401, detail="Invalid API key")
     
     # Check rate limits
-    if api_key_info:
+    if policy:
         rate_ok, limit_info = check_rate_limit(
-            api_key_info["key_id"], 
+            policy.id, 
             rate_limit_config
         )
         if not rate_ok:
@@ -157,7 +172,15 @@ async def chat_completions(
     # Parse request body
     try:
         request_data = await request.json()
-        logger.info(f"Chat completion request: {request_data}")
+        logger.debug(
+            "Chat completion request",
+            extra={
+                "route": "/v1/chat/completions",
+                "model": request_data.get("model"),
+                "messages": len(request_data.get("messages") or []),
+                "stream": bool(request_data.get("stream", False)),
+            }
+        )
     except Exception as e:
         logger.error(f"Failed to parse request JSON: {e}")
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
@@ -171,13 +194,25 @@ async def chat_completions(
     
     # Process the chat completion request
     try:
-        response = await ollama_client.chat_completion(
-            model=request_data["model"],
-            messages=request_data["messages"],
-            temperature=request_data.get("temperature", 0.7),
-            max_tokens=request_data.get("max_tokens"),
-            stream=request_data.get("stream", False)
-        )
+        def generate():
+            return ollama_client.chat_completion(
+                model=request_data["model"],
+                messages=request_data["messages"],
+                temperature=request_data.get("temperature", 0.7),
+                max_tokens=request_data.get("max_tokens"),
+                stream=request_data.get("stream", False)
+            )
+
+        # Identical deterministic requests share one generation
+        if request_data.get("temperature", 0.7) == 0 and not request_data.get("stream", False):
+            key = cache_key({
+                "model": request_data["model"],
+                "messages": request_data["messages"],
+                "options": {"temperature": 0, "num_predict": request_data.get("max_tokens")}
+            })
+            response = await coalescer.do(key, generate)
+        else:
+            response = await generate()
         
         # Return in OpenAI-compatible format
         return response
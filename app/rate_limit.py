@@ -1,26 +1,403 @@
+"""
+Per-key request rate limiting with constant memory per key.
+
+The default engine is GCRA (the generic cell rate algorithm): each key
+stores a single float, its theoretical arrival time (TAT). A request is
+allowed when it would not push the TAT more than one window past now,
+which admits bursts of up to ``max_requests`` and then one request every
+``window / max_requests`` seconds. ``mode="sliding_window"`` instead
+keeps two counters per key and weights the previous window by how much
+of it still overlaps the sliding window.
+
+Keys whose state has fully recovered are indistinguishable from new
+keys, so ``evict_idle`` drops them without changing any decision; run
+``run_eviction`` in the background to keep memory bounded by the number
+of recently active keys.
+
+``RedisRateLimiter`` runs the same GCRA decision inside Redis as one
+atomic script call, so every gateway replica shares the limit. In lease
+mode each replica reserves a block of tokens per key and spends them
+locally, topping the block up in a background thread, which replaces
+most Redis round trips with a dict lookup. The request path calls
+``check_async``, which makes any Redis round trip in a worker thread so
+the event loop never waits on the network.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import threading
 import time
-from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
 from fastapi import HTTPException, status
 
+try:
+    import redis
+except ImportError:  # redis is only needed for RedisRateLimiter
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+_monotonic = time.monotonic
+
+GCRA = "gcra"
+SLIDING_WINDOW = "sliding_window"
+
+
 class RateLimiter:
-    def __init__(self, max_requests: int, window_seconds: int):
+    def __init__(self, max_requests: int, window_seconds: int, mode: str = GCRA):
+        if mode not in (GCRA, SLIDING_WINDOW):
+            raise ValueError(f"Unknown rate limit mode: {mode}")
         self.max_requests = max_requests
         self.window = window_seconds
-        self.requests = defaultdict(deque)
+        self.mode = mode
+        # GCRA: key -> TAT. Sliding window: key -> [window index, previous, current].
+        self.state: Dict[str, Any] = {}
+        self._allow = self._allow_gcra if mode == GCRA else self._allow_sliding
+
+    def allow(self, api_key: str, max_requests: Optional[int] = None, now: Optional[float] = None) -> Tuple[bool, float]:
+        """Record a request if allowed; return (allowed, seconds until retry)."""
+        return self._allow(api_key, max_requests or self.max_requests, _monotonic() if now is None else now)
 
-    def check(self, api_key: str):
-        now = time.time()
-        window_start = now - self.window
-        q = self.requests[api_key]
+    def _allow_gcra(self, api_key: str, limit: int, now: float) -> Tuple[bool, float]:
+        tat = self.state.get(api_key, now)
+        new_tat = (tat if tat > now else now) + self.window / limit
+        # (now + window) - now can round to just above window on a large clock.
+        if new_tat - now > self.window + 1e-9:
+            return False, new_tat - now - self.window
+        self.state[api_key] = new_tat
+        return True, 0.0
 
-        # Remove expired timestamps
-        while q and q[0] < window_start:
-            q.popleft()
+    def _allow_sliding(self, api_key: str, limit: int, now: float) -> Tuple[bool, float]:
+        index = int(now // self.window)
+        counters = self.state.get(api_key)
+        if counters is None:
+            counters = self.state[api_key] = [index, 0, 0]
+        elif counters[0] != index:
+            previous = counters[2] if counters[0] == index - 1 else 0
+            counters[0], counters[1], counters[2] = index, previous, 0
+        elapsed = now / self.window - index
+        estimated = counters[1] * (1.0 - elapsed) + counters[2]
+        if estimated + 1 > limit:
+            if counters[1]:
+                # Time until enough of the previous window has slid out.
+                needed = (estimated + 1 - limit) / counters[1]
+                retry = min(needed, 1.0 - elapsed) * self.window
+            else:
+                retry = (1.0 - elapsed) * self.window
+            return False, retry
+        counters[2] += 1
+        return True, 0.0
 
-        if len(q) >= self.max_requests:
+    def check(self, api_key: str, max_requests: Optional[int] = None):
+        allowed, retry_after = self.allow(api_key, max_requests)
+        if not allowed:
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Rate limit exceeded"
+                detail="Rate limit exceeded",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Drop keys whose state has fully recovered; return how many."""
+        now = time.monotonic() if now is None else now
+        if self.mode == GCRA:
+            idle: List[str] = [k for k, tat in self.state.items() if tat <= now]
+        else:
+            index = int(now // self.window)
+            idle = [k for k, c in self.state.items() if c[0] < index - 1]
+        for key in idle:
+            del self.state[key]
+        return len(idle)
+
+    def tracked(self) -> List[str]:
+        """Keys that currently have state."""
+        return list(self.state)
+
+    def forget(self, api_keys: List[str]) -> None:
+        for key in api_keys:
+            self.state.pop(key, None)
+
+    async def run_eviction(self, interval: Optional[float] = None) -> None:
+        while True:
+            await asyncio.sleep(interval or self.window)
+            self.evict_idle()
+
+    async def check_async(self, api_key: str, max_requests: Optional[int] = None):
+        """``check`` for the request path; in-process state needs no I/O."""
+        self.check(api_key, max_requests)
+
+    def close(self) -> None:
+        """Nothing to release; present for parity with RedisRateLimiter."""
+
+
+@dataclass(frozen=True)
+class RateLimitConfig:
+    max_requests: int = field(default_factory=lambda: int(os.getenv("RATE_LIMIT_REQUESTS", "60")))
+    window_seconds: int = field(default_factory=lambda: int(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "60")))
+    mode: str = field(default_factory=lambda: os.getenv("RATE_LIMIT_MODE", GCRA))
+
+
+_limiters: Dict[RateLimitConfig, RateLimiter] = {}
+
+
+def check_rate_limit(api_key: str, config: RateLimitConfig) -> Tuple[bool, Dict[str, Any]]:
+    """Non-raising check; returns (allowed, limit info)."""
+    limiter = _limiters.get(config)
+    if limiter is None:
+        limiter = _limiters[config] = RateLimiter(config.max_requests, config.window_seconds, config.mode)
+    allowed, retry_after = limiter.allow(api_key)
+    return allowed, {
+        "max_requests": config.max_requests,
+        "window_seconds": config.window_seconds,
+        "retry_after": round(retry_after, 3),
+    }
+
+
+# KEYS[1] = limiter key
+# ARGV = emission interval (ms), burst window (ms), tokens wanted, [now (ms)]
+# Returns {tokens granted, ms until the next token}.
+GCRA_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local wanted = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+if not now then
+  local t = redis.call('TIME')
+  now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+end
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then tat = now end
+local granted = math.floor((now + window - tat) / interval)
+if granted > wanted then granted = wanted end
+if granted <= 0 then
+  return {0, math.ceil(tat + interval - window - now)}
+end
+tat = tat + granted * interval
+redis.call('SET', KEYS[1], tostring(tat), 'PX', math.ceil(tat - now))
+return {granted, 0}
+"""
+
+
+class LimiterUnavailable(Exception):
+    """Redis could not be reached in time and the limiter fails closed."""
+
+
+def _raise_if_refused(allowed: bool, retry_after: float) -> None:
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+
+def _unavailable() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Rate limiter unavailable",
+        headers={"Retry-After": "1"}
+    )
+
+
+class _Lease:
+    __slots__ = ("tokens", "expires", "refilling", "blocked_until")
+
+    def __init__(self, tokens: int, expires: float, blocked_until: float = 0.0):
+        self.tokens = tokens
+        self.expires = expires
+        self.refilling = False
+        self.blocked_until = blocked_until
+
+
+class RedisRateLimiter:
+    """GCRA limiter shared across replicas through Redis.
+
+    ``lease_size`` > 1 enables lease mode: up to that many tokens are
+    reserved per key and replica and must be used within ``lease_ttl``
+    seconds. Unused tokens are lost, so a key's lease is also capped at
+    what its limit lets it spend in ``lease_ttl``; keys too slow to spend
+    two tokens in that time go to Redis on every request. A refusal from
+    Redis is also remembered until its retry time. When Redis errors or
+    exceeds its socket timeout the limiter allows the request if
+    ``fail_open`` and otherwise refuses it with 503.
+    """
+
+    def __init__(
+        self,
+        max_requests: int,
+        window_seconds: int,
+        client: Any = None,
+        lease_size: int = 0,
+        lease_ttl: float = 1.0,
+        fail_open: bool = True,
+        prefix: str = "rl:",
+    ):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("RedisRateLimiter needs the redis package (pip install redis)")
+            client = redis.Redis.from_url(
+                os.getenv("REDIS_URL", "redis://redis:6379/0"),
+                socket_timeout=float(os.getenv("REDIS_TIMEOUT", "0.05")),
+                socket_connect_timeout=float(os.getenv("REDIS_TIMEOUT", "0.05")),
             )
+        self.max_requests = max_requests
+        self.window = window_seconds
+        self.client = client
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        self.fail_open = fail_open
+        self.prefix = prefix
+        self.round_trips = 0
+        self.failures = 0
+        self._script = client.register_script(GCRA_SCRIPT)
+        self._leases: Dict[str, _Lease] = {}
+        self._lock = threading.Lock()
+        self._refills = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rl-lease") if lease_size > 1 else None
+
+    def lease_for(self, limit: int) -> int:
+        """Tokens to lease for a key allowed ``limit`` per window; 0 means no lease."""
+        if self._refills is None:
+            return 0
+        size = min(self.lease_size, int(limit * self.lease_ttl / self.window))
+        return size if size > 1 else 0
+
+    def reserve(self, api_key: str, limit: int, wanted: int = 1, now_ms: Optional[int] = None) -> Tuple[int, float]:
+        """One atomic script call; returns (tokens granted, seconds until retry)."""
+        interval = self.window * 1000.0 / limit
+        args = [interval, self.window * 1000, wanted]
+        if now_ms is not None:
+            args.append(now_ms)
+        self.round_trips += 1
+        try:
+            granted, retry_ms = self._script(keys=[self.prefix + api_key], args=args)
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Redis rate limiter unavailable: {e}")
+            if self.fail_open:
+                return wanted, 0.0
+            raise LimiterUnavailable(str(e)) from e
+        return int(granted), int(retry_ms) / 1000.0
+
+    def _local(self, api_key: str, limit: int, size: int, now: float) -> Optional[Tuple[bool, float]]:
+        """Decide from the key's lease without Redis, or None if Redis must be asked."""
+        with self._lock:
+            lease = self._leases.get(api_key)
+            if lease is not None and lease.blocked_until > now:
+                # Redis already said no; don't ask again before the retry time.
+                return False, lease.blocked_until - now
+            if size > 1 and lease is not None and lease.tokens > 0 and lease.expires > now:
+                lease.tokens -= 1
+                if lease.tokens <= size // 2 and not lease.refilling:
+                    lease.refilling = True
+                    self._refills.submit(self._refill, api_key, limit, size)
+                return True, 0.0
+        return None
+
+    def _remote(self, api_key: str, limit: int, size: int, now: float) -> Tuple[bool, float]:
+        """Ask Redis for one token, or a new lease; blocks on the network."""
+        granted, retry_after = self.reserve(api_key, limit, max(size, 1))
+        if granted <= 0:
+            if self._refills is not None:
+                with self._lock:
+                    self._leases[api_key] = _Lease(0, now, blocked_until=now + retry_after)
+            return False, retry_after
+        if size > 1:
+            with self._lock:
+                self._leases[api_key] = _Lease(granted - 1, now + self.lease_ttl)
+        return True, 0.0
+
+    def allow(self, api_key: str, max_requests: Optional[int] = None) -> Tuple[bool, float]:
+        limit = max_requests or self.max_requests
+        size = self.lease_for(limit)
+        now = _monotonic()
+        local = self._local(api_key, limit, size, now) if self._refills is not None else None
+        return local if local is not None else self._remote(api_key, limit, size, now)
+
+    async def allow_async(self, api_key: str, max_requests: Optional[int] = None) -> Tuple[bool, float]:
+        """``allow`` with the Redis round trip, if any, in a worker thread."""
+        limit = max_requests or self.max_requests
+        size = self.lease_for(limit)
+        now = _monotonic()
+        local = self._local(api_key, limit, size, now) if self._refills is not None else None
+        if local is not None:
+            return local
+        return await asyncio.to_thread(self._remote, api_key, limit, size, now)
+
+    def _refill(self, api_key: str, limit: int, size: int) -> None:
+        try:
+            granted, _ = self.reserve(api_key, limit, size)
+        except LimiterUnavailable:
+            granted = 0
+        with self._lock:
+            lease = self._leases.get(api_key)
+            if lease is None:
+                return
+            lease.refilling = False
+            if granted > 0:
+                lease.tokens += granted
+                lease.expires = _monotonic() + self.lease_ttl
+
+    def check(self, api_key: str, max_requests: Optional[int] = None):
+        try:
+            allowed, retry_after = self.allow(api_key, max_requests)
+        except LimiterUnavailable:
+            raise _unavailable()
+        _raise_if_refused(allowed, retry_after)
+
+    async def check_async(self, api_key: str, max_requests: Optional[int] = None):
+        try:
+            allowed, retry_after = await self.allow_async(api_key, max_requests)
+        except LimiterUnavailable:
+            raise _unavailable()
+        _raise_if_refused(allowed, retry_after)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Drop expired local leases; Redis expires its own keys."""
+        now = _monotonic() if now is None else now
+        with self._lock:
+            idle = [
+                k for k, lease in self._leases.items()
+                if lease.expires <= now and lease.blocked_until <= now and not lease.refilling
+            ]
+            for key in idle:
+                del self._leases[key]
+        return len(idle)
+
+    async def run_eviction(self, interval: Optional[float] = None) -> None:
+        while True:
+            await asyncio.sleep(interval or self.window)
+            self.evict_idle()
+
+    def tracked(self) -> List[str]:
+        """Keys holding a local lease; the shared state lives in Redis."""
+        with self._lock:
+            return list(self._leases)
+
+    def forget(self, api_keys: List[str]) -> None:
+        with self._lock:
+            for key in api_keys:
+                self._leases.pop(key, None)
+
+    def close(self) -> None:
+        if self._refills is not None:
+            self._refills.shutdown(wait=False)
+
 
-        q.append(now)
+def rate_limiter_from_env() -> Any:
+    """In-process limiter by default; ``RATE_LIMIT_BACKEND=redis`` shares it via Redis."""
+    max_requests = int(os.getenv("RATE_LIMIT_REQUESTS", 60))
+    window_seconds = int(os.getenv("RATE_LIMIT_WINDOW_SECONDS", 60))
+    if os.getenv("RATE_LIMIT_BACKEND", "memory") == "redis":
+        return RedisRateLimiter(
+            max_requests,
+            window_seconds,
+            lease_size=int(os.getenv("RATE_LIMIT_LEASE_SIZE", "10")),
+            lease_ttl=float(os.getenv("RATE_LIMIT_LEASE_TTL", "1")),
+            fail_open=os.getenv("RATE_LIMIT_FAIL_OPEN", "true").lower() == "true",
+        )
+    return RateLimiter(max_requests, window_seconds, os.getenv("RATE_LIMIT_MODE", GCRA))
@@ -0,0 +1,65 @@
+"""
+Micro-benchmark: embeddings per second with and without micro-batching.
+
+Simulates an Ollama node that handles one ``/api/embed`` call at a time
+and costs ``--call-ms`` per call plus ``--input-ms`` per input, then
+fires ``--requests`` single-string requests from ``--clients``
+concurrent callers through ``MicroBatcher``.
+
+    python -m benchmarks.bench_embeddings [--requests 2000] [--clients 64]
+"""
+
+import argparse
+import asyncio
+import time
+
+from gateway.embeddings import MicroBatcher
+
+
+def simulated_node(call_ms: float, input_ms: float):
+    slot = asyncio.Semaphore(1)
+
+    async def embed(model, inputs):
+        async with slot:
+            await asyncio.sleep((call_ms + input_ms * len(inputs)) / 1000.0)
+        return [[0.0] * 8 for _ in inputs], len(inputs) * 4
+
+    return embed
+
+
+async def run(args, max_batch: int, max_wait_ms: float) -> float:
+    batcher = MicroBatcher(simulated_node(args.call_ms, args.input_ms), max_batch, max_wait_ms / 1000.0)
+    remaining = args.requests
+
+    async def client():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await batcher.embed("nomic-embed-text", ["some text to embed"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.clients)))
+    elapsed = time.perf_counter() - started
+    stats = batcher.snapshot()
+    print(f"max_batch={max_batch:<4} wait={max_wait_ms:>4}ms  {args.requests / elapsed:>8,.0f} embeddings/s  "
+          f"mean batch {stats['mean_batch']}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--call-ms", type=float, default=10.0)
+    parser.add_argument("--input-ms", type=float, default=0.5)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    baseline = asyncio.run(run(args, 1, 0))
+    batched = asyncio.run(run(args, args.max_batch, args.max_wait_ms))
+    print(f"speedup: {baseline / batched:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
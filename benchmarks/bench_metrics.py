@@ -0,0 +1,54 @@
+"""
+Micro-benchmark: cost of recording one request's metrics, and of /metrics.
+
+Reports microseconds per request for the full RequestMetrics lifecycle
+(queue wait, in-flight gauge, TTFT, tokens, tokens/s, latency) and the
+time to render the text exposition for the resulting series.
+
+    python -m benchmarks.bench_metrics [--requests 200000] [--keys 100]
+"""
+
+import argparse
+import random
+import time
+
+from gateway.metrics import REGISTRY, RequestMetrics
+
+RESPONSE = {"prompt_eval_count": 120, "eval_count": 300, "eval_duration": 6_000_000_000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200_000)
+    parser.add_argument("--keys", type=int, default=100)
+    parser.add_argument("--models", type=int, default=4)
+    parser.add_argument("--backends", type=int, default=4)
+    args = parser.parse_args()
+
+    keys = [f"key-{i}" for i in range(args.keys)]
+    models = [f"model-{i}" for i in range(args.models)]
+    backends = [f"http://gpu{i}:11434" for i in range(args.backends)]
+    plan = [
+        (random.choice(models), random.choice(keys), random.choice(backends))
+        for _ in range(args.requests)
+    ]
+
+    started = time.perf_counter()
+    for model, key, backend in plan:
+        m = RequestMetrics(model, key, backend, 0.004, 0.0)
+        m.first_token(0.2)
+        m.finished(RESPONSE)
+        m.end(6.5)
+    elapsed = time.perf_counter() - started
+
+    series = sum(len(metric.children) for metric in REGISTRY.metrics.values())
+    render_started = time.perf_counter()
+    text = REGISTRY.expose()
+    render = time.perf_counter() - render_started
+
+    print(f"record: {elapsed / args.requests * 1e6:.2f} us/request over {args.requests:,} requests")
+    print(f"expose: {render * 1000:.1f} ms for {series:,} series ({len(text):,} bytes)")
+
+
+if __name__ == "__main__":
+    main()
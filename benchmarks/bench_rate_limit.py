@@ -0,0 +1,81 @@
+"""
+Micro-benchmark: deque RateLimiter vs. the GCRA / sliding-window engine.
+
+Reports checks per second and bytes of limiter state per key.
+
+    python -m benchmarks.bench_rate_limit [--keys 10000] [--checks 200000]
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+from collections import defaultdict, deque
+
+from app.rate_limit import RateLimiter
+
+
+class DequeRateLimiter:
+    """The previous implementation: one timestamp per request per key."""
+
+    def __init__(self, max_requests: int, window_seconds: int):
+        self.max_requests = max_requests
+        self.window = window_seconds
+        self.requests = defaultdict(deque)
+
+    def allow(self, api_key: str) -> bool:
+        now = time.time()
+        window_start = now - self.window
+        q = self.requests[api_key]
+        while q and q[0] < window_start:
+            q.popleft()
+        if len(q) >= self.max_requests:
+            return False
+        q.append(now)
+        return True
+
+
+def bytes_per_key(make, keys: int, per_key: int) -> float:
+    names = [f"key-{i}" for i in range(keys)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    limiter = make()
+    for key in names:
+        for _ in range(per_key):
+            limiter.allow(key)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / keys
+
+
+def checks_per_second(make, keys: int, checks: int) -> float:
+    limiter = make()
+    names = [f"key-{i}" for i in range(keys)]
+    order = [random.choice(names) for _ in range(checks)]
+    started = time.perf_counter()
+    for key in order:
+        limiter.allow(key)
+    return checks / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--keys", type=int, default=10_000)
+    parser.add_argument("--checks", type=int, default=200_000)
+    parser.add_argument("--limit", type=int, default=60)
+    args = parser.parse_args()
+
+    engines = {
+        "deque": lambda: DequeRateLimiter(args.limit, 60),
+        "gcra": lambda: RateLimiter(args.limit, 60, mode="gcra"),
+        "sliding_window": lambda: RateLimiter(args.limit, 60, mode="sliding_window"),
+    }
+    print(f"{'engine':<16}{'checks/s':>14}{'bytes/key':>12}")
+    for name, make in engines.items():
+        rate = checks_per_second(make, args.keys, args.checks)
+        size = bytes_per_key(make, min(args.keys, 2_000), args.limit)
+        print(f"{name:<16}{rate:>14,.0f}{size:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Micro-benchmark: semantic cache lookup latency, flat vs IVF.
+
+Fills one scope's ``VectorIndex`` with ``--entries`` unit vectors of
+``--dim`` dimensions, drawn around ``--topics`` centres the way
+paraphrases of a few hundred questions cluster, then times
+``--queries`` searches for noisy copies of stored vectors before and
+after clustering. Recall is the share of searches that find the vector
+the query was copied from.
+
+    python -m benchmarks.bench_semantic_cache [--entries 100000] [--dim 768]
+"""
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from gateway.semantic_cache import VectorIndex
+
+
+def unit(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)).astype(np.float32)
+
+
+def measure(index: VectorIndex, queries, expected) -> None:
+    found = 0
+    started = time.perf_counter()
+    for query, id in zip(queries, expected):
+        found += index.search(query)[0] == id
+    elapsed = time.perf_counter() - started
+    print(f"{index.mode:<5} {len(index):>8,} entries  {1e6 * elapsed / len(queries):>8.1f} us/lookup  "
+          f"recall {found / len(queries):.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--topics", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--list-size", type=int, default=250)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((args.topics, args.dim))
+    topics = rng.integers(args.topics, size=args.entries)
+    vectors = unit(centres[topics] + rng.standard_normal((args.entries, args.dim)))
+    index = VectorIndex(args.dim, args.nprobe, args.list_size)
+    for id, vector in enumerate(vectors):
+        index.add(id, vector)
+
+    expected = rng.integers(args.entries, size=args.queries)
+    queries = unit(vectors[expected] + 0.1 * rng.standard_normal((args.queries, args.dim)) / np.sqrt(args.dim))
+    measure(index, queries, expected)
+    started = time.perf_counter()
+    asyncio.run(index.train())
+    print(f"clustered into {len(index.lists)} lists in {time.perf_counter() - started:.2f}s")
+    measure(index, queries, expected)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Micro-benchmark: the streaming hot loop, one Ollama line to one SSE frame.
+
+Compares building each ``chat.completion.chunk`` as a dict and encoding
+it with ``json.dumps`` against splicing the delta into a ``ChunkTemplate``
+with the gateway codec (orjson when installed). Reports chunks per second
+and the peak memory allocated while converting one chunk.
+
+    python -m benchmarks.bench_transform [--chunks 200000]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from gateway.transform import ChunkTemplate, loads, ollama_chunk_to_openai, orjson
+
+LINES = [
+    json.dumps({
+        "model": "llama3",
+        "created_at": "2024-05-01T12:00:00Z",
+        "message": {"role": "assistant", "content": word},
+        "done": False,
+    })
+    for word in ["Hello", ",", " world", " \"quoted\"", " naïve", "\n", " token"]
+]
+
+
+def dict_frame(line: str) -> bytes:
+    chunk = json.loads(line)
+    data = ollama_chunk_to_openai(chunk, "chatcmpl-0123456789abcdef", 1714564800, "llama3")
+    return f"data: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+def template_frame(template: ChunkTemplate, line: str) -> bytes:
+    chunk = loads(line)
+    return template.frame((chunk.get("message") or {}).get("content"))
+
+
+def run(name: str, convert, chunks: int) -> None:
+    lines = (LINES * (chunks // len(LINES) + 1))[:chunks]
+    started = time.perf_counter()
+    for line in lines:
+        convert(line)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    peak = 0
+    for line in LINES:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        convert(line)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    print(f"{name:<10} {chunks / elapsed:>12,.0f} chunks/s  {elapsed / chunks * 1e6:6.2f} us/chunk  {peak:>6,} B peak/chunk")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=200_000)
+    args = parser.parse_args()
+
+    template = ChunkTemplate("chatcmpl-0123456789abcdef", 1714564800, "llama3")
+    print(f"codec: {'orjson' if orjson is not None else 'json'}")
+    run("dict", dict_frame, args.chunks)
+    run("template", lambda line: template_frame(template, line), args.chunks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+A stand-in Ollama server for load tests.
+
+Serves ``/api/chat`` (NDJSON streaming or a single response),
+``/api/embed``, ``/api/tags`` and ``/api/ps`` with simulated timing:
+
+* the first request for a model after ``--keep-alive`` seconds idle pays
+  ``--load-ms`` to "load" it (reported as ``load_duration``);
+* a generation then waits ``--ttft-ms`` for the first token and emits
+  ``--tokens`` tokens at ``--tokens-per-second``;
+* each model runs at most ``--parallel`` generations at once, like
+  ``OLLAMA_NUM_PARALLEL``; the rest queue;
+* ``/api/embed`` takes ``--embed-ms`` plus ``--embed-input-ms`` per input;
+* ``--error-rate`` of chat and embed requests fail with a 500.
+
+    python -m benchmarks.fake_ollama [--port 11500] [--ttft-ms 50] [--tokens-per-second 80]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_MODELS = ("llama3", "nomic-embed-text")
+
+
+@dataclass
+class Profile:
+    ttft_ms: float = 50.0
+    tokens_per_second: float = 80.0
+    tokens: int = 64
+    load_ms: float = 500.0
+    keep_alive: float = 300.0
+    parallel: int = 4
+    error_rate: float = 0.0
+    embed_ms: float = 5.0
+    embed_input_ms: float = 0.5
+    dim: int = 768
+    seed: Optional[int] = None
+
+
+class FakeOllama:
+    """Per-model load state and generation slots."""
+
+    def __init__(self, profile: Profile, models=DEFAULT_MODELS):
+        self.profile = profile
+        self.models = list(models)
+        self.rng = random.Random(profile.seed)
+        self.last_used: Dict[str, float] = {}
+        self.slots: Dict[str, asyncio.Semaphore] = {}
+        self.requests = 0
+
+    def fail(self) -> bool:
+        return self.rng.random() < self.profile.error_rate
+
+    async def load(self, model: str) -> float:
+        """Wait for ``model`` to be loaded; returns the load time in seconds."""
+        now = time.monotonic()
+        last = self.last_used.get(model)
+        self.last_used[model] = now
+        if last is not None and now - last < self.profile.keep_alive:
+            return 0.0
+        await asyncio.sleep(self.profile.load_ms / 1000.0)
+        return self.profile.load_ms / 1000.0
+
+    def slot(self, model: str) -> asyncio.Semaphore:
+        slot = self.slots.get(model)
+        if slot is None:
+            slot = self.slots[model] = asyncio.Semaphore(self.profile.parallel)
+        return slot
+
+    def resident(self) -> List[str]:
+        now = time.monotonic()
+        return [m for m, used in self.last_used.items() if now - used < self.profile.keep_alive]
+
+
+def chunk(model: str, content: str, done: bool = False, **extra) -> bytes:
+    body = {
+        "model": model,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "message": {"role": "assistant", "content": content},
+        "done": done,
+        **extra,
+    }
+    return json.dumps(body).encode() + b"\n"
+
+
+def create_app(profile: Profile, models=DEFAULT_MODELS) -> FastAPI:
+    app = FastAPI()
+    server = FakeOllama(profile, models)
+    app.state.ollama = server
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": name, "model": name, "size": 0} for name in server.models]}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": name, "model": name} for name in server.resident()]}
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        payload = await request.json()
+        model = payload.get("model", "llama3")
+        server.requests += 1
+        if server.fail():
+            return JSONResponse(status_code=500, content={"error": "simulated failure"})
+        tokens = int((payload.get("options") or {}).get("num_predict") or profile.tokens)
+        tokens = max(1, min(tokens, profile.tokens))
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in payload.get("messages") or []) // 4 + 1
+        interval = 1.0 / profile.tokens_per_second if profile.tokens_per_second > 0 else 0.0
+
+        async def generate():
+            async with server.slot(model):
+                started = time.perf_counter()
+                load = await server.load(model)
+                await asyncio.sleep(profile.ttft_ms / 1000.0)
+                for i in range(tokens):
+                    if i:
+                        await asyncio.sleep(interval)
+                    yield chunk(model, f" tok{i}")
+                yield chunk(
+                    model, "", True,
+                    done_reason="stop" if tokens < profile.tokens else "length",
+                    total_duration=int((time.perf_counter() - started) * 1e9),
+                    load_duration=int(load * 1e9),
+                    prompt_eval_count=prompt_tokens,
+                    eval_count=tokens,
+                    eval_duration=int(tokens * interval * 1e9),
+                )
+
+        if payload.get("stream", True):
+            return StreamingResponse(generate(), media_type="application/x-ndjson")
+        content: List[str] = []
+        final = {}
+        async for line in generate():
+            final = json.loads(line)
+            content.append(final["message"]["content"])
+        final["message"]["content"] = "".join(content)
+        return final
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        payload = await request.json()
+        model = payload.get("model", "nomic-embed-text")
+        inputs = payload.get("input") or []
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        server.requests += 1
+        if server.fail():
+            return JSONResponse(status_code=500, content={"error": "simulated failure"})
+        async with server.slot(model):
+            load = await server.load(model)
+            await asyncio.sleep((profile.embed_ms + profile.embed_input_ms * len(inputs)) / 1000.0)
+        vector = [round(i / profile.dim, 6) for i in range(profile.dim)]
+        return {
+            "model": model,
+            "embeddings": [vector for _ in inputs],
+            "load_duration": int(load * 1e9),
+            "prompt_eval_count": sum(len(text) for text in inputs) // 4 + len(inputs),
+        }
+
+    return app
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = Profile()
+    parser.add_argument("--ttft-ms", type=float, default=defaults.ttft_ms)
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--tokens", type=int, default=defaults.tokens)
+    parser.add_argument("--load-ms", type=float, default=defaults.load_ms)
+    parser.add_argument("--keep-alive", type=float, default=defaults.keep_alive)
+    parser.add_argument("--parallel", type=int, default=defaults.parallel)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--embed-ms", type=float, default=defaults.embed_ms)
+    parser.add_argument("--embed-input-ms", type=float, default=defaults.embed_input_ms)
+    parser.add_argument("--dim", type=int, default=defaults.dim)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def profile_from_args(args: argparse.Namespace) -> Profile:
+    return Profile(
+        ttft_ms=args.ttft_ms,
+        tokens_per_second=args.tokens_per_second,
+        tokens=args.tokens,
+        load_ms=args.load_ms,
+        keep_alive=args.keep_alive,
+        parallel=args.parallel,
+        error_rate=args.error_rate,
+        embed_ms=args.embed_ms,
+        embed_input_ms=args.embed_input_ms,
+        dim=args.dim,
+        seed=args.seed,
+    )
+
+
+def profile_arguments(profile: Profile) -> List[str]:
+    """Command-line flags that recreate ``profile`` in a subprocess."""
+    flags = [
+        "--ttft-ms", str(profile.ttft_ms),
+        "--tokens-per-second", str(profile.tokens_per_second),
+        "--tokens", str(profile.tokens),
+        "--load-ms", str(profile.load_ms),
+        "--keep-alive", str(profile.keep_alive),
+        "--parallel", str(profile.parallel),
+        "--error-rate", str(profile.error_rate),
+        "--embed-ms", str(profile.embed_ms),
+        "--embed-input-ms", str(profile.embed_input_ms),
+        "--dim", str(profile.dim),
+    ]
+    if profile.seed is not None:
+        flags += ["--seed", str(profile.seed)]
+    return flags
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--models", default=",".join(DEFAULT_MODELS))
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    app = create_app(profile_from_args(args), [m for m in args.models.split(",") if m])
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
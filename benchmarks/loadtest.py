@@ -0,0 +1,386 @@
+"""
+Load test: drive a gateway with mixed traffic and record the results.
+
+By default this starts ``benchmarks.fake_ollama`` and a gateway
+(``uvicorn gateway.main:app``) pointed at it on free local ports, then
+runs ``--concurrency`` clients for ``--duration`` seconds. Each request
+is a streaming chat completion, a non-streaming one or an embedding,
+drawn with the weights in ``--mix``. Pass ``--gateway URL`` (and
+``--api-key``) to test a gateway that is already running instead.
+
+Reported per request kind: throughput, p50/p95/p99 latency and, for
+streams, time to the first content chunk. For a gateway this script
+started it also reports CPU time per request and resident memory growth
+(from ``psutil`` when installed, else ``/proc``).
+
+``--output`` saves the results as JSON. ``--baseline`` compares them to
+an earlier file and exits 1 if throughput fell, or p95/p99 latency,
+TTFT, CPU per request or the error rate rose, by more than
+``--tolerance`` (a fraction, default 0.15), so a CI job can fail the
+build on a regression:
+
+    python -m benchmarks.loadtest --duration 30 --output results.json
+    python -m benchmarks.loadtest --baseline results.json --tolerance 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import httpx
+
+from benchmarks.fake_ollama import Profile, add_profile_arguments, profile_arguments, profile_from_args
+
+try:
+    import psutil
+except ImportError:  # psutil is optional; /proc is read instead
+    psutil = None
+
+KINDS = ("stream", "chat", "embed")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of ``values`` (0 when empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100.0 * len(ordered))) - 1))]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2) if values else 0.0,
+    }
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """``stream=0.5,chat=0.3,embed=0.2`` -> weights per kind."""
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError(f"Unknown request kind {kind!r}; expected one of {', '.join(KINDS)}")
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+@dataclass
+class Samples:
+    latency_ms: List[float] = field(default_factory=list)
+    ttft_ms: List[float] = field(default_factory=list)
+    errors: int = 0
+    statuses: Dict[str, int] = field(default_factory=dict)
+
+    def record(self, status: int, latency: float, ttft: Optional[float] = None) -> None:
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if status != 200:
+            self.errors += 1
+            return
+        self.latency_ms.append(latency * 1000.0)
+        if ttft is not None:
+            self.ttft_ms.append(ttft * 1000.0)
+
+
+class ProcessStats:
+    """CPU seconds and resident bytes of a local process."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.process = psutil.Process(pid) if psutil is not None else None
+
+    def cpu_seconds(self) -> float:
+        if self.process is not None:
+            times = self.process.cpu_times()
+            return times.user + times.system
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def rss_bytes(self) -> int:
+        if self.process is not None:
+            return self.process.memory_info().rss
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+
+async def stream_request(client: httpx.AsyncClient, body: Dict[str, Any]) -> Tuple[int, float, Optional[float]]:
+    started = time.perf_counter()
+    ttft = None
+    async with client.stream("POST", "/v1/chat/completions", json=body) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return response.status_code, time.perf_counter() - started, None
+        async for line in response.aiter_lines():
+            if ttft is None and line.startswith("data: ") and '"content"' in line:
+                ttft = time.perf_counter() - started
+    return response.status_code, time.perf_counter() - started, ttft
+
+
+async def json_request(client: httpx.AsyncClient, path: str, body: Dict[str, Any]) -> Tuple[int, float, None]:
+    started = time.perf_counter()
+    response = await client.post(path, json=body)
+    await response.aread()
+    return response.status_code, time.perf_counter() - started, None
+
+
+async def generate_load(
+    gateway: str,
+    api_key: str,
+    mix: Mapping[str, float],
+    concurrency: int,
+    duration: float,
+    model: Optional[str] = None,
+    seed: int = 0,
+) -> Tuple[Dict[str, Samples], float]:
+    """Run ``concurrency`` clients for ``duration`` seconds; returns samples per kind and elapsed time."""
+    rng = random.Random(seed)
+    kinds, weights = list(mix), list(mix.values())
+    samples = {kind: Samples() for kind in kinds}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"Authorization": f"Bearer {api_key}"}
+    timeout = httpx.Timeout(120.0)
+
+    async with httpx.AsyncClient(base_url=gateway, headers=headers, limits=limits, timeout=timeout) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+
+        async def worker(n: int) -> None:
+            while time.perf_counter() < deadline:
+                kind = rng.choices(kinds, weights)[0]
+                question = f"Question {rng.randrange(1_000_000)} from client {n}: what is the capital of France?"
+                chat = {"messages": [{"role": "user", "content": question}], "stream": kind == "stream"}
+                if model:
+                    chat["model"] = model
+                try:
+                    if kind == "stream":
+                        result = await stream_request(client, chat)
+                    elif kind == "chat":
+                        result = await json_request(client, "/v1/chat/completions", chat)
+                    else:
+                        result = await json_request(client, "/v1/embeddings", {"input": question})
+                except httpx.HTTPError:
+                    result = (0, 0.0, None)
+                samples[kind].record(*result)
+
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return samples, elapsed
+
+
+def report(samples: Mapping[str, Samples], elapsed: float) -> Dict[str, Any]:
+    kinds = {}
+    total = errors = 0
+    latencies: List[float] = []
+    for kind, s in samples.items():
+        count = len(s.latency_ms) + s.errors
+        total += count
+        errors += s.errors
+        latencies += s.latency_ms
+        kinds[kind] = {
+            "requests": count,
+            "errors": s.errors,
+            "statuses": s.statuses,
+            "throughput_rps": round(len(s.latency_ms) / elapsed, 2),
+            "latency_ms": summarize(s.latency_ms),
+        }
+        if kind == "stream":
+            kinds[kind]["ttft_ms"] = summarize(s.ttft_ms)
+    return {
+        "duration_s": round(elapsed, 2),
+        "requests": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "throughput_rps": round((total - errors) / elapsed, 2),
+        "latency_ms": summarize(latencies),
+        "kinds": kinds,
+    }
+
+
+def regressions(current: Mapping[str, Any], baseline: Mapping[str, Any], tolerance: float) -> List[str]:
+    """What got worse than ``baseline`` by more than ``tolerance``."""
+    problems = []
+
+    def higher_is_better(name: str, now: float, before: float) -> None:
+        if before > 0 and now < before * (1 - tolerance):
+            problems.append(f"{name}: {now} < {before} (-{(1 - now / before) * 100:.1f}%)")
+
+    def lower_is_better(name: str, now: float, before: float) -> None:
+        if before > 0 and now > before * (1 + tolerance):
+            problems.append(f"{name}: {now} > {before} (+{(now / before - 1) * 100:.1f}%)")
+
+    higher_is_better("throughput_rps", current["throughput_rps"], baseline.get("throughput_rps", 0))
+    before_errors, now_errors = baseline.get("error_rate", 0.0), current["error_rate"]
+    if now_errors > before_errors + tolerance * max(before_errors, 0.01):
+        problems.append(f"error_rate: {now_errors} > {before_errors}")
+    for kind, now in current["kinds"].items():
+        before = baseline.get("kinds", {}).get(kind)
+        if before is None:
+            continue
+        higher_is_better(f"{kind}.throughput_rps", now["throughput_rps"], before["throughput_rps"])
+        for q in ("p95", "p99"):
+            lower_is_better(f"{kind}.latency_ms.{q}", now["latency_ms"][q], before["latency_ms"][q])
+        if "ttft_ms" in now and "ttft_ms" in before:
+            lower_is_better(f"{kind}.ttft_ms.p95", now["ttft_ms"]["p95"], before["ttft_ms"]["p95"])
+    now_cpu = (current.get("gateway") or {}).get("cpu_ms_per_request")
+    before_cpu = (baseline.get("gateway") or {}).get("cpu_ms_per_request")
+    if now_cpu is not None and before_cpu is not None:
+        lower_is_better("gateway.cpu_ms_per_request", now_cpu, before_cpu)
+    return problems
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def start_stack(
+    profile: Profile, api_key: str, model: str, env: Mapping[str, str]
+) -> Tuple[List[subprocess.Popen], str]:
+    """Start the fake Ollama and a gateway in front of it; returns (processes, gateway URL)."""
+    ollama_port, gateway_port = free_port(), free_port()
+    ollama = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(ollama_port), *profile_arguments(profile)]
+    )
+    gateway_env = {
+        **os.environ,
+        "OLLAMA_HOST": f"http://127.0.0.1:{ollama_port}",
+        "OLLAMA_NODES": "",
+        "API_KEYS": f"{api_key}={model}",
+        "RATE_LIMIT_REQUESTS": "100000000",
+        "TOKENS_PER_MINUTE": "0",
+        "ADMISSION_QUEUE_SIZE": "100000",
+        "OLLAMA_MODEL_CONCURRENCY": str(profile.parallel),
+        "CONFIG_PATH": os.devnull,
+        "LOG_LEVEL": "WARNING",
+        **env,
+    }
+    gateway = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "gateway.main:app", "--port", str(gateway_port), "--log-level", "warning"],
+        env=gateway_env,
+    )
+    processes = [ollama, gateway]
+    try:
+        wait_until_ready(f"http://127.0.0.1:{ollama_port}/api/tags")
+        wait_until_ready(f"http://127.0.0.1:{gateway_port}/metrics")
+    except Exception:
+        stop_stack(processes)
+        raise
+    return processes, f"http://127.0.0.1:{gateway_port}"
+
+
+def stop_stack(processes: List[subprocess.Popen]) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--gateway", help="URL of a running gateway; default starts one with a fake Ollama")
+    parser.add_argument("--api-key", default="bench-key")
+    parser.add_argument("--model", default="llama3")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", default="stream=0.5,chat=0.3,embed=0.2")
+    parser.add_argument("--gateway-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="extra environment for the gateway this script starts")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this JSON file and exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    mix = parse_mix(args.mix)
+    profile = profile_from_args(args)
+
+    processes: List[subprocess.Popen] = []
+    gateway = args.gateway
+    if gateway is None:
+        env = dict(item.split("=", 1) for item in args.gateway_env)
+        processes, gateway = start_stack(profile, args.api_key, args.model, env)
+    try:
+        stats = ProcessStats(processes[1].pid) if processes else None
+        if args.warmup > 0:
+            asyncio.run(
+                generate_load(gateway, args.api_key, mix, args.concurrency, args.warmup, model=args.model, seed=1)
+            )
+        cpu_before = stats.cpu_seconds() if stats else 0.0
+        rss_before = stats.rss_bytes() if stats else 0
+        samples, elapsed = asyncio.run(
+            generate_load(gateway, args.api_key, mix, args.concurrency, args.duration, model=args.model)
+        )
+        results = report(samples, elapsed)
+        if stats is not None:
+            cpu = stats.cpu_seconds() - cpu_before
+            rss_after = stats.rss_bytes()
+            results["gateway"] = {
+                "cpu_seconds": round(cpu, 3),
+                "cpu_ms_per_request": round(1000 * cpu / results["requests"], 3) if results["requests"] else 0.0,
+                "rss_start_mb": round(rss_before / 2**20, 1),
+                "rss_end_mb": round(rss_after / 2**20, 1),
+                "rss_growth_mb": round((rss_after - rss_before) / 2**20, 1),
+            }
+    finally:
+        stop_stack(processes)
+
+    results["config"] = {
+        "gateway": args.gateway or "local",
+        "concurrency": args.concurrency,
+        "mix": mix,
+        "profile": vars(profile),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+    }
+    results["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        problems = regressions(results, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            return 1
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
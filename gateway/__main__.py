@@ -0,0 +1,49 @@
+"""
+Command line entry point: ``python -m gateway validate [config.yml]``.
+
+Checks YAML syntax, field types, required fields and model mappings,
+then compiles the keys and tables exactly as a reload would. Exits 1 on
+the first file that fails.
+"""
+
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+from gateway.config import ConfigError, build_snapshot
+from gateway.keys import load_config
+from gateway.policies import POLICIES
+
+
+def validate(path: str) -> int:
+    if not os.path.exists(path):
+        print(f"{path}: not found", file=sys.stderr)
+        return 1
+    try:
+        snapshot = build_snapshot(POLICIES, load_config(path))
+    except ConfigError as e:
+        for error in e.errors:
+            print(f"{path}: {error}", file=sys.stderr)
+        return 1
+    except Exception as e:  # YAML syntax errors and the like
+        print(f"{path}: {e}", file=sys.stderr)
+        return 1
+    print(
+        f"{path}: OK ({len(snapshot.keys)} keys, {len(snapshot.nodes)} nodes, "
+        f"{len(snapshot.models)} models)"
+    )
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m gateway")
+    commands = parser.add_subparsers(dest="command", required=True)
+    check = commands.add_parser("validate", help="check a config.yml without starting the gateway")
+    check.add_argument("path", nargs="?", default=os.getenv("CONFIG_PATH", "config.yml"))
+    args = parser.parse_args(argv)
+    return validate(args.path)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Per-model concurrency admission with weighted fair queueing.
+
+Every (backend, model) pair gets a fixed number of generation slots and
+a bounded wait queue. Requests beyond the slot count wait in the queue
+and are admitted in weighted-fair order across API keys: each key's
+requests are stamped with a virtual finish time of ``1 / weight`` after
+its previous one, so a key flooding the queue only delays itself.
+When the queue is full the request is rejected immediately instead of
+piling up inside Ollama.
+
+Slots default to ``OLLAMA_MODEL_CONCURRENCY`` and can be set per model
+with ``MODEL_CONCURRENCY_<model>`` (``llama3:70b`` -> ``llama3_70b``).
+"""
+
+import asyncio
+import heapq
+import os
+import re
+import time
+from typing import Dict, List, Mapping, Optional, Tuple
+
+
+class AdmissionRejected(Exception):
+    """The request could not be admitted; ``status_code`` says why."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int = 1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def model_env_name(model: str) -> str:
+    return re.sub(r"[^0-9A-Za-z]", "_", model)
+
+
+class Ticket:
+    """An admitted request holding one slot; release it exactly once."""
+
+    __slots__ = ("gate", "wait", "_released")
+
+    def __init__(self, gate: "ModelGate", wait: float):
+        self.gate = gate
+        self.wait = wait
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.gate.release()
+
+
+class ModelGate:
+    """Slots and the fair wait queue for one model on one backend."""
+
+    def __init__(self, slots: int, max_queue: int):
+        self.slots = max(slots, 1)
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._heap: List[Tuple[float, int, float, asyncio.Future]] = []
+        self._seq = 0
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+
+    async def acquire(self, key: str, weight: float = 1.0, timeout: Optional[float] = None) -> Ticket:
+        started = time.monotonic()
+        if self.active < self.slots and not self.waiting:
+            self.active += 1
+            return Ticket(self, 0.0)
+        if self.waiting >= self.max_queue:
+            raise AdmissionRejected("Model queue is full", 429)
+
+        start = max(self._virtual_time, self._last_finish.get(key, 0.0))
+        finish = start + 1.0 / max(weight, 0.01)
+        self._last_finish[key] = finish
+        self._seq += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (finish, self._seq, start, future))
+        self.waiting += 1
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Granted just as we gave up: hand the slot on.
+                self.release()
+            else:
+                future.cancel()
+                self.waiting -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                raise AdmissionRejected("Timed out waiting for a model slot", 503) from e
+            raise
+        return Ticket(self, time.monotonic() - started)
+
+    def release(self) -> None:
+        while self._heap:
+            _, _, start, future = heapq.heappop(self._heap)
+            if future.cancelled():
+                continue
+            # The slot passes straight to the next waiter.
+            self.waiting -= 1
+            self._virtual_time = start
+            future.set_result(None)
+            return
+        self.active -= 1
+        if not self.waiting:
+            self._virtual_time = 0.0
+            self._last_finish.clear()
+
+
+class AdmissionController:
+    """Hands out ``ModelGate`` s per (backend, model)."""
+
+    def __init__(
+        self,
+        default_slots: int = 4,
+        max_queue: int = 64,
+        queue_timeout: Optional[float] = 30.0,
+        model_slots: Optional[Dict[str, int]] = None,
+    ):
+        self.default_slots = default_slots
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.model_slots = model_slots or {}
+        self.gates: Dict[Tuple[str, str], ModelGate] = {}
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "AdmissionController":
+        model_slots = {
+            name[len("MODEL_CONCURRENCY_"):]: int(value)
+            for name, value in env.items()
+            if name.startswith("MODEL_CONCURRENCY_")
+        }
+        timeout = float(env.get("ADMISSION_QUEUE_TIMEOUT", "30"))
+        return cls(
+            default_slots=int(env.get("OLLAMA_MODEL_CONCURRENCY", "4")),
+            max_queue=int(env.get("ADMISSION_QUEUE_SIZE", "64")),
+            queue_timeout=timeout if timeout > 0 else None,
+            model_slots=model_slots,
+        )
+
+    def gate(self, backend: str, model: str) -> ModelGate:
+        gate = self.gates.get((backend, model))
+        if gate is None:
+            slots = self.model_slots.get(model_env_name(model), self.default_slots)
+            gate = self.gates[(backend, model)] = ModelGate(slots, self.max_queue)
+        return gate
+
+    async def acquire(self, backend: str, model: str, key: str, weight: float = 1.0) -> Ticket:
+        return await self.gate(backend, model).acquire(key, weight, self.queue_timeout)
+
+    def snapshot(self) -> List[Dict[str, object]]:
+        return [
+            {"backend": backend, "model": model, "slots": g.slots, "active": g.active, "waiting": g.waiting}
+            for (backend, model), g in self.gates.items()
+        ]
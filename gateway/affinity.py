@@ -0,0 +1,92 @@
+"""
+Prompt-prefix affinity and ``keep_alive`` management.
+
+Ollama only reuses an already evaluated prompt prefix (its KV cache)
+when the next request with that prefix reaches the same runner before
+the model is unloaded. Requests are therefore tagged with a hash of the
+model and the opening every later turn repeats: the leading system
+prompt, or the first turn when there is none. Follow-ups of a
+conversation and requests sharing a system prompt get the same tag, and
+the backend pool keeps each tag on the same node while that node is not
+much busier than the best alternative.
+
+``keep_alive`` is set per model (``KEEP_ALIVE_<model>``, falling back to
+``OLLAMA_KEEP_ALIVE``) or per policy (``keep_alive``), so models with
+long shared prompts stay loaded.
+
+``PrefixStats`` keeps ``prompt_eval_count`` / ``prompt_eval_duration``
+per prefix so reuse can be checked: a reused prefix shows a low
+evaluated-token count compared with the first request.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional
+
+from gateway.admission import model_env_name
+
+def prefix_key(model: str, messages: List[Dict[str, Any]]) -> str:
+    """Hash of the model and the leading system prompt, else the first turn."""
+    digest = hashlib.blake2b(model.encode(), digest_size=12)
+    system = False
+    for message in messages:
+        if message.get("role") != "system" and system:
+            break
+        digest.update(b"\0")
+        digest.update(str(message.get("role", "")).encode())
+        digest.update(b"\0")
+        digest.update(str(message.get("content", "")).encode())
+        if message.get("role") != "system":
+            break
+        system = True
+    return digest.hexdigest()
+
+
+def keep_alive_for(model: str, policy: Mapping[str, Any], env: Mapping[str, str] = os.environ) -> Optional[str]:
+    """The ``keep_alive`` to send for ``model``, or None for Ollama's default."""
+    if policy.get("keep_alive") is not None:
+        return str(policy["keep_alive"])
+    return env.get(f"KEEP_ALIVE_{model_env_name(model)}") or env.get("OLLAMA_KEEP_ALIVE") or None
+
+
+class PrefixStats:
+    """Prompt evaluation counters per prefix, bounded to ``max_prefixes``."""
+
+    def __init__(self, max_prefixes: int = 1000):
+        self.max_prefixes = max_prefixes
+        self._stats: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def record(self, prefix: str, model: str, backend: str, response: Dict[str, Any]) -> None:
+        if "prompt_eval_count" not in response and "prompt_eval_duration" not in response:
+            return
+        entry = self._stats.get(prefix)
+        if entry is None:
+            entry = self._stats[prefix] = {
+                "model": model,
+                "requests": 0,
+                "first_prompt_eval_count": response.get("prompt_eval_count", 0),
+                "prompt_eval_count": 0,
+                "prompt_eval_duration_ms": 0.0,
+                "backends": {},
+            }
+            if len(self._stats) > self.max_prefixes:
+                self._stats.popitem(last=False)
+        else:
+            self._stats.move_to_end(prefix)
+        entry["requests"] += 1
+        entry["prompt_eval_count"] += response.get("prompt_eval_count", 0)
+        entry["prompt_eval_duration_ms"] += response.get("prompt_eval_duration", 0) / 1_000_000
+        entry["backends"][backend] = entry["backends"].get(backend, 0) + 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for prefix, entry in self._stats.items():
+            requests = entry["requests"]
+            result[prefix] = {
+                **entry,
+                "backends": dict(entry["backends"]),
+                "avg_prompt_eval_count": round(entry["prompt_eval_count"] / requests, 1),
+                "avg_prompt_eval_duration_ms": round(entry["prompt_eval_duration_ms"] / requests, 2),
+            }
+        return result
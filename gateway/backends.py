@@ -0,0 +1,270 @@
+"""
+Pool of Ollama nodes with least-outstanding-requests routing.
+
+Nodes come from ``OLLAMA_NODES`` (comma separated, ``host`` or
+``host=weight``) and fall back to the single ``OLLAMA_HOST``. Each node
+tracks its in-flight requests and an exponentially weighted average of
+recent upstream latency; a chat goes to the node with the fewest
+outstanding requests per unit of weight among the nodes that serve the
+requested model.
+
+Nodes also keep a view of which models are resident in memory, from
+the health prober's ``/api/ps`` checks (see ``gateway.health``) and from
+the ``load_duration`` of each response. Routing
+prefers nodes where the model is already warm: a cold node is charged
+``OLLAMA_COLD_PENALTY`` extra in-flight requests. Between equally good
+cold nodes a model always ranks the same nodes first (rendezvous
+hashing), so repeated loads of a model land on one node instead of
+evicting something on every node in turn.
+
+Requests may carry an affinity key (see ``gateway.affinity``). The key's
+rendezvous-preferred node is used as long as its score is within
+``AFFINITY_SLACK`` of the best node, so repeated prompt prefixes reach
+the runner that already has them evaluated.
+
+Nodes that failed their health checks (see ``gateway.health``) or whose
+circuit breaker is open (see ``gateway.resilience``) are skipped while
+any node serving the model is usable.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple
+
+from gateway.resilience import CircuitBreaker
+from gateway.upstream import DEFAULT_OLLAMA_HOST, UpstreamClient, normalize_host
+
+logger = logging.getLogger(__name__)
+
+LATENCY_ALPHA = 0.2
+COLD_PENALTY = float(os.getenv("OLLAMA_COLD_PENALTY", "4"))
+# Ollama reports a few milliseconds of load_duration even for a warm model.
+COLD_LOAD_NS = float(os.getenv("OLLAMA_COLD_LOAD_MS", "500")) * 1_000_000
+AFFINITY_SLACK = float(os.getenv("AFFINITY_SLACK", "2"))
+
+
+class Backend:
+    """One Ollama node and its live routing state."""
+
+    def __init__(self, host: str, weight: float = 1.0, models: Optional[FrozenSet[str]] = None):
+        self.host = normalize_host(host)
+        self.weight = max(float(weight), 0.01)
+        # None means "not known yet": the node is assumed to serve anything.
+        self.models = models
+        self.inflight = 0
+        self.latency: Optional[float] = None
+        self.requests = 0
+        self.errors = 0
+        self.resident: FrozenSet[str] = frozenset()
+        self.cold_loads = 0
+        self.breaker = CircuitBreaker(self.host)
+        # Set by the health prober; nodes are assumed up until probed.
+        self.healthy = True
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models or _base_name(model) in self.models
+
+    def is_resident(self, model: str) -> bool:
+        return model in self.resident or _base_name(model) in self.resident
+
+    def load(self) -> float:
+        return (self.inflight + 1) / self.weight
+
+    def score(self, model: str) -> float:
+        if self.is_resident(model):
+            return self.load()
+        return self.load() + COLD_PENALTY
+
+    def rank(self, model: str) -> int:
+        """Rendezvous hash of ``model`` on this node; lower ranks first."""
+        digest = hashlib.blake2b(f"{model}@{self.host}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def record_response(self, model: str, response: Dict[str, Any]) -> None:
+        """Learn residency from a finished response's ``load_duration``."""
+        if response.get("load_duration", 0) >= COLD_LOAD_NS:
+            self.cold_loads += 1
+        if not self.is_resident(model):
+            self.resident = self.resident | {model}
+
+    def record_latency(self, seconds: float) -> None:
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += LATENCY_ALPHA * (seconds - self.latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "host": self.host,
+            "weight": self.weight,
+            "inflight": self.inflight,
+            "latency_ms": round(self.latency * 1000, 2) if self.latency is not None else None,
+            "requests": self.requests,
+            "errors": self.errors,
+            "models": sorted(self.models) if self.models is not None else None,
+            "resident": sorted(self.resident),
+            "cold_loads": self.cold_loads,
+            "cold_load_rate": round(self.cold_loads / self.requests, 4) if self.requests else 0.0,
+            "healthy": self.healthy,
+            "breaker": self.breaker.snapshot(),
+        }
+
+
+def parse_nodes(entries: Iterable[str]) -> List[Tuple[str, float]]:
+    """``host`` or ``host=weight`` entries, as in ``OLLAMA_NODES``."""
+    nodes = []
+    for entry in entries:
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, weight = entry.partition("=")
+        nodes.append((host, float(weight) if weight else 1.0))
+    return nodes
+
+
+def _base_name(model: str) -> str:
+    """``llama3`` and ``llama3:latest`` name the same Ollama model."""
+    if ":" not in model:
+        return f"{model}:latest"
+    if model.endswith(":latest"):
+        return model[: -len(":latest")]
+    return model
+
+
+class Lease:
+    """An in-flight request on a backend; release it exactly once.
+
+    The first of ``observe`` (a response arrived) and ``release`` reports
+    the outcome to the node's circuit breaker.
+    """
+
+    __slots__ = ("backend", "started", "_released", "_reported")
+
+    def __init__(self, backend: Backend):
+        self.backend = backend
+        self.started = time.monotonic()
+        self._released = False
+        self._reported = False
+        backend.inflight += 1
+        backend.requests += 1
+        backend.breaker.started()
+
+    def observe(self, since: Optional[float] = None) -> None:
+        """Record the time since ``since`` (default: the lease) as upstream latency."""
+        latency = time.monotonic() - (since or self.started)
+        self.backend.record_latency(latency)
+        if not self._reported:
+            self._reported = True
+            self.backend.breaker.record(False, latency)
+
+    def record_response(self, model: str, response: Dict[str, Any]) -> None:
+        self.backend.record_response(model, response)
+
+    def release(self, failed: bool = False) -> None:
+        if self._released:
+            return
+        self._released = True
+        self.backend.inflight -= 1
+        if failed:
+            self.backend.errors += 1
+        if not self._reported:
+            self._reported = True
+            if failed:
+                self.backend.breaker.record(True)
+            else:
+                self.backend.breaker.abandoned()
+
+
+class BackendPool:
+    """Routes requests across a set of Ollama nodes."""
+
+    def __init__(self, backends: List[Backend]):
+        if not backends:
+            raise ValueError("BackendPool needs at least one backend")
+        self.backends = backends
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "BackendPool":
+        nodes = parse_nodes(env.get("OLLAMA_NODES", "").split(","))
+        if not nodes:
+            return cls([Backend(env.get("OLLAMA_HOST", DEFAULT_OLLAMA_HOST))])
+        return cls([Backend(host, weight) for host, weight in nodes])
+
+    def reconfigure(self, nodes: List[Tuple[str, float]]) -> None:
+        """Replace the node list, keeping the live state of nodes that stay.
+
+        Requests already holding a ``Lease`` on a removed node finish on it.
+        """
+        if not nodes:
+            raise ValueError("BackendPool needs at least one backend")
+        current = {b.host: b for b in self.backends}
+        backends = []
+        for host, weight in nodes:
+            backend = current.get(normalize_host(host))
+            if backend is None:
+                backend = Backend(host, weight)
+            else:
+                backend.weight = max(float(weight), 0.01)
+            backends.append(backend)
+        self.backends = backends
+
+    def candidates(self, model: str) -> List[Backend]:
+        serving = [b for b in self.backends if b.serves(model)]
+        # A model nobody reports yet may be pulled on demand; let any node try.
+        serving = serving or self.backends
+        # With every node down or open, trying one beats refusing outright.
+        return [b for b in serving if b.healthy and b.breaker.available()] or serving
+
+    def select(self, model: str, affinity: Optional[str] = None, exclude: Iterable[str] = ()) -> Backend:
+        """Pick the warmest, least loaded node for ``model``.
+
+        With an ``affinity`` key, that key's preferred node wins unless it
+        is more than ``AFFINITY_SLACK`` busier than the best choice. Hosts
+        in ``exclude`` (already tried for this request) are avoided unless
+        no other node is left.
+        """
+        candidates = self.candidates(model)
+        if exclude:
+            candidates = [b for b in candidates if b.host not in exclude] or candidates
+        best = min(
+            candidates,
+            key=lambda b: (
+                b.score(model),
+                (b.latency or 0.0) if b.is_resident(model) else 0.0,
+                len(b.resident),
+                b.rank(model),
+            ),
+        )
+        if affinity is None or len(candidates) == 1:
+            return best
+        preferred = min(candidates, key=lambda b: b.rank(affinity))
+        if preferred.score(model) <= best.score(model) + AFFINITY_SLACK:
+            return preferred
+        return best
+
+    def acquire(self, model: str, affinity: Optional[str] = None, exclude: Iterable[str] = ()) -> Lease:
+        return Lease(self.select(model, affinity, exclude))
+
+    async def refresh_models(self, upstream: UpstreamClient) -> None:
+        """Update each node's model list from ``/api/tags``."""
+
+        async def refresh(backend: Backend) -> None:
+            try:
+                response = await upstream.client.get(upstream.url("/api/tags", backend.host))
+                response.raise_for_status()
+                backend.models = frozenset(m["name"] for m in response.json().get("models", []))
+            except Exception as e:
+                logger.warning(f"Failed to list models on {backend.host}: {e}")
+
+        await asyncio.gather(*(refresh(b) for b in self.backends))
+
+    async def run_refresh(self, upstream: UpstreamClient, interval: float) -> None:
+        while True:
+            await self.refresh_models(upstream)
+            await asyncio.sleep(interval)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [b.snapshot() for b in self.backends]
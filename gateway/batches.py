@@ -0,0 +1,522 @@
+"""
+OpenAI-style Batch API: ``/v1/files`` and ``/v1/batches``.
+
+Uploads are streamed to ``BATCH_DIR`` chunk by chunk. A new batch is
+first validated in a worker thread (every line must be JSON with a
+``custom_id`` and a ``body`` for ``/v1/chat/completions``), then run by
+``BatchManager``: lines are read in order and sent through the
+same dispatch path as interactive chats, at most ``BATCH_CONCURRENCY``
+at once across all batches. Batch requests enter the model queues with
+admission weight ``BATCH_WEIGHT``, so interactive keys are admitted
+first whenever a model is busy; refusals from admission or the token
+budget are retried after their ``retry_after``.
+
+Results are appended in input order: a line's result is written once
+every earlier line has finished, with at most ``BATCH_WINDOW`` lines in
+flight. The checkpoint is therefore three byte offsets (input, output,
+errors), saved every ``BATCH_CHECKPOINT_INTERVAL`` seconds and when the
+gateway stops. After a restart an unfinished batch truncates its output
+files to the checkpoint and carries on from the saved input offset, so
+every line is answered exactly once. Memory stays bounded by the window
+whatever the size of the file.
+
+Input is read and results are written in worker threads: lines are
+read ahead ``READ_AHEAD_BYTES`` at a time, and results are buffered in
+memory and written out with each checkpoint, or sooner once
+``FLUSH_BYTES`` have piled up.
+
+A batch runs under the key that created it, which is stored on disk
+only as its SHA-256 digest. Interactive chats are accounted under the
+same digest, so a key's batch and interactive work share one token
+budget; usage is recorded by key id on both paths.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from collections import deque
+from dataclasses import replace
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Mapping, Optional, Tuple
+
+import httpx
+
+from gateway.admission import AdmissionRejected
+from gateway.keys import Policy
+from gateway.transform import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+ACTIVE = frozenset({"validating", "in_progress", "finalizing", "cancelling"})
+_FILE_ID = re.compile(r"file-[0-9a-f]{24}")
+_BATCH_ID = re.compile(r"batch_[0-9a-f]{24}")
+MAX_REPORTED_ERRORS = 10
+READ_AHEAD_BYTES = 1 << 16
+FLUSH_BYTES = 1 << 20
+
+Dispatch = Callable[[Dict[str, Any], str, Policy], Awaitable[Any]]
+
+
+def _new_id(prefix: str) -> str:
+    return f"{prefix}{uuid.uuid4().hex[:24]}"
+
+
+def _write_json(path: str, data: Mapping[str, Any]) -> None:
+    """Replace ``path`` atomically."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def result_line(custom_id: Any, status_code: int, body: bytes) -> bytes:
+    """One output record, splicing the already-serialized response body."""
+    return b"".join((
+        b'{"id":', dumps(_new_id("batch_req_")),
+        b',"custom_id":', dumps(custom_id),
+        b',"response":{"status_code":', str(status_code).encode(),
+        b',"request_id":', dumps(_new_id("req_")),
+        b',"body":', body,
+        b'},"error":null}\n',
+    ))
+
+
+def error_line(custom_id: Any, code: str, message: str) -> bytes:
+    record = {
+        "id": _new_id("batch_req_"),
+        "custom_id": custom_id,
+        "response": None,
+        "error": {"code": code, "message": message},
+    }
+    return dumps(record) + b"\n"
+
+
+def check_request(request: Any) -> Optional[str]:
+    """Why a parsed input line is unusable, or None."""
+    if not isinstance(request, dict):
+        return "line is not a JSON object"
+    if not isinstance(request.get("custom_id"), str):
+        return "missing custom_id"
+    if request.get("url", BATCH_ENDPOINT) != BATCH_ENDPOINT:
+        return f"url must be {BATCH_ENDPOINT}"
+    body = request.get("body")
+    if not isinstance(body, dict) or not isinstance(body.get("messages"), list):
+        return "body must be a chat completion request with messages"
+    return None
+
+
+def validate_input(path: str) -> Tuple[int, List[Dict[str, Any]]]:
+    """Count the requests in an input file and report bad lines; streams the file."""
+    total = 0
+    errors: List[Dict[str, Any]] = []
+    with open(path, "rb") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            total += 1
+            try:
+                problem = check_request(loads(line))
+            except ValueError:
+                problem = "invalid JSON"
+            if problem and len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"code": "invalid_request", "line": number, "message": problem})
+    return total, errors
+
+
+class FileStore:
+    """Uploaded and generated JSONL files with a small JSON sidecar each."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, file_id: str) -> str:
+        if not _FILE_ID.fullmatch(file_id):
+            raise KeyError(file_id)
+        return os.path.join(self.root, f"{file_id}.jsonl")
+
+    def meta(self, file_id: str) -> Optional[Dict[str, Any]]:
+        if not _FILE_ID.fullmatch(file_id):
+            return None
+        return _read_json(os.path.join(self.root, f"{file_id}.json"))
+
+    def publish(self, file_id: str, filename: str, purpose: str, owner: str) -> Dict[str, Any]:
+        meta = {
+            "id": file_id,
+            "object": "file",
+            "bytes": os.path.getsize(self.path(file_id)),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "owner": owner,
+        }
+        _write_json(os.path.join(self.root, f"{file_id}.json"), meta)
+        return meta
+
+    async def save(self, chunks: AsyncIterator[bytes], filename: str, purpose: str, owner: str) -> Dict[str, Any]:
+        """Stream an upload to disk without holding it in memory."""
+        os.makedirs(self.root, exist_ok=True)
+        file_id = _new_id("file-")
+        f = await asyncio.to_thread(open, self.path(file_id), "wb")
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    await asyncio.to_thread(f.write, chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+        return await asyncio.to_thread(self.publish, file_id, filename, purpose, owner)
+
+
+class BatchJob:
+    """One batch: its OpenAI-visible object plus the resume checkpoint."""
+
+    def __init__(self, batch: Dict[str, Any], owner: str, checkpoint: Optional[Dict[str, int]] = None):
+        self.batch = batch
+        self.owner = owner
+        self.checkpoint = checkpoint or {"input": 0, "output": 0, "errors": 0}
+        self.task: Optional[asyncio.Task] = None
+        self.started = time.monotonic()
+        self.done_this_run = 0
+
+    @property
+    def id(self) -> str:
+        return self.batch["id"]
+
+    def view(self) -> Dict[str, Any]:
+        """The batch object, plus progress, throughput and ETA."""
+        counts = self.batch["request_counts"]
+        finished = counts["completed"] + counts["failed"]
+        elapsed = time.monotonic() - self.started
+        rate = self.done_this_run / elapsed if self.done_this_run and elapsed > 0 else 0.0
+        eta = (counts["total"] - finished) / rate if rate else None
+        return {
+            **self.batch,
+            "progress": {
+                "percent": round(100.0 * finished / counts["total"], 1) if counts["total"] else 0.0,
+                "requests_per_sec": round(rate, 2),
+                "eta_seconds": round(eta, 1) if eta is not None and self.batch["status"] == "in_progress" else None,
+            },
+        }
+
+    def state(self) -> Dict[str, Any]:
+        return {"batch": self.batch, "owner": self.owner, "checkpoint": dict(self.checkpoint)}
+
+
+class BatchManager:
+    """Runs batches through ``dispatch`` with a shared bound on concurrency."""
+
+    def __init__(
+        self,
+        root: str,
+        dispatch: Dispatch,
+        lookup: Callable[[bytes], Optional[Policy]],
+        concurrency: int = 4,
+        window: Optional[int] = None,
+        weight: float = 0.1,
+        checkpoint_interval: float = 1.0,
+        max_retries: int = 10,
+    ):
+        self.root = root
+        self.files = FileStore(os.path.join(root, "files"))
+        self.dispatch = dispatch
+        self.lookup = lookup
+        self.concurrency = concurrency
+        self.window = window or concurrency * 8
+        self.weight = weight
+        self.checkpoint_interval = checkpoint_interval
+        self.max_retries = max_retries
+        self.jobs: Dict[str, BatchJob] = {}
+        self._slots = asyncio.Semaphore(concurrency)
+
+    @classmethod
+    def from_env(
+        cls,
+        dispatch: Dispatch,
+        lookup: Callable[[bytes], Optional[Policy]],
+        env: Mapping[str, str] = os.environ,
+    ) -> "BatchManager":
+        concurrency = int(env.get("BATCH_CONCURRENCY", "4"))
+        return cls(
+            env.get("BATCH_DIR", "data/batches"),
+            dispatch,
+            lookup,
+            concurrency,
+            int(env.get("BATCH_WINDOW", "0")) or None,
+            float(env.get("BATCH_WEIGHT", "0.1")),
+            float(env.get("BATCH_CHECKPOINT_INTERVAL", "1")),
+            int(env.get("BATCH_MAX_RETRIES", "10")),
+        )
+
+    def _state_path(self, batch_id: str) -> str:
+        return os.path.join(self.root, f"{batch_id}.json")
+
+    def _save(self, job: BatchJob) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        _write_json(self._state_path(job.id), job.state())
+
+    def get(self, batch_id: str, owner: str) -> Optional[BatchJob]:
+        job = self.jobs.get(batch_id)
+        return job if job is not None and job.owner == owner else None
+
+    def list(self, owner: str, limit: int = 20) -> List[BatchJob]:
+        jobs = [job for job in self.jobs.values() if job.owner == owner]
+        jobs.sort(key=lambda job: job.batch["created_at"], reverse=True)
+        return jobs[:limit]
+
+    async def start(self) -> None:
+        """Load saved batches and resume the unfinished ones."""
+        for state in await asyncio.to_thread(self._load_states):
+            job = BatchJob(state["batch"], state["owner"], state["checkpoint"])
+            self.jobs[job.id] = job
+            if job.batch["status"] in ACTIVE:
+                logger.info(f"Resuming batch {job.id} at input offset {job.checkpoint['input']}")
+                self._spawn(job)
+
+    def _load_states(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.root):
+            return []
+        states = []
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith(".json") and _BATCH_ID.fullmatch(name[:-5]):
+                state = _read_json(os.path.join(self.root, name))
+                if state is not None:
+                    states.append(state)
+        return states
+
+    async def create(
+        self,
+        input_file_id: str,
+        owner: str,
+        endpoint: str = BATCH_ENDPOINT,
+        completion_window: str = "24h",
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> BatchJob:
+        if endpoint != BATCH_ENDPOINT:
+            raise ValueError(f"Only {BATCH_ENDPOINT} is supported")
+        meta = self.files.meta(input_file_id)
+        if meta is None or meta.get("owner") != owner:
+            raise ValueError(f"No such file: {input_file_id}")
+        batch = {
+            "id": _new_id("batch_"),
+            "object": "batch",
+            "endpoint": endpoint,
+            "errors": None,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "in_progress_at": None,
+            "finalizing_at": None,
+            "completed_at": None,
+            "failed_at": None,
+            "cancelling_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": metadata,
+        }
+        job = BatchJob(batch, owner)
+        self.jobs[job.id] = job
+        await asyncio.to_thread(self._save, job)
+        self._spawn(job)
+        return job
+
+    async def cancel(self, job: BatchJob) -> BatchJob:
+        """Stop feeding new lines; requests already running still finish."""
+        if job.batch["status"] in ACTIVE and job.batch["status"] != "cancelling":
+            job.batch["status"] = "cancelling"
+            job.batch["cancelling_at"] = int(time.time())
+            await asyncio.to_thread(self._save, job)
+        return job
+
+    def _spawn(self, job: BatchJob) -> None:
+        job.task = asyncio.create_task(self._run(job))
+
+    async def close(self) -> None:
+        """Stop all batches at their last checkpoint; they resume on start."""
+        tasks = [job.task for job in self.jobs.values() if job.task is not None and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: BatchJob) -> None:
+        batch = job.batch
+        try:
+            if batch["status"] == "validating":
+                total, errors = await asyncio.to_thread(validate_input, self.files.path(batch["input_file_id"]))
+                if errors or not total:
+                    errors = errors or [{"code": "empty_file", "line": None, "message": "no requests in file"}]
+                    self._finish(job, "failed", {"object": "list", "data": errors})
+                    return
+                batch["request_counts"]["total"] = total
+                if batch["status"] == "cancelling":
+                    self._finish(job, "cancelled")
+                    return
+                batch["status"] = "in_progress"
+                batch["in_progress_at"] = int(time.time())
+                batch["output_file_id"] = _new_id("file-")
+                batch["error_file_id"] = _new_id("file-")
+                await asyncio.to_thread(self._save, job)
+            await self._process(job)
+            batch["finalizing_at"] = int(time.time())
+            await asyncio.to_thread(self._publish_outputs, job)
+            self._finish(job, "cancelled" if batch["status"] == "cancelling" else "completed")
+        except Exception as e:
+            logger.error(f"Batch {job.id} failed: {e}")
+            error = {"code": "batch_failed", "line": None, "message": str(e)}
+            self._finish(job, "failed", {"object": "list", "data": [error]})
+
+    def _finish(self, job: BatchJob, status: str, errors: Optional[Dict[str, Any]] = None) -> None:
+        job.batch["status"] = status
+        job.batch[f"{status}_at"] = int(time.time())
+        if errors is not None:
+            job.batch["errors"] = errors
+        self._save(job)
+        logger.info(f"Batch {job.id} {status}: {job.batch['request_counts']}")
+
+    def _publish_outputs(self, job: BatchJob) -> None:
+        for file_id, name in ((job.batch["output_file_id"], "output"), (job.batch["error_file_id"], "errors")):
+            self.files.publish(file_id, f"{job.id}_{name}.jsonl", "batch_output", job.owner)
+
+    def _open_outputs(self, job: BatchJob) -> Tuple[Any, Any, Any]:
+        os.makedirs(self.files.root, exist_ok=True)
+        handles = []
+        for file_id, offset in ((job.batch["output_file_id"], job.checkpoint["output"]),
+                                (job.batch["error_file_id"], job.checkpoint["errors"])):
+            path = self.files.path(file_id)
+            with open(path, "ab") as f:
+                # Drop results written after the last checkpoint; they are redone.
+                f.truncate(offset)
+            handles.append(open(path, "ab"))
+        source = open(self.files.path(job.batch["input_file_id"]), "rb")
+        source.seek(job.checkpoint["input"])
+        return source, handles[0], handles[1]
+
+    def _checkpoint(
+        self, job: BatchJob, out: Any, err: Any, state: Dict[str, Any], records: Tuple[bytes, bytes] = (b"", b"")
+    ) -> None:
+        """Append buffered results, sync them and then save ``state``, which covers them."""
+        for f, data in zip((out, err), records):
+            if data:
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.makedirs(self.root, exist_ok=True)
+        _write_json(self._state_path(job.id), state)
+
+    async def _process(self, job: BatchJob) -> None:
+        policy = self.lookup(bytes.fromhex(job.owner))
+        if policy is None:
+            raise RuntimeError("the API key that created this batch is no longer valid")
+        policy = replace(policy, weight=self.weight)
+        source, out, err = await asyncio.to_thread(self._open_outputs, job)
+        pending: Deque[Tuple[int, Optional[asyncio.Task]]] = deque()
+        lines: Deque[bytes] = deque()
+        # Committed results not yet written: output records, error records.
+        buffered: Tuple[List[bytes], List[bytes]] = ([], [])
+        size = 0
+        offset = job.checkpoint["input"]
+        saved = time.monotonic()
+        job.started, job.done_this_run = time.monotonic(), 0
+
+        async def commit_head() -> None:
+            nonlocal size
+            end, task = pending[0]
+            if task is not None:
+                ok, record = await task
+                buffered[0 if ok else 1].append(record)
+                size += len(record)
+                job.checkpoint["output" if ok else "errors"] += len(record)
+                job.batch["request_counts"]["completed" if ok else "failed"] += 1
+                job.done_this_run += 1
+            pending.popleft()
+            job.checkpoint["input"] = end
+
+        def take() -> Tuple[bytes, bytes]:
+            nonlocal size
+            records = (b"".join(buffered[0]), b"".join(buffered[1]))
+            buffered[0].clear()
+            buffered[1].clear()
+            size = 0
+            return records
+
+        async def save() -> None:
+            # The state is captured together with the records it covers.
+            await asyncio.to_thread(self._checkpoint, job, out, err, job.state(), take())
+
+        try:
+            while job.batch["status"] == "in_progress":
+                if not lines:
+                    lines.extend(await asyncio.to_thread(source.readlines, READ_AHEAD_BYTES))
+                    if not lines:
+                        break
+                line = lines.popleft()
+                offset += len(line)
+                while len(pending) >= self.window:
+                    await commit_head()
+                if line.strip():
+                    pending.append((offset, asyncio.create_task(self._execute(line, policy, job.owner))))
+                else:
+                    pending.append((offset, None))
+                while pending and (pending[0][1] is None or pending[0][1].done()):
+                    await commit_head()
+                if size >= FLUSH_BYTES or time.monotonic() - saved >= self.checkpoint_interval:
+                    await save()
+                    saved = time.monotonic()
+            while pending:
+                await commit_head()
+        finally:
+            for _, task in pending:
+                if task is not None:
+                    task.cancel()
+            try:
+                # Only committed results are covered by the checkpoint.
+                await asyncio.to_thread(self._checkpoint, job, out, err, job.state(), take())
+            finally:
+                for f in (source, out, err):
+                    f.close()
+
+    async def _execute(self, line: bytes, policy: Policy, key: str) -> Tuple[bool, bytes]:
+        """Run one input line; (True, output record) or (False, error record)."""
+        try:
+            request = loads(line)
+        except ValueError:
+            return False, error_line(None, "invalid_request", "invalid JSON")
+        problem = check_request(request)
+        if problem:
+            custom_id = request.get("custom_id") if isinstance(request, dict) else None
+            return False, error_line(custom_id, "invalid_request", problem)
+        custom_id = request["custom_id"]
+        payload = policy.ollama_payload({**request["body"], "stream": False})
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._slots:
+                    response = await self.dispatch(payload, key, policy)
+                break
+            except AdmissionRejected as e:
+                if attempt == self.max_retries:
+                    return False, error_line(custom_id, "rate_limit_exceeded", str(e))
+                await asyncio.sleep(e.retry_after)
+            except httpx.HTTPStatusError as e:
+                status_code = e.response.status_code
+                body = dumps({"error": {"message": str(e), "type": "api_error", "code": status_code}})
+                return False, result_line(custom_id, status_code, body)
+            except Exception as e:
+                return False, error_line(custom_id, "upstream_error", str(e) or type(e).__name__)
+        if response.status_code != 200:
+            return False, result_line(custom_id, response.status_code, response.body)
+        return True, result_line(custom_id, 200, response.body)
@@ -0,0 +1,175 @@
+"""
+Exact-match response cache for deterministic chat completions.
+
+Responses are keyed on a SHA-256 of the canonical JSON of everything that
+determines the output: model, the effective messages (including the
+policy's system prompt) and the options (temperature, ``num_predict``
+from ``max_tokens``, seed). Only deterministic requests are cached
+(temperature 0 or a fixed seed) unless the caller opts in with
+``X-Gateway-Cache: use``.
+
+The in-memory tier is an LRU bounded by the bytes of the stored bodies.
+An optional SQLite file (``CACHE_DISK_PATH``) keeps entries across
+restarts; disk reads and writes run in a worker thread.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(ollama_payload: Dict[str, Any]) -> str:
+    canonical = json.dumps(
+        {
+            "model": ollama_payload["model"],
+            "messages": ollama_payload["messages"],
+            "options": ollama_payload.get("options", {}),
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def is_deterministic(options: Dict[str, Any]) -> bool:
+    return options.get("temperature") == 0 or options.get("seed") is not None
+
+
+class DiskCache:
+    """SQLite-backed second tier; trims the oldest rows past ``max_bytes``."""
+
+    def __init__(self, path: str, max_bytes: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, body BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)"
+        )
+        self._db.commit()
+        self.bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._db.execute("SELECT body FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return bytes(row[0])
+
+    def put(self, key: str, body: bytes) -> None:
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, body, size, used) VALUES (?, ?, ?, ?)",
+                (key, body, len(body), time.time()),
+            )
+            self.bytes += len(body) - (old[0] if old else 0)
+            while self.bytes > self.max_bytes:
+                row = self._db.execute(
+                    "SELECT key, size FROM responses ORDER BY used LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    break
+                self._db.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+                self.bytes -= row[1]
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache:
+    """Byte-bounded LRU in memory, optionally backed by a ``DiskCache``."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, disk: Optional[DiskCache] = None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.bytes = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "ResponseCache":
+        disk_path = env.get("CACHE_DISK_PATH")
+        disk = None
+        if disk_path:
+            disk = DiskCache(disk_path, int(env.get("CACHE_DISK_MAX_BYTES", str(1024 ** 3))))
+        return cls(int(env.get("CACHE_MAX_BYTES", str(64 * 1024 * 1024))), disk)
+
+    def get_memory(self, key: str) -> Optional[bytes]:
+        body = self._entries.get(key)
+        if body is not None:
+            self._entries.move_to_end(key)
+        return body
+
+    async def get(self, key: str) -> Optional[bytes]:
+        body = self.get_memory(key)
+        if body is not None:
+            self.hits += 1
+            return body
+        if self.disk is not None:
+            body = await asyncio.to_thread(self.disk.get, key)
+            if body is not None:
+                self.disk_hits += 1
+                self._store(key, body)
+                return body
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, body: bytes) -> None:
+        self._store(key, body)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.put, key, body)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to write response cache to disk: {e}")
+
+    def _store(self, key: str, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old)
+        self._entries[key] = body
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "disk_bytes": self.disk.bytes if self.disk is not None else None,
+        }
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
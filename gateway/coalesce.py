@@ -0,0 +1,141 @@
+"""
+Single-flight coalescing of identical in-flight chat requests.
+
+When a deterministic request arrives while an identical one is already
+being generated, it attaches to that generation instead of starting its
+own. Non-streaming followers get a copy of the leader's response.
+Streaming followers subscribe to a shared stream that records every SSE
+frame, so each of them receives the full chunk sequence from the start.
+
+The upstream work runs in its own task: it survives the leader
+disconnecting as long as someone is still waiting for it, and it is
+cancelled (closing the upstream request) once nobody is.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from starlette.responses import Response
+
+from gateway.streaming import SSEResponse
+
+
+class SharedStream:
+    """Fans one SSE frame iterator out to any number of subscribers."""
+
+    def __init__(self, response: SSEResponse):
+        self.response = response
+        self.frames: List[bytes] = []
+        self.done = False
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._pump: Optional[asyncio.Task] = None
+
+    def start(self, on_finish: Callable[[], Any]) -> None:
+        self._pump = asyncio.create_task(self._run(on_finish))
+
+    async def _run(self, on_finish: Callable[[], Any]) -> None:
+        iterator = self.response.body_iterator
+        try:
+            async for frame in iterator:
+                self.frames.append(frame if isinstance(frame, bytes) else frame.encode())
+                self._notify()
+        finally:
+            self.done = True
+            self._notify()
+            on_finish()
+            await iterator.aclose()
+            if self.response.on_close is not None:
+                await self.response.on_close()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[bytes]:
+        position = 0
+        while True:
+            while position < len(self.frames):
+                yield self.frames[position]
+                position += 1
+            if self.done:
+                return
+            await self._changed.wait()
+
+    def response_for_subscriber(self) -> SSEResponse:
+        self.subscribers += 1
+        headers = {
+            k: v for k, v in self.response.headers.items()
+            if k.lower() not in ("content-length", "content-type")
+        }
+        return SSEResponse(self.subscribe(), on_close=self._unsubscribe, headers=headers)
+
+    async def _unsubscribe(self) -> None:
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done and self._pump is not None:
+            self._pump.cancel()
+
+
+class Coalescer:
+    """Tracks in-flight work by key and shares it with identical requests."""
+
+    def __init__(self):
+        self._flights: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self._streams: Dict[str, SharedStream] = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, start: Callable[[], Awaitable[Any]]) -> Any:
+        """Run ``start()`` once per key at a time and share its result."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(start())
+            self._flights[key] = flight
+            self._waiters[key] = 0
+            flight.add_done_callback(lambda _: self._finish(key, flight))
+        else:
+            self.coalesced += 1
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(flight)
+        except asyncio.CancelledError:
+            if not flight.done() and self._waiters.get(key) == 1:
+                flight.cancel()
+            raise
+        finally:
+            if self._flights.get(key) is flight:
+                self._waiters[key] -= 1
+
+    def _finish(self, key: str, flight: asyncio.Future) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+            del self._waiters[key]
+        if not flight.cancelled():
+            flight.exception()  # retrieved here; every waiter re-raises it
+
+    async def response(self, key: str, start: Callable[[], Awaitable[Response]]) -> Response:
+        """Like ``do`` for handlers returning responses.
+
+        Every caller gets its own ``Response``: a copy of the body for
+        plain responses, or a subscription for streaming ones. A stream
+        stays joinable until its last frame.
+        """
+        shared = self._streams.get(key)
+        if shared is not None:
+            self.coalesced += 1
+            return shared.response_for_subscriber()
+
+        async def start_shared() -> Any:
+            response = await start()
+            if isinstance(response, SSEResponse):
+                shared = SharedStream(response)
+                self._streams[key] = shared
+                shared.start(lambda: self._streams.pop(key, None))
+                return shared
+            return response
+
+        result = await self.do(key, start_shared)
+        if isinstance(result, SharedStream):
+            return result.response_for_subscriber()
+        headers = {k: v for k, v in result.headers.items() if k.lower() != "content-length"}
+        return Response(result.body, status_code=result.status_code, headers=headers)
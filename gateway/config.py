@@ -0,0 +1,349 @@
+"""
+``config.yml`` validation and hot reload.
+
+``build_snapshot`` turns the file (``CONFIG_PATH``) plus the environment
+into a ``Snapshot``: the compiled ``KeyIndex`` with ``models`` aliases
+resolved into each policy, the Ollama nodes, and the request and token
+limits and the health check interval. Environment variables win over
+the file, as documented: ``OLLAMA_NODES``/``OLLAMA_HOST`` over
+``ollama.nodes``/``ollama.host``, ``HEALTHCHECK_INTERVAL`` over
+``ollama.healthcheck_interval``,
+``RATE_LIMIT_REQUESTS`` over ``rate_limit.requestsperminute`` and
+``TOKENS_PER_MINUTE`` over ``rate_limit.tokensperminute``. With
+``rate_limit.enabled: false`` and neither variable set, requests and
+tokens are not limited at all.
+
+``ConfigManager`` rebuilds the snapshot in a worker thread when the file
+changes or the process receives SIGHUP, then applies it on the event
+loop without awaiting in between, so a request sees either the old
+tables or the new ones, never a mix. Requests already running keep the
+``Policy`` and ``Backend`` they resolved. The rate limiter and token
+budget are updated in place: state for keys that are still configured
+carries over, state for removed keys is dropped. A file that fails
+validation is logged and the previous snapshot stays in force.
+
+Settings read once at startup (``server``, ``ollama.timeout``,
+``logging``) still need a restart.
+
+``python -m gateway validate [path]`` runs the same checks offline.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from gateway.backends import BackendPool, parse_nodes
+from gateway.keys import KeyIndex, KeyRegistry, ModelRoute, build_index, load_config, model_routes
+
+logger = logging.getLogger(__name__)
+
+_NUMBER = (int, float)
+
+# section -> field -> accepted types; ``None`` means any mapping.
+SCHEMA: Dict[str, Optional[Dict[str, Any]]] = {
+    "server": {"host": str, "port": int, "request_timeout": _NUMBER, "maxrequestsize": (str, int)},
+    "ollama": {"host": str, "nodes": list, "timeout": _NUMBER, "healthcheck_interval": _NUMBER},
+    "auth": {"enabled": bool, "keys": list},
+    "rate_limit": {"enabled": bool, "requestsperminute": int, "tokensperminute": int},
+    "models": None,
+    "logging": {"level": str, "format": str, "file": str, "audit": dict},
+    "cors": {"enabled": bool, "origins": list},
+}
+KEY_FIELDS = {
+    "id": str, "key": str, "key_sha256": str, "scopes": list, "model": str, "temperature": _NUMBER,
+    "system_prompt": str, "weight": _NUMBER, "keep_alive": (str, int), "rate_limit": int,
+    "tokens_per_minute": int, "max_tokens": int, "semantic_cache": (bool, dict),
+}
+MODEL_FIELDS = {"model": str, "version": (str, _NUMBER), "max_tokens": int}
+SEMANTIC_CACHE_FIELDS = {"threshold": _NUMBER, "ttl": _NUMBER}
+
+
+class ConfigError(ValueError):
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def _type_name(types: Any) -> str:
+    types = types if isinstance(types, tuple) else (types,)
+    flat = [t for group in types for t in (group if isinstance(group, tuple) else (group,))]
+    return " or ".join(sorted({t.__name__ for t in flat}))
+
+
+def _check_fields(where: str, values: Any, fields: Mapping[str, Any], errors: List[str]) -> bool:
+    if not isinstance(values, Mapping):
+        errors.append(f"{where}: expected a mapping")
+        return False
+    for name, value in values.items():
+        if name not in fields:
+            errors.append(f"{where}.{name}: unknown field")
+            continue
+        types = fields[name]
+        # bool is an int subclass; only accept it where bool is meant.
+        accepted = types if isinstance(types, tuple) else (types,)
+        if value is not None and (
+            not isinstance(value, types) or (isinstance(value, bool) and bool not in accepted)
+        ):
+            errors.append(f"{where}.{name}: expected {_type_name(types)}, got {type(value).__name__}")
+    return True
+
+
+def validate_config(config: Any) -> List[str]:
+    """Every problem found in a parsed ``config.yml``; empty when valid."""
+    if config is None:
+        return []
+    if not isinstance(config, Mapping):
+        return ["config: expected a mapping"]
+    errors: List[str] = []
+    for section, values in config.items():
+        if section not in SCHEMA:
+            errors.append(f"{section}: unknown section")
+        elif SCHEMA[section] is not None and values is not None:
+            _check_fields(section, values, SCHEMA[section], errors)
+
+    for name in ("requestsperminute", "tokensperminute"):
+        value = (config.get("rate_limit") or {}).get(name)
+        if isinstance(value, int) and value < 0:
+            errors.append(f"rate_limit.{name}: must not be negative")
+
+    interval = (config.get("ollama") or {}).get("healthcheck_interval")
+    if isinstance(interval, _NUMBER) and not isinstance(interval, bool) and interval <= 0:
+        errors.append("ollama.healthcheck_interval: must be positive")
+
+    nodes = (config.get("ollama") or {}).get("nodes")
+    if isinstance(nodes, list):
+        try:
+            parse_nodes(str(node) for node in nodes)
+        except ValueError as e:
+            errors.append(f"ollama.nodes: {e}")
+
+    models = config.get("models") or {}
+    if not isinstance(models, Mapping):
+        errors.append("models: expected a mapping")
+        models = {}
+    for alias, spec in models.items():
+        where = f"models.{alias}"
+        if not _check_fields(where, spec, MODEL_FIELDS, errors):
+            continue
+        if not spec.get("model"):
+            errors.append(f"{where}.model: required")
+        elif ":" in str(spec["model"]) and spec.get("version") is not None:
+            errors.append(f"{where}: 'model' already has a tag, drop 'version'")
+        if isinstance(spec.get("max_tokens"), int) and spec["max_tokens"] <= 0:
+            errors.append(f"{where}.max_tokens: must be positive")
+
+    keys = (config.get("auth") or {}).get("keys") or []
+    seen_ids, seen_keys = set(), set()
+    for i, spec in enumerate(keys if isinstance(keys, list) else []):
+        where = f"auth.keys[{i}]"
+        if not _check_fields(where, spec, KEY_FIELDS, errors):
+            continue
+        secret = spec.get("key") or spec.get("key_sha256")
+        if not secret:
+            errors.append(f"{where}: needs 'key' or 'key_sha256'")
+        elif spec.get("key_sha256") is not None:
+            digest = str(spec["key_sha256"])
+            if len(digest) != 64 or any(c not in "0123456789abcdefABCDEF" for c in digest):
+                errors.append(f"{where}.key_sha256: expected 64 hex characters")
+        if secret and secret in seen_keys:
+            errors.append(f"{where}: duplicate key")
+        seen_keys.add(secret)
+        semantic = spec.get("semantic_cache")
+        if isinstance(semantic, Mapping):
+            _check_fields(f"{where}.semantic_cache", semantic, SEMANTIC_CACHE_FIELDS, errors)
+            threshold = semantic.get("threshold")
+            if isinstance(threshold, _NUMBER) and not 0 < threshold <= 1:
+                errors.append(f"{where}.semantic_cache.threshold: must be in (0, 1]")
+        if spec.get("id") is not None and spec["id"] in seen_ids:
+            errors.append(f"{where}.id: duplicate id '{spec['id']}'")
+        seen_ids.add(spec.get("id"))
+    return errors
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """Everything built from one version of ``config.yml``."""
+
+    keys: KeyIndex
+    nodes: Tuple[Tuple[str, float], ...]
+    # None when ``rate_limit.enabled`` is false: requests are not limited.
+    max_requests: Optional[int]
+    tokens_per_minute: int
+    models: Mapping[str, ModelRoute]
+    loaded_at: float
+    healthcheck_interval: Optional[float] = None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "loaded_at": self.loaded_at,
+            "keys": len(self.keys),
+            "nodes": [{"host": host, "weight": weight} for host, weight in self.nodes],
+            "max_requests": self.max_requests,
+            "tokens_per_minute": self.tokens_per_minute,
+            "models": {alias: route.model for alias, route in self.models.items()},
+            "healthcheck_interval": self.healthcheck_interval,
+        }
+
+
+def _nodes(config: Mapping[str, Any], env: Mapping[str, str]) -> Tuple[Tuple[str, float], ...]:
+    ollama = config.get("ollama") or {}
+    nodes = parse_nodes(env.get("OLLAMA_NODES", "").split(","))
+    if not nodes and env.get("OLLAMA_HOST"):
+        nodes = [(env["OLLAMA_HOST"], 1.0)]
+    if not nodes:
+        nodes = parse_nodes(str(node) for node in ollama.get("nodes") or [])
+    if not nodes and ollama.get("host"):
+        nodes = [(ollama["host"], 1.0)]
+    return tuple(nodes)
+
+
+def build_snapshot(
+    policies: Mapping[str, Mapping[str, Any]],
+    config: Mapping[str, Any],
+    env: Mapping[str, str] = os.environ,
+) -> Snapshot:
+    """Validate and compile ``config``; raises ``ConfigError``."""
+    errors = validate_config(config)
+    if errors:
+        raise ConfigError(errors)
+    config = config or {}
+    limits = config.get("rate_limit") or {}
+    enabled = limits.get("enabled", True) is not False
+    window = float(env.get("RATE_LIMIT_WINDOW_SECONDS", "60"))
+    if env.get("RATE_LIMIT_REQUESTS"):
+        max_requests = int(env["RATE_LIMIT_REQUESTS"])
+    elif not enabled:
+        max_requests = None
+    elif limits.get("requestsperminute"):
+        max_requests = max(1, round(limits["requestsperminute"] * window / 60))
+    else:
+        max_requests = 60
+    if env.get("TOKENS_PER_MINUTE"):
+        tokens_per_minute = int(env["TOKENS_PER_MINUTE"])
+    else:
+        tokens_per_minute = int(limits.get("tokensperminute") or 0) if enabled else 0
+    try:
+        index = build_index(policies, config, env)
+        nodes = _nodes(config, env)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ConfigError([str(e)]) from e
+    interval = (config.get("ollama") or {}).get("healthcheck_interval")
+    return Snapshot(
+        index, nodes, max_requests, tokens_per_minute, model_routes(config), time.time(),
+        float(interval) if interval else None,
+    )
+
+
+class ConfigManager:
+    """Rebuilds the snapshot on change and swaps it into the live objects."""
+
+    def __init__(
+        self,
+        keys: KeyRegistry,
+        pool: BackendPool,
+        rate_limiter: Any,
+        token_budget: Any,
+        env: Mapping[str, str] = os.environ,
+        health: Any = None,
+    ):
+        self.keys = keys
+        self.pool = pool
+        self.rate_limiter = rate_limiter
+        self.token_budget = token_budget
+        self.env = env
+        self.health = health
+        self.path = keys.config_path
+        self.snapshot: Optional[Snapshot] = None
+        self.reloads = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self._mtime = self._config_mtime()
+        self._lock = asyncio.Lock()
+
+    def _config_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime if self.path else None
+        except OSError:
+            return None
+
+    def build(self) -> Tuple[Snapshot, List[str]]:
+        """Build the next snapshot and list the keys it no longer knows."""
+        snapshot = build_snapshot(self.keys.policies, load_config(self.path), self.env)
+        # Limiter and budget state is kept per key digest (hex), shared by chats and batches.
+        tracked = {*self.rate_limiter.tracked(), *self.token_budget.tracked()}
+        stale = [digest for digest in tracked if snapshot.keys.lookup_digest(bytes.fromhex(digest)) is None]
+        return snapshot, stale
+
+    def apply(self, snapshot: Snapshot, stale: List[str] = ()) -> None:
+        """Swap ``snapshot`` in; must run on the event loop, without awaits."""
+        self.keys.index = snapshot.keys
+        if snapshot.nodes:
+            self.pool.reconfigure(list(snapshot.nodes))
+        self.rate_limiter.max_requests = snapshot.max_requests
+        self.token_budget.tokens_per_minute = snapshot.tokens_per_minute
+        if self.health is not None:
+            self.health.configure(snapshot.healthcheck_interval)
+        self.rate_limiter.forget(stale)
+        self.token_budget.forget(stale)
+        self.snapshot = snapshot
+
+    async def reload(self) -> Snapshot:
+        """Rebuild off the loop and apply; raises ``ConfigError`` and keeps the old tables."""
+        async with self._lock:
+            self._mtime = self._config_mtime()
+            try:
+                snapshot, stale = await asyncio.to_thread(self.build)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                raise
+            self.apply(snapshot, stale)
+            self.reloads += 1
+            self.last_error = None
+        logger.info(
+            f"Loaded {self.path or 'environment'}: {len(snapshot.keys)} keys, "
+            f"{len(snapshot.nodes)} nodes, {len(snapshot.models)} models"
+        )
+        return snapshot
+
+    async def _reload_logged(self) -> None:
+        try:
+            await self.reload()
+        except Exception as e:
+            logger.error(f"Keeping previous configuration, reload failed: {e}")
+
+    async def run(self, interval: float = 5.0) -> None:
+        """Reload when ``config.yml`` changes or on SIGHUP."""
+        loop = asyncio.get_running_loop()
+        pending: List[asyncio.Task] = []
+        hooked = False
+        try:
+            loop.add_signal_handler(
+                signal.SIGHUP, lambda: pending.append(loop.create_task(self._reload_logged()))
+            )
+            hooked = True
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+            # No SIGHUP on Windows, and signal handlers need the main thread.
+            pass
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                pending[:] = [task for task in pending if not task.done()]
+                if self._config_mtime() != self._mtime:
+                    await self._reload_logged()
+        finally:
+            if hooked:
+                loop.remove_signal_handler(signal.SIGHUP)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "snapshot": self.snapshot.summary() if self.snapshot is not None else None,
+        }
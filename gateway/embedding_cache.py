@@ -0,0 +1,378 @@
+"""
+Persistent, content-addressed cache for embeddings.
+
+Vectors are keyed by (model, hash of the normalized text): each model
+has its own segment under ``EMBED_CACHE_DIR``, made of two fixed-size
+memory-mapped files, ``vectors.f32`` (``capacity`` rows of ``dim``
+float32) and ``keys.bin`` (the 16-byte BLAKE2b digest stored in each
+row). The digest -> row index is a dict rebuilt from ``keys.bin`` when
+the segment is opened, so the cache survives restarts without a
+separate index file. Texts are normalized (Unicode NFC, surrounding
+whitespace stripped) before hashing, so re-ingested chunks that differ
+only in those respects hit.
+
+A whole request is looked up at once: every digest is resolved, then
+the hit rows are gathered in one step (one NumPy fancy-index over the
+mapped matrix when NumPy is installed, otherwise slices of the map),
+and only the distinct misses are sent upstream.
+
+Each segment holds at most ``EMBED_CACHE_SEGMENT_BYTES``. Once full,
+rows are reused in CLOCK order (an approximation of LRU): a row read or
+written since the hand last passed gets a second chance.
+
+``embed`` keeps file I/O off the event loop: segments are opened (and
+their keys scanned) in a worker thread, and the evicted keys of a whole
+batch are flushed to disk with one pass in a worker thread before their
+rows are rewritten. Rows waiting on that flush are reserved so no other
+request claims them in the meantime.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import unicodedata
+from array import array
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Sequence, Set, Tuple
+
+from gateway.admission import model_env_name
+from gateway.metrics import REGISTRY
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; lookups fall back to memoryview slices
+    np = None
+
+logger = logging.getLogger(__name__)
+
+KEY_BYTES = 16
+_EMPTY = bytes(KEY_BYTES)
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    "gateway_embed_cache_lookups_total", "Embedding cache lookups per input.", ("model", "result")
+)
+
+
+def text_key(text: str) -> bytes:
+    normalized = unicodedata.normalize("NFC", text).strip()
+    return hashlib.blake2b(normalized.encode(), digest_size=KEY_BYTES).digest()
+
+
+def _mapped(path: str, size: int) -> mmap.mmap:
+    with open(path, "a+b") as f:
+        if os.fstat(f.fileno()).st_size != size:
+            f.truncate(size)
+        return mmap.mmap(f.fileno(), size)
+
+
+class Segment:
+    """One model's vectors in fixed-width, memory-mapped rows."""
+
+    def __init__(self, directory: str, dim: int, capacity: int):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dim = dim
+        self.capacity = capacity
+        self.row_bytes = dim * 4
+        self.hand = 0
+        meta = self._read_meta()
+        if meta is not None and (meta["dim"], meta["capacity"]) == (dim, capacity):
+            self.hand = meta["hand"]
+        else:
+            self._remove_files()
+        self.vectors = _mapped(os.path.join(directory, "vectors.f32"), capacity * self.row_bytes)
+        self.keys = _mapped(os.path.join(directory, "keys.bin"), capacity * KEY_BYTES)
+        self.index: Dict[bytes, int] = {}
+        for row in range(capacity):
+            key = self.keys[row * KEY_BYTES:(row + 1) * KEY_BYTES]
+            if key != _EMPTY:
+                self.index[key] = row
+        # CLOCK reference bits; not persisted, every row starts unreferenced.
+        self.used = bytearray(capacity)
+        # Rows claimed by ``reserve`` and not yet filled, and their keys.
+        self.reserved: Set[int] = set()
+        self.pending: Dict[bytes, int] = {}
+        self.matrix = np.frombuffer(self.vectors, dtype=np.float32).reshape(capacity, dim) if np is not None else None
+        self._write_meta()
+
+    @classmethod
+    def open_existing(cls, directory: str) -> Optional["Segment"]:
+        path = os.path.join(directory, "meta.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(directory, meta["dim"], meta["capacity"])
+
+    def _read_meta(self) -> Optional[Dict[str, int]]:
+        try:
+            with open(os.path.join(self.directory, "meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self) -> None:
+        tmp = os.path.join(self.directory, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "capacity": self.capacity, "hand": self.hand}, f)
+        os.replace(tmp, os.path.join(self.directory, "meta.json"))
+
+    def _remove_files(self) -> None:
+        for name in ("vectors.f32", "keys.bin", "meta.json"):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def rows(self, keys: Sequence[bytes]) -> List[Optional[int]]:
+        rows = [self.index.get(key) for key in keys]
+        for row in rows:
+            if row is not None:
+                self.used[row] = 1
+        return rows
+
+    def gather(self, rows: List[int]) -> List[List[float]]:
+        """The vectors at ``rows``, read straight from the mapped file."""
+        if not rows:
+            return []
+        if self.matrix is not None:
+            return self.matrix[rows].tolist()
+        size = self.row_bytes
+        with memoryview(self.vectors) as view:
+            return [view[row * size:(row + 1) * size].cast("f").tolist() for row in rows]
+
+    def _victim(self) -> int:
+        while True:
+            row = self.hand
+            self.hand = (row + 1) % self.capacity
+            if row in self.reserved:
+                continue
+            if not self.used[row] or self.keys[row * KEY_BYTES:(row + 1) * KEY_BYTES] == _EMPTY:
+                return row
+            self.used[row] = 0
+
+    def reserve(self, keys: Sequence[bytes]) -> Tuple[List[Tuple[bytes, int]], List[int]]:
+        """Claim rows for the new ``keys``: ((key, row) pairs, rows whose old key was cleared).
+
+        The cleared key slots must reach disk (``sync_keys``) before
+        ``fill`` overwrites their vectors, so a crash in between cannot
+        pair an evicted key with the new vector.
+        """
+        claimed: List[Tuple[bytes, int]] = []
+        retired: List[int] = []
+        for key in keys:
+            if key in self.index or key in self.pending:
+                continue
+            if len(self.reserved) >= self.capacity:
+                break
+            row = self._victim()
+            start = row * KEY_BYTES
+            old = self.keys[start:start + KEY_BYTES]
+            if old != _EMPTY:
+                del self.index[old]
+                self.keys[start:start + KEY_BYTES] = _EMPTY
+                retired.append(row)
+            self.reserved.add(row)
+            self.pending[key] = row
+            claimed.append((key, row))
+        return claimed, retired
+
+    def sync_keys(self, rows: Sequence[int]) -> None:
+        """Flush the ``keys.bin`` pages holding ``rows``; blocks on disk."""
+        granularity = mmap.ALLOCATIONGRANULARITY
+        for page in sorted({row * KEY_BYTES - row * KEY_BYTES % granularity for row in rows}):
+            self.keys.flush(page, min(granularity, len(self.keys) - page))
+
+    def fill(self, claimed: Sequence[Tuple[bytes, int]], vectors: Mapping[bytes, Sequence[float]]) -> None:
+        for key, row in claimed:
+            self.vectors[row * self.row_bytes:(row + 1) * self.row_bytes] = array("f", vectors[key]).tobytes()
+            # The key goes in last: a row with a key always has its vector.
+            self.keys[row * KEY_BYTES:(row + 1) * KEY_BYTES] = key
+            self.index[key] = row
+            self.used[row] = 1
+        self.release(claimed)
+
+    def release(self, claimed: Sequence[Tuple[bytes, int]]) -> None:
+        for key, row in claimed:
+            self.reserved.discard(row)
+            self.pending.pop(key, None)
+
+    def put(self, key: bytes, vector: Sequence[float]) -> None:
+        claimed, retired = self.reserve([key])
+        if retired:
+            self.sync_keys(retired)
+        self.fill(claimed, {key: vector})
+
+    def flush(self) -> None:
+        self.vectors.flush()
+        self.keys.flush()
+        self._write_meta()
+
+    def close(self) -> None:
+        self.flush()
+        self.matrix = None
+        self.vectors.close()
+        self.keys.close()
+
+    def destroy(self) -> None:
+        self.matrix = None
+        self.vectors.close()
+        self.keys.close()
+        self._remove_files()
+
+    def stats(self) -> Dict[str, Any]:
+        bytes_per_vector = self.row_bytes + KEY_BYTES
+        return {
+            "dim": self.dim,
+            "vectors": len(self.index),
+            "capacity": self.capacity,
+            "bytes_per_vector": bytes_per_vector,
+            "bytes": self.capacity * bytes_per_vector,
+        }
+
+
+class EmbeddingCache:
+    """Per-model ``Segment`` s under one directory."""
+
+    def __init__(self, root: str, segment_bytes: int = 256 * 1024 * 1024):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.segments: Dict[str, Segment] = {}
+        self._opening = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> Optional["EmbeddingCache"]:
+        root = env.get("EMBED_CACHE_DIR")
+        if not root:
+            return None
+        return cls(root, int(env.get("EMBED_CACHE_SEGMENT_BYTES", str(256 * 1024 * 1024))))
+
+    def _directory(self, model: str) -> str:
+        # The digest keeps "a:b" and "a_b" apart.
+        digest = hashlib.blake2b(model.encode(), digest_size=4).hexdigest()
+        return os.path.join(self.root, f"{model_env_name(model)}-{digest}")
+
+    def segment(self, model: str, dim: Optional[int] = None) -> Optional[Segment]:
+        """The model's segment; created for ``dim`` if missing or of another width."""
+        segment = self.segments.get(model)
+        if segment is None:
+            segment = Segment.open_existing(self._directory(model))
+            if segment is not None:
+                self.segments[model] = segment
+        if dim is None or (segment is not None and segment.dim == dim):
+            return segment
+        self.segments.pop(model, None)
+        segment = self.segments[model] = self._create(model, dim, segment)
+        return segment
+
+    async def open(self, model: str, dim: Optional[int] = None) -> Optional[Segment]:
+        """``segment``, with any file I/O done in a worker thread."""
+        segment = self.segments.get(model)
+        if segment is not None and (dim is None or segment.dim == dim):
+            return segment
+        async with self._opening:
+            segment = self.segments.get(model)
+            if segment is None:
+                segment = await asyncio.to_thread(Segment.open_existing, self._directory(model))
+                if segment is not None:
+                    self.segments[model] = segment
+            if dim is None or (segment is not None and segment.dim == dim):
+                return segment
+            # Unlisted first, so no request starts on a segment being destroyed.
+            self.segments.pop(model, None)
+            segment = self.segments[model] = await asyncio.to_thread(self._create, model, dim, segment)
+            return segment
+
+    def _create(self, model: str, dim: int, old: Optional[Segment]) -> Segment:
+        if old is not None:
+            logger.info(f"Embedding width for {model} changed to {dim}; starting a new cache segment")
+            old.destroy()
+        capacity = max(self.segment_bytes // (dim * 4 + KEY_BYTES), 1)
+        return Segment(self._directory(model), dim, capacity)
+
+    def lookup(self, model: str, texts: Sequence[str]) -> Tuple[List[bytes], List[Optional[List[float]]]]:
+        """Digests of ``texts`` and their cached vectors (None for misses)."""
+        return self._lookup(model, texts, self.segment(model))
+
+    def _lookup(
+        self, model: str, texts: Sequence[str], segment: Optional[Segment]
+    ) -> Tuple[List[bytes], List[Optional[List[float]]]]:
+        keys = [text_key(text) for text in texts]
+        found: List[Optional[List[float]]] = [None] * len(texts)
+        if segment is not None:
+            rows = segment.rows(keys)
+            hits = [i for i, row in enumerate(rows) if row is not None]
+            for i, vector in zip(hits, segment.gather([rows[i] for i in hits])):
+                found[i] = vector
+        hit_count = sum(vector is not None for vector in found)
+        self.hits += hit_count
+        self.misses += len(texts) - hit_count
+        CACHE_LOOKUPS.labels(model, "hit").inc(hit_count)
+        CACHE_LOOKUPS.labels(model, "miss").inc(len(texts) - hit_count)
+        return keys, found
+
+    def store(self, model: str, keys: Sequence[bytes], vectors: Sequence[Sequence[float]]) -> None:
+        if not vectors:
+            return
+        segment = self.segment(model, len(vectors[0]))
+        for key, vector in zip(keys, vectors):
+            if len(vector) == segment.dim:
+                segment.put(key, vector)
+
+    async def _store(self, model: str, fresh: Mapping[bytes, Sequence[float]]) -> None:
+        """``store`` for the event loop: one off-loop flush for the whole batch."""
+        if not fresh:
+            return
+        segment = await self.open(model, len(next(iter(fresh.values()))))
+        claimed, retired = segment.reserve([key for key, vector in fresh.items() if len(vector) == segment.dim])
+        try:
+            if retired:
+                await asyncio.to_thread(segment.sync_keys, retired)
+        except BaseException:
+            segment.release(claimed)
+            raise
+        if self.segments.get(model) is segment:
+            segment.fill(claimed, fresh)
+
+    async def embed(
+        self,
+        model: str,
+        texts: List[str],
+        embed: Callable[[str, List[str]], Awaitable[Tuple[List[List[float]], int]]],
+    ) -> Tuple[List[List[float]], int]:
+        """Embeddings for ``texts``, sending only distinct misses to ``embed``."""
+        keys, found = self._lookup(model, texts, await self.open(model))
+        missing: Dict[bytes, str] = {}
+        for key, text, vector in zip(keys, texts, found):
+            if vector is None:
+                missing.setdefault(key, text)
+        tokens = 0
+        if missing:
+            vectors, tokens = await embed(model, list(missing.values()))
+            fresh = dict(zip(missing, vectors))
+            await self._store(model, fresh)
+            found = [vector if vector is not None else fresh[key] for key, vector in zip(keys, found)]
+        return found, tokens
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "vectorized": np is not None,
+            "models": {model: segment.stats() for model, segment in self.segments.items()},
+        }
+
+    def flush(self) -> None:
+        for segment in self.segments.values():
+            segment.flush()
+
+    def close(self) -> None:
+        for segment in self.segments.values():
+            segment.close()
+        self.segments.clear()
@@ -0,0 +1,160 @@
+"""
+``/v1/embeddings`` with dynamic micro-batching onto Ollama's ``/api/embed``.
+
+Ollama embeds a list of inputs in one call for little more than the
+cost of one, but RAG indexers tend to send one string per request.
+``MicroBatcher`` collects the inputs of concurrent requests for the same
+model and sends them upstream together: a batch is sent when it reaches
+``EMBED_MAX_BATCH`` inputs or ``EMBED_MAX_WAIT_MS`` after its first
+input arrived, whichever is first, so no request waits longer than that
+for company. Each caller gets back its own slice of the embeddings and
+a share of the prompt tokens in proportion to the length of its input.
+Requests at least ``EMBED_MAX_BATCH`` inputs long are sent on their own.
+
+Batches only combine requests of one API key (its digest) and are
+admitted under that key and its policy weight, so weighted fair
+queueing holds between tenants for embeddings as it does for chats.
+The gateway's own embeddings (semantic cache queries) queue as
+``INTERNAL_KEY``.
+"""
+
+import asyncio
+import base64
+import os
+from array import array
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+
+from gateway.metrics import REGISTRY
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+EMBED_BATCH_SIZE = REGISTRY.histogram(
+    "gateway_embed_batch_inputs", "Inputs per upstream /api/embed call.", ("model",), BATCH_SIZE_BUCKETS
+)
+
+INTERNAL_KEY = "gateway"
+
+# (model, inputs, key, weight) -> (embeddings, prompt tokens)
+Embed = Callable[[str, List[str], str, float], Awaitable[Tuple[List[List[float]], int]]]
+
+
+class _Batch:
+    __slots__ = ("weight", "inputs", "waiters", "timer")
+
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.inputs: List[str] = []
+        # (future, start index, count, characters)
+        self.waiters: List[Tuple[asyncio.Future, int, int, int]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MicroBatcher:
+    """Coalesces concurrent embedding requests per (model, key)."""
+
+    def __init__(self, embed: Embed, max_batch: int = 64, max_wait: float = 0.005):
+        self.embed_batch = embed
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending: Dict[Tuple[str, str], _Batch] = {}
+        self.batches = 0
+        self.inputs = 0
+
+    @classmethod
+    def from_env(cls, embed: Embed, env: Mapping[str, str] = os.environ) -> "MicroBatcher":
+        return cls(
+            embed,
+            int(env.get("EMBED_MAX_BATCH", "64")),
+            float(env.get("EMBED_MAX_WAIT_MS", "5")) / 1000.0,
+        )
+
+    async def embed(
+        self, model: str, inputs: List[str], key: str = INTERNAL_KEY, weight: float = 1.0
+    ) -> Tuple[List[List[float]], int]:
+        """Embeddings for ``inputs`` and the prompt tokens attributed to them."""
+        if len(inputs) >= self.max_batch or self.max_wait <= 0:
+            self._count(model, len(inputs))
+            return await self.embed_batch(model, inputs, key, weight)
+
+        group = (model, key)
+        batch = self.pending.get(group)
+        if batch is None:
+            batch = self.pending[group] = _Batch(weight)
+            batch.timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush, group, batch)
+        elif len(batch.inputs) + len(inputs) > self.max_batch:
+            self._flush(group, batch)
+            return await self.embed(model, inputs, key, weight)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.waiters.append((future, len(batch.inputs), len(inputs), sum(len(text) for text in inputs)))
+        batch.inputs.extend(inputs)
+        if len(batch.inputs) >= self.max_batch:
+            self._flush(group, batch)
+        return await future
+
+    def _count(self, model: str, size: int) -> None:
+        self.batches += 1
+        self.inputs += size
+        EMBED_BATCH_SIZE.labels(model).observe(size)
+
+    def _flush(self, group: Tuple[str, str], batch: _Batch) -> None:
+        if self.pending.get(group) is not batch:
+            return
+        del self.pending[group]
+        if batch.timer is not None:
+            batch.timer.cancel()
+        self._count(group[0], len(batch.inputs))
+        asyncio.get_running_loop().create_task(self._send(group, batch))
+
+    async def _send(self, group: Tuple[str, str], batch: _Batch) -> None:
+        model, key = group
+        try:
+            embeddings, tokens = await self.embed_batch(model, batch.inputs, key, batch.weight)
+        except Exception as e:
+            for future, *_ in batch.waiters:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        characters = sum(waiter[3] for waiter in batch.waiters) or 1
+        for future, start, count, chars in batch.waiters:
+            if not future.done():
+                future.set_result((embeddings[start:start + count], round(tokens * chars / characters)))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "inputs": self.inputs,
+            "mean_batch": round(self.inputs / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+def embedding_inputs(value: Any) -> List[str]:
+    """OpenAI ``input``: a string or a list of strings; raises ValueError otherwise."""
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list) and value and all(isinstance(item, str) for item in value):
+        return value
+    raise ValueError("input must be a string or a non-empty array of strings")
+
+
+def encode_embedding(embedding: List[float], encoding_format: str = "float") -> Any:
+    if encoding_format == "base64":
+        return base64.b64encode(array("f", embedding).tobytes()).decode()
+    return embedding
+
+
+def embeddings_response(
+    model: str,
+    embeddings: List[List[float]],
+    tokens: int,
+    encoding_format: str = "float",
+) -> Dict[str, Any]:
+    return {
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": i, "embedding": encode_embedding(embedding, encoding_format)}
+            for i, embedding in enumerate(embeddings)
+        ],
+        "model": model,
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
@@ -0,0 +1,205 @@
+"""
+Background health checks of the Ollama nodes.
+
+``HealthProber`` probes every node in the pool each ``interval`` seconds
+(``HEALTHCHECK_INTERVAL``, else ``ollama.healthcheck_interval`` from
+``config.yml``, else 10), stretched or shortened by up to
+``HEALTHCHECK_JITTER`` so that gateway replicas do not probe in step. A
+probe asks ``/api/version`` and ``/api/ps`` within
+``HEALTHCHECK_TIMEOUT`` seconds and records liveness, probe latency, the
+Ollama version and the loaded models in ``table``. The loaded models are
+also the node's resident set for routing; nothing else polls
+``/api/ps``.
+
+A node turns unhealthy after ``HEALTHCHECK_FAILURES`` failed probes in a
+row and healthy again after one successful probe. Routing skips
+unhealthy nodes (see ``gateway.backends``), and ``/health`` answers from
+the table without calling Ollama, so load balancer probes cost the
+gateway a dictionary walk. Each transition is logged as a JSON event on
+``gateway.events`` and counted in
+``gateway_backend_health_transitions_total``.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional
+
+from gateway.backends import Backend, BackendPool
+from gateway.metrics import REGISTRY
+from gateway.timing import event_logger
+from gateway.upstream import UpstreamClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 10.0
+
+BACKEND_UP = REGISTRY.gauge("gateway_backend_up", "1 if the last health checks found the backend up.", ("backend",))
+PROBE_SECONDS = REGISTRY.gauge(
+    "gateway_backend_probe_seconds", "Latency of the last successful health probe.", ("backend",)
+)
+TRANSITIONS = REGISTRY.counter(
+    "gateway_backend_health_transitions_total", "Backend health changes, by new state.", ("backend", "state")
+)
+
+
+@dataclass
+class NodeHealth:
+    """What the last probes of one node found."""
+
+    host: str
+    healthy: bool = True
+    checked_at: Optional[float] = None
+    latency: Optional[float] = None
+    version: Optional[str] = None
+    loaded: List[str] = field(default_factory=list)
+    failures: int = 0
+    error: Optional[str] = None
+    changed_at: Optional[float] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy,
+            "checked_at": self.checked_at,
+            "latency_ms": round(self.latency * 1000, 2) if self.latency is not None else None,
+            "version": self.version,
+            "loaded": self.loaded,
+            "failures": self.failures,
+            "error": self.error,
+            "changed_at": self.changed_at,
+        }
+
+
+class HealthProber:
+    """Keeps ``table`` current and mirrors it onto ``Backend.healthy``."""
+
+    def __init__(
+        self,
+        pool: BackendPool,
+        upstream: UpstreamClient,
+        interval: Optional[float] = None,
+        timeout: float = 2.0,
+        failures: int = 2,
+        jitter: float = 0.1,
+    ):
+        self.pool = pool
+        self.upstream = upstream
+        # Set from config.yml on reload unless HEALTHCHECK_INTERVAL pins it.
+        self.interval = interval or DEFAULT_INTERVAL
+        self.pinned = interval is not None
+        self.timeout = timeout
+        self.failures = max(1, failures)
+        self.jitter = min(max(jitter, 0.0), 1.0)
+        self.table: Dict[str, NodeHealth] = {}
+        self.rounds = 0
+
+    @classmethod
+    def from_env(
+        cls, pool: BackendPool, upstream: UpstreamClient, env: Mapping[str, str] = os.environ
+    ) -> "HealthProber":
+        interval = env.get("HEALTHCHECK_INTERVAL")
+        return cls(
+            pool,
+            upstream,
+            float(interval) if interval else None,
+            float(env.get("HEALTHCHECK_TIMEOUT", "2")),
+            int(env.get("HEALTHCHECK_FAILURES", "2")),
+            float(env.get("HEALTHCHECK_JITTER", "0.1")),
+        )
+
+    def configure(self, interval: Optional[float]) -> None:
+        """Apply ``ollama.healthcheck_interval`` from a config reload."""
+        if not self.pinned:
+            self.interval = interval if interval and interval > 0 else DEFAULT_INTERVAL
+
+    def entry(self, backend: Backend) -> NodeHealth:
+        health = self.table.get(backend.host)
+        if health is None:
+            health = self.table[backend.host] = NodeHealth(backend.host)
+        return health
+
+    async def _get(self, backend: Backend, path: str) -> Dict[str, Any]:
+        response = await self.upstream.client.get(self.upstream.url(path, backend.host), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    async def probe(self, backend: Backend) -> NodeHealth:
+        """Check ``backend`` once and record the outcome."""
+        health = self.entry(backend)
+        started = time.monotonic()
+        try:
+            version, ps = await asyncio.wait_for(
+                asyncio.gather(self._get(backend, "/api/version"), self._get(backend, "/api/ps")),
+                self.timeout,
+            )
+        except Exception as e:
+            health.checked_at = time.time()
+            health.failures += 1
+            health.error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            if health.failures >= self.failures:
+                self._set(backend, health, False)
+            return health
+        health.checked_at = time.time()
+        health.latency = time.monotonic() - started
+        health.version = version.get("version")
+        health.loaded = sorted(m["name"] for m in ps.get("models", []))
+        health.failures = 0
+        health.error = None
+        backend.resident = frozenset(health.loaded)
+        PROBE_SECONDS.labels(backend.host).set(health.latency)
+        self._set(backend, health, True)
+        return health
+
+    def _set(self, backend: Backend, health: NodeHealth, healthy: bool) -> None:
+        BACKEND_UP.labels(backend.host).set(1 if healthy else 0)
+        backend.healthy = healthy
+        if health.healthy == healthy:
+            return
+        health.healthy = healthy
+        health.changed_at = health.checked_at
+        state = "healthy" if healthy else "unhealthy"
+        TRANSITIONS.labels(backend.host, state).inc()
+        event = {"event": "backend_health", "backend": backend.host, "state": state, "error": health.error}
+        logger.warning(f"Backend {backend.host} is now {state}" + (f": {health.error}" if health.error else ""))
+        if event_logger.isEnabledFor(logging.INFO):
+            event_logger.info(json.dumps(event, separators=(",", ":")), extra={"fields": event})
+
+    async def probe_all(self) -> None:
+        backends = list(self.pool.backends)
+        await asyncio.gather(*(self.probe(b) for b in backends))
+        hosts = {b.host for b in backends}
+        for host in [h for h in self.table if h not in hosts]:
+            del self.table[host]
+        self.rounds += 1
+
+    def delay(self) -> float:
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def run(self) -> None:
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(self.delay())
+
+    def status(self) -> Dict[str, Any]:
+        """The ``/health`` body: healthy, degraded (some nodes down) or unhealthy (all down)."""
+        backends = list(self.pool.backends)
+        up = sum(b.healthy for b in backends)
+        if up == len(backends):
+            status = "healthy"
+        elif up:
+            status = "degraded"
+        else:
+            status = "unhealthy"
+        return {
+            "status": status,
+            "service": "AI Gateway for Ollama",
+            "timestamp": time.time(),
+            "backends": {
+                b.host: self.table[b.host].snapshot() if b.host in self.table else {"healthy": b.healthy}
+                for b in backends
+            },
+        }
@@ -0,0 +1,275 @@
+"""
+API key registry.
+
+Every configured key is compiled once into a ``Policy``: model, the
+Ollama options, the ready-made system message, limits and scopes. The
+policies live in a ``KeyIndex``, an immutable dict keyed by the SHA-256
+digest of the key, so authenticating a request and resolving its policy
+is one hash and one dict lookup whatever the number of keys, and the
+digest is confirmed with ``hmac.compare_digest``. Plaintext keys are not
+kept; ``config.yml`` may list ``key_sha256`` instead of ``key``.
+
+Keys come from, in increasing precedence:
+
+* ``POLICIES`` in ``gateway/policies.py``;
+* ``auth.keys`` in ``config.yml`` (``CONFIG_PATH``), each entry an
+  ``id``, ``key`` or ``key_sha256``, optional ``scopes`` and any policy
+  field (``model``, ``temperature``, ``system_prompt``, ``weight``,
+  ``keep_alive``, ``rate_limit``, ``tokens_per_minute``, ``max_tokens``,
+  ``semantic_cache``);
+* ``API_KEYS``, comma-separated ``key`` or ``key=model`` entries using
+  ``DEFAULT_MODEL`` and ``DEFAULT_TEMPERATURE``.
+
+A policy's ``model`` may name an alias from the ``models`` section of
+``config.yml``; it is resolved to the Ollama name (``model:version``)
+when the policy is compiled, and the alias's ``max_tokens`` caps
+``num_predict`` for every request under that policy.
+
+``KeyRegistry`` holds the current index. ``gateway.config.ConfigManager``
+rebuilds it when ``config.yml`` changes and swaps it in with a single
+assignment; requests already holding a ``Policy`` keep using it.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple
+
+from gateway.affinity import keep_alive_for
+from gateway.metrics import key_label
+from gateway.semantic_cache import SemanticSettings
+from gateway.transform import ChatRequest, ollama_chat
+
+logger = logging.getLogger(__name__)
+
+ALL_SCOPES = "*"
+DEFAULT_SCOPES = frozenset({ALL_SCOPES})
+# Ollama options a caller may set per request; the rest come from the policy.
+CALLER_OPTIONS = ("top_p", "stop", "seed")
+
+
+def key_digest(key: str) -> bytes:
+    return hashlib.sha256(key.encode()).digest()
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """A ``models`` entry: the Ollama model an alias points at."""
+
+    model: str
+    max_tokens: Optional[int] = None
+
+    @classmethod
+    def compile(cls, spec: Mapping[str, Any]) -> "ModelRoute":
+        model = str(spec["model"])
+        if spec.get("version") is not None:
+            model = f"{model}:{spec['version']}"
+        return cls(model, spec.get("max_tokens"))
+
+
+def model_routes(config: Mapping[str, Any]) -> Dict[str, ModelRoute]:
+    return {str(alias): ModelRoute.compile(spec) for alias, spec in (config.get("models") or {}).items()}
+
+
+def extract_api_key(authorization: Optional[str]) -> Optional[str]:
+    """The key from ``Bearer <key>``, or a bare key; None if malformed."""
+    if not authorization:
+        return None
+    if authorization.startswith("Bearer "):
+        return authorization[7:] or None
+    if " " in authorization:
+        return None
+    return authorization
+
+
+@dataclass(frozen=True)
+class Policy:
+    """Everything a request needs from its key, built once per reload.
+
+    ``options`` and ``system_message`` are shared by every request using
+    the key and must not be mutated.
+    """
+
+    id: str
+    model: str
+    temperature: float = 0.7
+    system_message: Optional[Dict[str, str]] = None
+    options: Dict[str, Any] = field(default_factory=dict)
+    weight: float = 1
+    keep_alive: Optional[str] = None
+    rate_limit: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+    max_tokens: Optional[int] = None
+    scopes: FrozenSet[str] = DEFAULT_SCOPES
+    semantic_cache: Optional[SemanticSettings] = None
+
+    @classmethod
+    def compile(
+        cls,
+        id: str,
+        spec: Mapping[str, Any],
+        env: Mapping[str, str] = os.environ,
+        models: Mapping[str, ModelRoute] = {},
+    ) -> "Policy":
+        model = spec.get("model") or env.get("DEFAULT_MODEL", "llama3")
+        route = models.get(model)
+        if route is not None:
+            model = route.model
+        max_tokens = spec.get("max_tokens") or (route.max_tokens if route is not None else None)
+        temperature = float(spec.get("temperature", env.get("DEFAULT_TEMPERATURE", 0.7)))
+        system_prompt = spec.get("system_prompt")
+        options: Dict[str, Any] = {"temperature": temperature}
+        if max_tokens:
+            options["num_predict"] = max_tokens
+        return cls(
+            id=id,
+            model=model,
+            temperature=temperature,
+            system_message={"role": "system", "content": system_prompt} if system_prompt else None,
+            options=options,
+            weight=spec.get("weight", 1),
+            keep_alive=keep_alive_for(model, spec, env),
+            rate_limit=spec.get("rate_limit"),
+            tokens_per_minute=spec.get("tokens_per_minute"),
+            max_tokens=max_tokens or None,
+            scopes=frozenset(spec.get("scopes") or DEFAULT_SCOPES),
+            semantic_cache=SemanticSettings.compile(spec.get("semantic_cache"), env),
+        )
+
+    def allows(self, scope: str) -> bool:
+        return ALL_SCOPES in self.scopes or scope in self.scopes
+
+    def get(self, name: str, default: Any = None) -> Any:
+        """Dict-style access for code written against ``POLICIES`` entries."""
+        return getattr(self, name, default)
+
+    def ollama_payload(self, payload: Mapping[str, Any]) -> Dict[str, Any]:
+        """The ``/api/chat`` body for an OpenAI-style request under this policy.
+
+        The policy fixes the model and temperature; the caller's ``top_p``,
+        ``stop`` and ``seed`` are passed through, and ``max_tokens`` is
+        capped by the policy's limit.
+        """
+        request = ChatRequest.from_openai(payload)
+        requested = request.options()
+        options = self.options
+        passed = {name: requested[name] for name in CALLER_OPTIONS if name in requested}
+        if passed:
+            options = {**options, **passed}
+        if request.max_tokens is not None:
+            limit = request.max_tokens
+            if self.max_tokens is not None:
+                limit = min(limit, self.max_tokens)
+            options = {**options, "num_predict": limit}
+        return ollama_chat(
+            self.model, request.messages, options, request.stream, self.system_message, self.keep_alive
+        )
+
+
+class KeyIndex:
+    """Immutable digest -> policy map."""
+
+    __slots__ = ("_entries",)
+
+    def __init__(self, entries: Iterable[Tuple[bytes, Policy]] = ()):
+        self._entries: Dict[bytes, Tuple[bytes, Policy]] = {d: (d, p) for d, p in entries}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, key: Optional[str]) -> Optional[Policy]:
+        if not key:
+            return None
+        digest = key_digest(key)
+        entry = self._entries.get(digest)
+        if entry is None or not hmac.compare_digest(entry[0], digest):
+            return None
+        return entry[1]
+
+    def lookup_digest(self, digest: bytes) -> Optional[Policy]:
+        """The policy for a stored key digest (e.g. a batch's owner)."""
+        entry = self._entries.get(digest)
+        return entry[1] if entry is not None else None
+
+    def ids(self) -> List[str]:
+        return sorted(policy.id for _, policy in self._entries.values())
+
+
+def policy_entries(
+    policies: Mapping[str, Mapping[str, Any]],
+    env: Mapping[str, str],
+    models: Mapping[str, ModelRoute] = {},
+) -> List[Tuple[bytes, Policy]]:
+    return [(key_digest(key), Policy.compile(key_label(key), spec, env, models)) for key, spec in policies.items()]
+
+
+def config_entries(
+    config: Mapping[str, Any],
+    env: Mapping[str, str],
+    models: Mapping[str, ModelRoute] = {},
+) -> List[Tuple[bytes, Policy]]:
+    entries = []
+    for i, spec in enumerate((config.get("auth") or {}).get("keys") or []):
+        if spec.get("key_sha256"):
+            digest = bytes.fromhex(spec["key_sha256"])
+        elif spec.get("key"):
+            digest = key_digest(str(spec["key"]))
+        else:
+            raise ValueError(f"auth.keys[{i}] needs 'key' or 'key_sha256'")
+        entries.append((digest, Policy.compile(str(spec.get("id") or f"key-{i}"), spec, env, models)))
+    return entries
+
+
+def env_entries(env: Mapping[str, str], models: Mapping[str, ModelRoute] = {}) -> List[Tuple[bytes, Policy]]:
+    entries = []
+    for item in filter(None, (part.strip() for part in env.get("API_KEYS", "").split(","))):
+        key, _, model = item.partition("=")
+        spec = {"model": model} if model else {}
+        entries.append((key_digest(key), Policy.compile(key_label(key), spec, env, models)))
+    return entries
+
+
+def load_config(path: str) -> Dict[str, Any]:
+    if not path or not os.path.exists(path):
+        return {}
+    import yaml
+
+    with open(path, encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+def build_index(
+    policies: Mapping[str, Mapping[str, Any]],
+    config: Mapping[str, Any],
+    env: Mapping[str, str] = os.environ,
+) -> KeyIndex:
+    models = model_routes(config)
+    return KeyIndex(
+        policy_entries(policies, env, models) + config_entries(config, env, models) + env_entries(env, models)
+    )
+
+
+class KeyRegistry:
+    """Holds the current ``KeyIndex``; ``ConfigManager`` swaps in new ones."""
+
+    def __init__(
+        self,
+        index: KeyIndex,
+        policies: Mapping[str, Mapping[str, Any]] = {},
+        config_path: Optional[str] = None,
+        env: Mapping[str, str] = os.environ,
+    ):
+        self.index = index
+        self.policies = policies
+        self.config_path = config_path
+        self.env = env
+
+    @classmethod
+    def from_env(cls, policies: Mapping[str, Mapping[str, Any]], env: Mapping[str, str] = os.environ) -> "KeyRegistry":
+        path = env.get("CONFIG_PATH", "config.yml")
+        return cls(build_index(policies, load_config(path), env), policies, path, env)
+
+    def lookup(self, key: Optional[str]) -> Optional[Policy]:
+        return self.index.lookup(key)
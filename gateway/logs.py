@@ -0,0 +1,300 @@
+"""
+Non-blocking structured logging and the audit trail.
+
+``setup_logging`` puts a ``QueueHandler`` on the root logger: the calling
+thread only checks the level and sampling and enqueues the record; a
+``QueueListener`` thread formats and writes it. When the queue is full
+(a stalled disk or terminal) records are dropped and counted rather
+than blocking the event loop.
+
+Records are written as compact JSON (``LOG_FORMAT=json``, the default)
+with any ``extra=`` fields included; an ``extra={"fields": {...}}``
+mapping is written in place of the message. Auth headers, API keys and
+bearer tokens are redacted and message contents are replaced by their
+length.
+``LOG_SAMPLE_RATES`` ("route=rate,...") keeps only a fraction of the
+INFO and DEBUG records carrying that ``route``; warnings and errors are
+always kept.
+
+``AuditLog`` is the ``logging.audit`` trail: one JSON line per completed
+request (actor, model, token counts, timestamps), written by its own
+thread in batches, fsynced at most every ``AUDIT_FSYNC_INTERVAL``
+seconds and rotated by size (``AUDIT_MAX_BYTES``) or age
+(``AUDIT_ROTATE_SECONDS``), keeping ``AUDIT_BACKUPS`` old files.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional
+
+REDACTED = "[REDACTED]"
+SENSITIVE_KEYS = frozenset({"authorization", "x-admin-key", "api_key", "apikey", "cookie", "set-cookie", "password"})
+_BEARER = re.compile(r"(Bearer\s+)[^\s'\",}]+", re.IGNORECASE)
+_HEADER_VALUE = re.compile(r"(['\"]?(?:authorization|x-admin-key)['\"]?\s*[:=]\s*['\"]?)[^'\",}]+", re.IGNORECASE)
+
+# Attributes every LogRecord has; anything else came in through ``extra=``.
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def redact(value: Any, key: Optional[str] = None) -> Any:
+    """Copy ``value`` with secrets masked and message contents elided."""
+    if key is not None and key.lower() in SENSITIVE_KEYS:
+        return REDACTED
+    if isinstance(value, str):
+        if key == "content":
+            return f"[{len(value)} chars]"
+        return redact_text(value)
+    if isinstance(value, Mapping):
+        return {k: redact(v, str(k)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v, key) for v in value]
+    return value
+
+
+def redact_text(text: str) -> str:
+    return _HEADER_VALUE.sub(r"\1" + REDACTED, _BEARER.sub(r"\1" + REDACTED, text))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+        }
+        fields = getattr(record, "fields", None)
+        if isinstance(fields, Mapping):
+            # Structured events: the fields are the message.
+            entry.update(redact(fields))
+        else:
+            entry["msg"] = redact_text(record.getMessage())
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key != "fields":
+                entry[key] = redact(value, key)
+        if record.exc_text:
+            entry["exc"] = redact_text(record.exc_text)
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return redact_text(super().format(record))
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of INFO/DEBUG records per ``route``."""
+
+    def __init__(self, rates: Mapping[str, float]):
+        super().__init__()
+        self.rates = dict(rates)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, "route", None), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """``QueueHandler`` that drops records instead of blocking when full."""
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogListener(logging.handlers.QueueListener):
+    """``QueueListener`` whose stop waits for room in a full queue."""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, rate = item.rpartition("=")
+        rates[route] = float(rate)
+    return rates
+
+
+_listener: Optional[LogListener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+
+
+def setup_logging(
+    level: str = "info",
+    fmt: str = "json",
+    file: Optional[str] = None,
+    queue_size: int = 10_000,
+    sample_rates: Optional[Mapping[str, float]] = None,
+) -> DroppingQueueHandler:
+    """Route the root logger through a queue to a background writer."""
+    global _listener, _queue_handler
+    stop_logging()
+
+    if file:
+        directory = os.path.dirname(file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        target: logging.Handler = logging.FileHandler(file, encoding="utf-8")
+    else:
+        target = logging.StreamHandler()
+    if fmt == "json":
+        target.setFormatter(JsonFormatter())
+    else:
+        target.setFormatter(TextFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    handler = DroppingQueueHandler(queue.Queue(queue_size))
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    root.setLevel({"warn": "WARNING"}.get(level.lower(), level.upper()))
+    root.addHandler(handler)
+    _queue_handler = handler
+    _listener = LogListener(handler.queue, target, respect_handler_level=True)
+    _listener.start()
+    return handler
+
+
+def setup_logging_from_env(env: Mapping[str, str] = os.environ) -> DroppingQueueHandler:
+    return setup_logging(
+        env.get("LOG_LEVEL", "info"),
+        env.get("LOG_FORMAT", "json"),
+        env.get("LOG_FILE") or None,
+        int(env.get("LOG_QUEUE_SIZE", "10000")),
+        parse_sample_rates(env.get("LOG_SAMPLE_RATES", "")),
+    )
+
+
+def stop_logging() -> None:
+    """Flush queued records and detach the queue handler."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+        for target in _listener.handlers:
+            target.close()
+        _listener = None
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+
+
+class AuditLog:
+    """Append-only JSON lines written in batches by a background thread."""
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 100 * 1024 * 1024,
+        rotate_seconds: float = 86_400,
+        backups: int = 7,
+        fsync_interval: float = 1.0,
+        queue_size: int = 10_000,
+    ):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        self.fsync_interval = fsync_interval
+        self.dropped = 0
+        self.written = 0
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue(queue_size)
+        self._file = open(path, "a", encoding="utf-8")
+        self._opened = time.time()
+        self._synced = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="audit-log", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> Optional["AuditLog"]:
+        if env.get("AUDIT_ENABLED", "false").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            env.get("AUDIT_FILE", "logs/audit.log"),
+            int(env.get("AUDIT_MAX_BYTES", str(100 * 1024 * 1024))),
+            float(env.get("AUDIT_ROTATE_SECONDS", "86400")),
+            int(env.get("AUDIT_BACKUPS", "7")),
+            float(env.get("AUDIT_FSYNC_INTERVAL", "1")),
+        )
+
+    def record(self, entry: Mapping[str, Any]) -> None:
+        """Queue one audit entry; never blocks."""
+        line = json.dumps(redact(entry), separators=(",", ":"), default=str) + "\n"
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            try:
+                line = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                self._sync()
+                continue
+            batch: List[Optional[str]] = [line]
+            while len(batch) < 512:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self._write([line for line in batch if line is not None])
+            if stop:
+                self._sync(force=True)
+                return
+
+    def _write(self, lines: List[str]) -> None:
+        if not lines:
+            return
+        if self._file.tell() >= self.max_bytes or time.time() - self._opened >= self.rotate_seconds:
+            self._rotate()
+        self._file.writelines(lines)
+        self.written += len(lines)
+        self._sync()
+
+    def _sync(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if force or now - self._synced >= self.fsync_interval:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._synced = now
+
+    def _rotate(self) -> None:
+        self._sync(force=True)
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{i}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._opened = time.time()
+
+    def close(self) -> None:
+        """Write everything queued, fsync and close the file."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._file.close()
@@ -1,40 +1,688 @@
+"""
+This is the gateway brain.
+"""
 
----
+import asyncio
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Optional, Set, Tuple
 
+import httpx
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response
 
+from app.rate_limit import rate_limiter_from_env
+from gateway.admission import AdmissionController, AdmissionRejected
+from gateway.affinity import PrefixStats, prefix_key
+from gateway.backends import BackendPool
+from gateway.batches import BatchManager
+from gateway.cache import ResponseCache, cache_key, is_deterministic
+from gateway.coalesce import Coalescer
+from gateway.config import ConfigManager
+from gateway.embedding_cache import EmbeddingCache
+from gateway.embeddings import INTERNAL_KEY, MicroBatcher, embedding_inputs, embeddings_response
+from gateway.health import HealthProber
+from gateway.keys import (  # noqa: F401  (extract_api_key is re-exported for callers of gateway.main)
+    KeyRegistry,
+    Policy,
+    extract_api_key,
+    key_digest,
+)
+from gateway.logs import AuditLog, setup_logging_from_env, stop_logging
+from gateway.metrics import REGISTRY, RequestMetrics
+from gateway.policies import POLICIES
+from gateway.resilience import LatencyTracker, RetryPolicy, backend_failure, hedged, with_retries
+from gateway.semantic_cache import SemanticCache, semantic_query
+from gateway.streaming import SSEResponse, stream_chat_completion
+from gateway.timing import RequestTiming, TimingMiddleware
+from gateway.token_budget import TokenBudget
+from gateway.transform import (  # noqa: F401  (transform_* are re-exported for callers of gateway.main)
+    dumps,
+    new_completion_id,
+    ollama_response_to_openai,
+    transform_ollama_to_openai,
+    transform_openai_to_ollama,
+)
+from gateway.upstream import UpstreamClient
+from gateway.usage import UsageAggregator
 
+logger = logging.getLogger(__name__)
 
-This is the gateway brain.
+app = FastAPI()
+app.add_middleware(TimingMiddleware)
 
-from fastapi import FastAPI, Header, HTTPException
-import requests
-from policies import POLICIES
+upstream = UpstreamClient()
+pool = BackendPool.from_env()
+admission = AdmissionController.from_env()
+response_cache = ResponseCache.from_env()
+coalescer = Coalescer()
+prefix_stats = PrefixStats()
+rate_limiter = rate_limiter_from_env()
+token_budget = TokenBudget.from_env()
+usage = UsageAggregator.from_env()
+audit = AuditLog.from_env()
+keys = KeyRegistry.from_env(POLICIES)
+health = HealthProber.from_env(pool, upstream)
+config = ConfigManager(keys, pool, rate_limiter, token_budget, health=health)
+batches = BatchManager.from_env(
+    lambda payload, key, policy: dispatch_chat(payload, key, policy),
+    lambda digest: keys.index.lookup_digest(digest)
+)
+embedder = MicroBatcher.from_env(lambda model, inputs, key, weight: embed_upstream(model, inputs, key, weight))
+embedding_cache = EmbeddingCache.from_env()
+semantic_cache = SemanticCache.from_env(lambda model, inputs: embed_texts(model, inputs))
+retry_policy = RetryPolicy.from_env()
+latencies = LatencyTracker.from_env()
 
-app = FastAPI()
+ADMIN_KEY = os.getenv("ADMIN_KEY")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
+MODELS_REFRESH_INTERVAL = float(os.getenv("OLLAMA_MODELS_REFRESH_INTERVAL", "30"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+CONFIG_RELOAD_INTERVAL = float(os.getenv("CONFIG_RELOAD_INTERVAL", os.getenv("KEYS_RELOAD_INTERVAL", "5")))
 
-OLLAMA_URL = "http://ollama:11434/api/chat"
+background_tasks = []
 
-@app.post("/v1/chat/completions")
-def chat(payload: dict, authorization: str = Header(None)):
+
+@app.on_event("startup")
+async def startup_event():
+    """Start logging, load config.yml, start health checks and learn which models each backend serves and has loaded."""
+    setup_logging_from_env()
+    await config.reload()
+    await batches.start()
+    background_tasks.append(asyncio.create_task(health.run()))
+    background_tasks.append(asyncio.create_task(pool.run_refresh(upstream, MODELS_REFRESH_INTERVAL)))
+    background_tasks.append(asyncio.create_task(rate_limiter.run_eviction()))
+    background_tasks.append(asyncio.create_task(token_budget.run_eviction()))
+    background_tasks.append(asyncio.create_task(usage.run()))
+    background_tasks.append(asyncio.create_task(config.run(CONFIG_RELOAD_INTERVAL)))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background work and close pooled upstream connections."""
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    await batches.close()
+    await usage.close()
+    await upstream.aclose()
+    response_cache.close()
+    if embedding_cache is not None:
+        await asyncio.to_thread(embedding_cache.close)
+    rate_limiter.close()
+    if audit is not None:
+        audit.close()
+    stop_logging()
+
+
+def require_admin(x_admin_key: str):
+    if not ADMIN_KEY or x_admin_key != ADMIN_KEY:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+def validate_api_key(api_key: Optional[str]) -> bool:
+    return keys.lookup(api_key) is not None
+
+
+def authenticate(authorization: Optional[str], scope: str) -> Tuple[str, Policy]:
+    """The caller's key and policy, or 401/403."""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing API key")
 
-    key = authorization.replace("Bearer ", "")
-    policy = POLICIES.get(key)
+    key = authorization[7:]
+    policy = keys.lookup(key)
 
-    if not policy:
+    if policy is None:
         raise HTTPException(status_code=403, detail="Invalid API key")
+    if not policy.allows(scope):
+        raise HTTPException(status_code=403, detail=f"API key lacks the {scope} scope")
+    return key, policy
+
+
+@app.post("/admin/keys/reload")
+@app.post("/admin/config/reload")
+async def reload_config(x_admin_key: str = Header(None)):
+    require_admin(x_admin_key)
+    try:
+        snapshot = await config.reload()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid configuration: {e}")
+    return snapshot.summary()
+
+
+@app.get("/admin/config")
+async def config_status(x_admin_key: str = Header(None)):
+    require_admin(x_admin_key)
+    return config.status()
+
+
+@app.get("/admin/backends")
+async def backends(x_admin_key: str = Header(None)):
+    require_admin(x_admin_key)
+    return {"backends": pool.snapshot(), "admission": admission.snapshot()}
 
-    ollama_payload = {
-        "model": policy["model"],
-        "messages": [
-            {"role": "system", "content": policy["system_prompt"]},
-            *payload.get("messages", [])
-        ],
-        "options": {
-            "temperature": policy["temperature"]
-        }
+
+@app.get("/health")
+async def health_check():
+    """Liveness of the gateway and its backends, from the last background health checks."""
+    status = health.status()
+    return JSONResponse(status_code=503 if status["status"] == "unhealthy" else 200, content=status)
+
+
+@app.get("/v1/models")
+async def list_models(authorization: str = Header(None)):
+    """Configured model aliases and the models resident on the backends, without calling Ollama."""
+    if authorization and keys.lookup(authorization[7:] if authorization.startswith("Bearer ") else None) is None:
+        raise HTTPException(status_code=403, detail="Invalid API key")
+    names = set(config.snapshot.models) if config.snapshot is not None else set()
+    for backend in pool.backends:
+        names |= backend.resident
+    return {
+        "object": "list",
+        "data": [{"id": name, "object": "model", "created": 0, "owned_by": "ollama"} for name in sorted(names)],
     }
 
-    r = requests.post(OLLAMA_URL, json=ollama_payload)
-    return r.json()
+
+@app.get("/admin/prefixes")
+async def prefixes(x_admin_key: str = Header(None)):
+    require_admin(x_admin_key)
+    return {"prefixes": prefix_stats.snapshot()}
+
+
+@app.get("/admin/cache")
+async def cache_stats(x_admin_key: str = Header(None)):
+    require_admin(x_admin_key)
+    stats = {**response_cache.stats(), "coalesced": coalescer.coalesced}
+    if semantic_cache is not None:
+        stats["semantic"] = semantic_cache.stats()
+    if embedding_cache is not None:
+        stats["embeddings"] = embedding_cache.stats()
+    return stats
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.expose(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/admin/metrics")
+async def admin_metrics(x_admin_key: str = Header(None)):
+    require_admin(x_admin_key)
+    return {"metrics": REGISTRY.snapshot(), "usage": usage.snapshot()["usage"]}
+
+
+@app.get("/admin/usage")
+async def usage_stats(x_admin_key: str = Header(None)):
+    require_admin(x_admin_key)
+    return usage.snapshot()
+
+
+@app.post("/v1/chat/completions")
+async def chat(
+    payload: dict,
+    request: Request,
+    authorization: str = Header(None),
+    x_gateway_cache: str = Header(None)
+):
+    timing = RequestTiming(getattr(request.state, "received", None))
+    timing.mark("parse")
+
+    key, policy = authenticate(authorization, "chat:write")
+    # Limits, budgets and queues use the key digest, the identity batches
+    # run under too; the plaintext key is never stored.
+    owner = key_digest(key).hex()
+    if rate_limiter.max_requests is not None:
+        await rate_limiter.check_async(owner, policy.rate_limit)
+    timing.mark("auth")
+
+    messages = payload.get("messages")
+    if not isinstance(messages, list) or not messages:
+        raise HTTPException(status_code=422, detail="messages must be a non-empty list")
+    ollama_payload = policy.ollama_payload(payload)
+    event = {
+        "route": "/v1/chat/completions",
+        "model": ollama_payload["model"],
+        "key": policy.id,
+        "stream": ollama_payload["stream"],
+        "messages": len(ollama_payload["messages"])
+    }
+
+    # Deterministic requests (or callers that opt in) are served from the
+    # exact-match cache, or share an identical generation already in flight.
+    key_hash = None
+    if x_gateway_cache != "bypass" and (
+        x_gateway_cache == "use" or is_deterministic(ollama_payload["options"])
+    ):
+        key_hash = cache_key(ollama_payload)
+        if not ollama_payload["stream"]:
+            body = await response_cache.get(key_hash)
+            timing.mark("cache")
+            if body is not None:
+                response = Response(body, media_type="application/json", headers={"X-Cache": "HIT"})
+                return timed(response, timing, cache="hit", **event)
+
+    # Keys that opt in are answered from the semantic cache when an earlier
+    # request asked nearly the same final question in the same context.
+    semantic = None
+    if (
+        policy.semantic_cache is not None and semantic_cache is not None
+        and x_gateway_cache != "bypass" and not ollama_payload["stream"]
+    ):
+        query = semantic_query(policy.id, ollama_payload)
+        if query is not None:
+            try:
+                hit, vector = await semantic_cache.lookup(policy.semantic_cache, *query, policy.id)
+            except Exception as e:
+                logger.warning(f"Semantic cache lookup failed: {e}")
+            else:
+                timing.mark("semantic_cache")
+                if hit is not None:
+                    body, similarity = hit
+                    response = Response(
+                        body,
+                        media_type="application/json",
+                        headers={"X-Cache": "SEMANTIC", "X-Cache-Similarity": f"{similarity:.4f}"}
+                    )
+                    return timed(response, timing, cache="semantic", **event)
+                semantic = *query, vector
+
+    try:
+        if key_hash is None:
+            response = await dispatch_chat(ollama_payload, owner, policy, timing)
+        else:
+            # Only one caller's requests share a flight: each is admitted and
+            # charged under its own key.
+            response = await coalescer.response(
+                f"{owner}:{key_hash}:{ollama_payload['stream']}",
+                lambda: dispatch_chat(ollama_payload, owner, policy, timing)
+            )
+            if not ollama_payload["stream"] and response.status_code == 200:
+                response.headers["X-Cache"] = "MISS"
+                if response_cache.get_memory(key_hash) is None:
+                    await response_cache.put(key_hash, response.body)
+        if semantic is not None and response.status_code == 200:
+            try:
+                await semantic_cache.store(policy.semantic_cache, *semantic, response.body)
+            except Exception as e:
+                logger.warning(f"Semantic cache store failed: {e}")
+    except AdmissionRejected as e:
+        response = JSONResponse(
+            status_code=e.status_code,
+            headers={"Retry-After": str(e.retry_after)},
+            content={"error": {"message": str(e), "type": "rate_limit_error", "code": e.status_code}}
+        )
+    except httpx.HTTPStatusError as e:
+        status_code = e.response.status_code
+        logger.error(f"Ollama returned {status_code}: {e}")
+        response = upstream_error(str(e), status_code)
+    except Exception as e:
+        logger.error(f"Upstream chat failed: {e}")
+        response = upstream_error(str(e), 502)
+    return timed(response, timing, **event)
+
+
+@app.post("/v1/files")
+async def upload_file(
+    request: Request,
+    authorization: str = Header(None),
+    purpose: str = "batch",
+    filename: str = "input.jsonl"
+):
+    """Store a JSONL upload, streamed to disk.
+
+    Accepts ``multipart/form-data`` (``file`` and ``purpose`` fields, as
+    the OpenAI SDK sends them) or the raw file as the request body.
+    """
+    key, _ = authenticate(authorization, "chat:write")
+    owner = key_digest(key).hex()
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        try:
+            form = await request.form()
+        except AssertionError:
+            raise HTTPException(status_code=415, detail="Multipart uploads need python-multipart; send the raw file")
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Missing file field")
+
+        async def chunks() -> AsyncIterator[bytes]:
+            while True:
+                chunk = await upload.read(1 << 20)
+                if not chunk:
+                    return
+                yield chunk
+
+        meta = await batches.files.save(chunks(), upload.filename or filename, form.get("purpose", purpose), owner)
+    else:
+        meta = await batches.files.save(request.stream(), filename, purpose, owner)
+    return public_file(meta)
+
+
+def public_file(meta: dict) -> dict:
+    return {k: v for k, v in meta.items() if k != "owner"}
+
+
+def owned_file(file_id: str, authorization: Optional[str]) -> dict:
+    key, _ = authenticate(authorization, "chat:write")
+    meta = batches.files.meta(file_id)
+    if meta is None or meta.get("owner") != key_digest(key).hex():
+        raise HTTPException(status_code=404, detail=f"No such file: {file_id}")
+    return meta
+
+
+@app.get("/v1/files/{file_id}")
+async def get_file(file_id: str, authorization: str = Header(None)):
+    return public_file(owned_file(file_id, authorization))
+
+
+@app.get("/v1/files/{file_id}/content")
+async def get_file_content(file_id: str, authorization: str = Header(None)):
+    owned_file(file_id, authorization)
+    return FileResponse(batches.files.path(file_id), media_type="application/jsonl")
+
+
+@app.post("/v1/batches")
+async def create_batch(payload: dict, authorization: str = Header(None)):
+    key, _ = authenticate(authorization, "chat:write")
+    try:
+        job = await batches.create(
+            str(payload.get("input_file_id")),
+            key_digest(key).hex(),
+            payload.get("endpoint", "/v1/chat/completions"),
+            payload.get("completion_window", "24h"),
+            payload.get("metadata")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.view()
+
+
+@app.get("/v1/batches")
+async def list_batches(authorization: str = Header(None), limit: int = 20):
+    key, _ = authenticate(authorization, "chat:write")
+    jobs = batches.list(key_digest(key).hex(), limit)
+    return {"object": "list", "data": [job.view() for job in jobs], "has_more": False}
+
+
+def owned_batch(batch_id: str, authorization: Optional[str]):
+    key, _ = authenticate(authorization, "chat:write")
+    job = batches.get(batch_id, key_digest(key).hex())
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No such batch: {batch_id}")
+    return job
+
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str, authorization: str = Header(None)):
+    return owned_batch(batch_id, authorization).view()
+
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, authorization: str = Header(None)):
+    job = await batches.cancel(owned_batch(batch_id, authorization))
+    return job.view()
+
+
+@app.post("/v1/embeddings")
+async def embeddings(payload: dict, request: Request, authorization: str = Header(None)):
+    timing = RequestTiming(getattr(request.state, "received", None))
+    key, policy = authenticate(authorization, "embeddings:write")
+    owner = key_digest(key).hex()
+    if rate_limiter.max_requests is not None:
+        await rate_limiter.check_async(owner, policy.rate_limit)
+    try:
+        inputs = embedding_inputs(payload.get("input"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    model = payload.get("model") or EMBEDDING_MODEL
+    route = config.snapshot.models.get(model) if config.snapshot is not None else None
+    if route is not None:
+        model = route.model
+    timing.mark("auth")
+
+    event = {"route": "/v1/embeddings", "model": model, "key": policy.id, "inputs": len(inputs)}
+    try:
+        vectors, tokens = await embed_texts(model, inputs, owner, policy.weight)
+    except AdmissionRejected as e:
+        response = JSONResponse(
+            status_code=e.status_code,
+            headers={"Retry-After": str(e.retry_after)},
+            content={"error": {"message": str(e), "type": "rate_limit_error", "code": e.status_code}}
+        )
+        return timed(response, timing, **event)
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Ollama returned {e.response.status_code} for embeddings: {e}")
+        return timed(upstream_error(str(e), e.response.status_code), timing, **event)
+    except Exception as e:
+        logger.error(f"Upstream embeddings failed: {e}")
+        return timed(upstream_error(str(e), 502), timing, **event)
+    timing.mark("upstream")
+    usage.record(policy.id, model, tokens, 0)
+    body = embeddings_response(model, vectors, tokens, payload.get("encoding_format") or "float")
+    response = Response(dumps(body), media_type="application/json")
+    timing.mark("serialize")
+    return timed(response, timing, prompt_tokens=tokens, **event)
+
+
+async def embed_texts(model: str, inputs: list, key: str = INTERNAL_KEY, weight: float = 1.0):
+    """Embeddings through the persistent cache when enabled, else the micro-batcher.
+
+    ``key`` (the caller's key digest) and ``weight`` place the upstream
+    calls in the model's fair queue.
+    """
+
+    def embed(model: str, inputs: list):
+        return embedder.embed(model, inputs, key, weight)
+
+    if embedding_cache is not None:
+        return await embedding_cache.embed(model, inputs, embed)
+    return await embed(model, inputs)
+
+
+async def embed_upstream(model: str, inputs: list, key: str = INTERNAL_KEY, weight: float = 1.0):
+    """One ``/api/embed`` call for a micro-batch of one key, holding one model slot."""
+
+    async def attempt(tried: Set[str]) -> dict:
+        lease = pool.acquire(model, exclude=tried)
+        tried.add(lease.backend.host)
+        try:
+            ticket = await admission.acquire(lease.backend.host, model, key, weight)
+        except BaseException:
+            lease.release()
+            raise
+        try:
+            result = await upstream.post_json(
+                upstream.url("/api/embed", lease.backend.host), {"model": model, "input": inputs}
+            )
+            lease.observe()
+        except BaseException as e:
+            lease.release(failed=backend_failure(e))
+            raise
+        finally:
+            ticket.release()
+        lease.release()
+        return result
+
+    result = await with_retries(attempt, retry_policy, model)
+    return result["embeddings"], result.get("prompt_eval_count", 0)
+
+
+def timed(response: Response, timing: RequestTiming, **fields) -> Response:
+    """Attach ``Server-Timing``; log and audit the request once it is done."""
+    response.headers["Server-Timing"] = timing.header()
+
+    def done():
+        event = timing.emit(status=response.status_code, **fields)
+        if event is not None and audit is not None:
+            audit.record(event)
+
+    if not isinstance(response, SSEResponse):
+        done()
+        return response
+
+    close = response.on_close
+
+    async def closed():
+        if close is not None:
+            await close()
+        done()
+
+    response.on_close = closed
+    return response
+
+
+class UpstreamCall:
+    """A chat that reached Ollama: its lease, slot, metrics and reply."""
+
+    __slots__ = ("lease", "ticket", "metrics", "sent", "reply")
+
+    def __init__(self, lease, ticket, metrics: RequestMetrics, sent: float, reply: Any):
+        self.lease = lease
+        self.ticket = ticket
+        self.metrics = metrics
+        self.sent = sent
+        self.reply = reply
+
+
+async def dispatch_chat(
+    ollama_payload: dict,
+    key: str,
+    policy: Policy,
+    timing: Optional[RequestTiming] = None
+):
+    """Send a chat to the warmest, least loaded backend that serves its model.
+
+    The request waits for a slot on that backend's model gate first; the
+    time spent queued is returned in ``X-Queue-Wait-Ms``. A call that
+    fails before the first byte is retried on another backend; a slow
+    non-streaming deterministic call may be hedged (see
+    ``gateway.resilience``). Keys with a tokens-per-minute allowance
+    reserve an estimate up front, settle against Ollama's eval counts,
+    and have streams cut off mid-way once the allowance is spent. Phase
+    timings and Ollama's durations are recorded on ``timing``.
+
+    ``key`` is the hex SHA-256 of the caller's API key, so interactive
+    chats and batch lines of one key share a token budget and queue.
+    """
+    timing = timing or RequestTiming()
+    model = ollama_payload["model"]
+    reservation = token_budget.reserve(
+        key,
+        ollama_payload["messages"],
+        ollama_payload["options"].get("num_predict"),
+        policy.tokens_per_minute
+    )
+    prefix = prefix_key(model, ollama_payload["messages"])
+
+    async def attempt(tried: Set[str]) -> UpstreamCall:
+        lease = pool.acquire(model, affinity=prefix, exclude=tried)
+        tried.add(lease.backend.host)
+        try:
+            ticket = await admission.acquire(lease.backend.host, model, key, policy.weight)
+        except BaseException:
+            lease.release()
+            raise
+        timing.mark("queue")
+        sent = time.monotonic()
+        request_metrics = RequestMetrics(model, policy.id, lease.backend.host, ticket.wait, sent)
+        url = upstream.url("/api/chat", lease.backend.host)
+        try:
+            if ollama_payload["stream"]:
+                reply = await upstream.open_stream(url, ollama_payload)
+            else:
+                reply = await upstream.post_json(url, ollama_payload)
+        except BaseException as e:
+            # Hedge losers and disconnected clients are cancelled, not failed.
+            failed = backend_failure(e)
+            request_metrics.end(time.monotonic(), failed=failed, abandoned=isinstance(e, asyncio.CancelledError))
+            lease.release(failed=failed)
+            ticket.release()
+            raise
+        lease.observe(sent)
+        return UpstreamCall(lease, ticket, request_metrics, sent, reply)
+
+    def discard(call: UpstreamCall) -> None:
+        # A hedged call that answered too but lost the race.
+        call.metrics.end(time.monotonic())
+        call.lease.release()
+        call.ticket.release()
+
+    hedge_after = None
+    if HEDGE_ENABLED and not ollama_payload["stream"] and is_deterministic(ollama_payload["options"]):
+        if len(pool.candidates(model)) > 1:
+            hedge_after = latencies.hedge_delay(model)
+    try:
+        if hedge_after is not None:
+            call = await with_retries(
+                lambda tried: hedged(attempt, hedge_after, tried, model, discard), retry_policy, model
+            )
+        else:
+            call = await with_retries(attempt, retry_policy, model)
+    except BaseException:
+        if reservation is not None:
+            reservation.settle()
+        raise
+    lease, ticket, request_metrics = call.lease, call.ticket, call.metrics
+    timing.fields["backend"] = lease.backend.host
+    headers = {"X-Queue-Wait-Ms": f"{ticket.wait * 1000:.1f}"}
+
+    def finished(response: dict):
+        request_metrics.finished(response)
+        timing.ollama(response)
+        lease.record_response(model, response)
+        prefix_stats.record(prefix, model, lease.backend.host, response)
+        usage.record(policy.id, model, response.get("prompt_eval_count", 0), response.get("eval_count", 0))
+        if reservation is not None:
+            reservation.settle(response)
+
+    def cut_off():
+        # Streams ended by the token budget never see Ollama's final counts.
+        used = reservation.settle()
+        if used:
+            usage.record(policy.id, model, reservation.prompt_estimate, used - reservation.prompt_estimate)
+
+    try:
+        if ollama_payload["stream"]:
+            stream = call.reply
+            timing.mark("connect")
+            stream.on_close(lease.release)
+            stream.on_close(ticket.release)
+            stream.on_close(lambda: request_metrics.end(time.monotonic()))
+            if reservation is not None:
+                stream.on_close(cut_off)
+
+            def allow_chunk(chunk: dict) -> bool:
+                request_metrics.first_token(time.monotonic())
+                return reservation is None or reservation.allow_chunk(chunk)
+
+            return SSEResponse(
+                stream_chat_completion(stream, model, on_done=finished, allow_chunk=allow_chunk),
+                on_close=stream.aclose,
+                headers=headers
+            )
+        result = call.reply
+        timing.mark("upstream")
+        latencies.observe(model, time.monotonic() - call.sent)
+        finished(result)
+        request_metrics.end(time.monotonic())
+        lease.release()
+        ticket.release()
+        body = ollama_response_to_openai(result, new_completion_id(), int(time.time()), model)
+        response = Response(dumps(body), media_type="application/json", headers=headers)
+        timing.mark("serialize")
+        return response
+    except BaseException:
+        request_metrics.end(time.monotonic(), failed=True)
+        lease.release(failed=True)
+        ticket.release()
+        if reservation is not None:
+            reservation.settle()
+        raise
+
+
+def upstream_error(message: str, status_code: int) -> JSONResponse:
+    """OpenAI-style error body for failures talking to Ollama."""
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": "api_error", "code": status_code}}
+    )
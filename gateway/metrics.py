@@ -0,0 +1,324 @@
+"""
+In-process metrics: counters, gauges and fixed-bucket histograms.
+
+Each metric keeps one child per label combination; ``labels(...)`` is a
+dict lookup and recording is a few attribute updates, so instrumenting a
+request costs a few microseconds (see ``benchmarks/bench_metrics.py``).
+Metrics are updated from the event loop thread.
+
+``Registry.expose`` renders the Prometheus text format for ``/metrics``
+and ``Registry.snapshot`` the JSON for ``/admin/metrics``, both in
+O(series) from the values already held here; nothing is scanned or
+fetched at read time.
+
+API keys never appear in labels; ``key_label`` turns them into a short
+stable digest.
+"""
+
+import hashlib
+import math
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TTFT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 40, 60, 80, 120, 200, 400)
+
+
+@lru_cache(maxsize=4096)
+def key_label(key: str) -> str:
+    return "key-" + hashlib.sha256(key.encode()).hexdigest()[:8]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # One slot per bucket plus the +Inf overflow.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple[str, ...], object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self.children[values] = self._new_child()
+        return child
+
+    def expose(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for values, child in self.children.items():
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+    def snapshot(self) -> List[Dict[str, object]]:
+        return [
+            {"labels": dict(zip(self.labelnames, values)), "value": child.value}
+            for values, child in self.children.items()
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self) -> CounterChild:
+        return CounterChild()
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self) -> GaugeChild:
+        return GaugeChild()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def expose(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for values, child in self.children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {child.count}"
+
+    def snapshot(self) -> List[Dict[str, object]]:
+        return [
+            {
+                "labels": dict(zip(self.labelnames, values)),
+                "count": child.count,
+                "sum": round(child.sum, 6),
+                "avg": round(child.sum / child.count, 6) if child.count else None,
+                "p50": child.quantile(0.5),
+                "p95": child.quantile(0.95),
+                "p99": child.quantile(0.99),
+            }
+            for values, child in self.children.items()
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def expose(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, List[Dict[str, object]]]:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter(
+    "gateway_requests_total", "Chat completions dispatched to Ollama.", ("model", "key", "backend")
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "gateway_upstream_errors_total", "Chat completions that failed upstream.", ("model", "backend")
+)
+ABANDONED = REGISTRY.counter(
+    "gateway_upstream_abandoned_total",
+    "Chat completions cancelled before Ollama answered (hedge losers, client disconnects).",
+    ("model", "backend"),
+)
+TOKENS = REGISTRY.counter(
+    "gateway_tokens_total", "Prompt and completion tokens reported by Ollama.", ("model", "key", "kind")
+)
+INFLIGHT = REGISTRY.gauge(
+    "gateway_inflight_requests", "Chat completions currently being generated.", ("model", "backend")
+)
+REQUEST_LATENCY = REGISTRY.histogram(
+    "gateway_request_duration_seconds",
+    "Time from dispatch to the last byte from Ollama.",
+    ("model", "key", "backend"),
+)
+TTFT = REGISTRY.histogram(
+    "gateway_time_to_first_token_seconds",
+    "Time from dispatch to the first generated token.",
+    ("model", "backend"),
+    TTFT_BUCKETS,
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    "gateway_queue_wait_seconds", "Time spent waiting for an admission slot.", ("model", "backend"), TTFT_BUCKETS
+)
+TOKENS_PER_SECOND = REGISTRY.histogram(
+    "gateway_tokens_per_second",
+    "Generation speed from Ollama's eval_count / eval_duration.",
+    ("model", "backend"),
+    TOKENS_PER_SECOND_BUCKETS,
+)
+
+
+class RequestMetrics:
+    """Records one dispatched chat completion; ``end`` is idempotent."""
+
+    __slots__ = ("model", "key", "backend", "started", "first_token_at", "inflight", "ended")
+
+    def __init__(self, model: str, key: str, backend: str, queue_wait: float, started: float):
+        # ``key`` is already a label (the policy id), never the API key itself.
+        self.model = model
+        self.key = key
+        self.backend = backend
+        self.started = started
+        self.first_token_at: Optional[float] = None
+        self.ended = False
+        QUEUE_WAIT.labels(model, backend).observe(queue_wait)
+        self.inflight = INFLIGHT.labels(model, backend)
+        self.inflight.inc()
+
+    def first_token(self, now: float) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = now
+            TTFT.labels(self.model, self.backend).observe(now - self.started)
+
+    def finished(self, response: Dict[str, object]) -> None:
+        """Count Ollama's tokens and generation speed from its final chunk."""
+        prompt = response.get("prompt_eval_count") or 0
+        completion = response.get("eval_count") or 0
+        TOKENS.labels(self.model, self.key, "prompt").inc(prompt)
+        TOKENS.labels(self.model, self.key, "completion").inc(completion)
+        eval_duration = response.get("eval_duration") or 0
+        if completion and eval_duration:
+            TOKENS_PER_SECOND.labels(self.model, self.backend).observe(completion / (eval_duration / 1e9))
+        if self.first_token_at is None:
+            # Non-streamed: Ollama's load + prompt evaluation is the wait before the first token.
+            ns = (response.get("load_duration") or 0) + (response.get("prompt_eval_duration") or 0)
+            if ns:
+                self.first_token_at = self.started + ns / 1e9
+                TTFT.labels(self.model, self.backend).observe(ns / 1e9)
+
+    def end(self, now: float, failed: bool = False, abandoned: bool = False) -> None:
+        """Count the request once; an abandoned one has no meaningful duration."""
+        if self.ended:
+            return
+        self.ended = True
+        self.inflight.dec()
+        REQUESTS.labels(self.model, self.key, self.backend).inc()
+        if abandoned:
+            ABANDONED.labels(self.model, self.backend).inc()
+        else:
+            REQUEST_LATENCY.labels(self.model, self.key, self.backend).observe(now - self.started)
+        if failed:
+            UPSTREAM_ERRORS.labels(self.model, self.backend).inc()
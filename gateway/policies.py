@@ -1,16 +1,34 @@
+"""
 This is where the magic becomes visible.
 
+Each API key = one personality.
+
+``weight`` is the key's share of a busy model's queue relative to other
+keys (default 1). ``keep_alive`` (optional) is how long Ollama keeps the
+model loaded after this key's requests, e.g. "30m" for a long system
+prompt worth keeping evaluated. ``rate_limit`` (optional) overrides
+RATE_LIMIT_REQUESTS for this key, and ``tokens_per_minute`` (optional)
+overrides TOKENS_PER_MINUTE.
+
+``semantic_cache`` (optional) answers paraphrases of earlier questions
+from the semantic cache: ``True`` for the defaults, or
+``{"threshold": 0.95, "ttl": 600}`` for the minimum cosine similarity
+and the seconds a stored completion may be served (defaults
+SEMANTIC_CACHE_THRESHOLD and SEMANTIC_CACHE_TTL). Only suits keys whose
+answers don't depend on wording, like a support bot's FAQ.
+"""
+
 POLICIES = {
     "dev-key-123": {
         "model": "deepseek-coder",
         "temperature": 0.1,
-        "system_prompt": "You are a strict senior engineer. Be precise. No speculation."
+        "system_prompt": "You are a strict senior engineer. Be precise. No speculation.",
+        "weight": 2
     },
     "creative-key-456": {
         "model": "llama3",
         "temperature": 0.8,
-        "system_prompt": "You are a creative assistant. Be expressive and helpful."
+        "system_prompt": "You are a creative assistant. Be expressive and helpful.",
+        "weight": 1
     }
 }
-
-Each API key = one personality.
@@ -0,0 +1,294 @@
+"""
+Circuit breakers, retries and hedged requests for Ollama calls.
+
+Every ``Backend`` has a ``CircuitBreaker``. While closed it keeps the
+outcomes of the last ``BREAKER_WINDOW_SECONDS``; once at least
+``BREAKER_MIN_REQUESTS`` are in the window and either the share of
+failures reaches ``BREAKER_ERROR_RATE`` or the share of calls slower
+than ``BREAKER_SLOW_SECONDS`` (to response headers for streams, to the
+full body otherwise) reaches ``BREAKER_SLOW_RATE``, it opens and routing
+skips the node. After ``BREAKER_OPEN_SECONDS`` it turns half-open and
+lets ``BREAKER_HALF_OPEN_REQUESTS`` trial requests through at a time;
+that many successes close it, any failure opens it again. Failures are
+connection errors, timeouts and 5xx answers, not 4xx answers or callers
+hanging up. When every node serving a model is open, routing ignores the
+breakers rather than refuse the request.
+
+``with_retries`` retries a call that failed before the first byte of the
+response (a connection error, a timeout waiting for headers or a 5xx) up
+to ``UPSTREAM_RETRIES`` times on other nodes where possible, sleeping a
+random time up to ``UPSTREAM_RETRY_BACKOFF_MS`` * 2^n (capped at
+``UPSTREAM_RETRY_MAX_BACKOFF_MS``) in between ("full jitter").
+
+``hedged`` sends a non-streaming call to a second node if the first has
+not answered after the model's recent p95 latency (``LatencyTracker``),
+keeps the first answer and cancels the other call. ``main`` only hedges
+deterministic requests, with ``HEDGE_ENABLED`` set and at least two
+usable nodes, since hedging spends spare capacity to cut the tail.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Mapping, Optional, Set, Tuple, TypeVar
+
+import httpx
+
+from gateway.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = REGISTRY.gauge(
+    "gateway_backend_breaker_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open.", ("backend",)
+)
+BREAKER_TRIPS = REGISTRY.counter("gateway_backend_breaker_trips_total", "Times a breaker opened.", ("backend",))
+RETRIES = REGISTRY.counter("gateway_upstream_retries_total", "Upstream calls retried after a failure.", ("model",))
+HEDGES = REGISTRY.counter(
+    "gateway_hedged_requests_total", "Hedged calls sent, by which call answered first.", ("model", "winner")
+)
+
+
+def backend_failure(error: BaseException) -> bool:
+    """Whether ``error`` says the node is unwell (as opposed to the request or caller)."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+@dataclass(frozen=True)
+class BreakerSettings:
+    window: float = 30.0
+    min_requests: int = 10
+    error_rate: float = 0.5
+    slow_seconds: float = 30.0
+    slow_rate: float = 0.8
+    open_seconds: float = 15.0
+    half_open_requests: int = 2
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "BreakerSettings":
+        return cls(
+            float(env.get("BREAKER_WINDOW_SECONDS", "30")),
+            int(env.get("BREAKER_MIN_REQUESTS", "10")),
+            float(env.get("BREAKER_ERROR_RATE", "0.5")),
+            float(env.get("BREAKER_SLOW_SECONDS", "30")),
+            float(env.get("BREAKER_SLOW_RATE", "0.8")),
+            float(env.get("BREAKER_OPEN_SECONDS", "15")),
+            int(env.get("BREAKER_HALF_OPEN_REQUESTS", "2")),
+        )
+
+
+BREAKER_SETTINGS = BreakerSettings.from_env()
+
+
+class CircuitBreaker:
+    """Closed / open / half-open state of one backend."""
+
+    def __init__(self, name: str, settings: BreakerSettings = BREAKER_SETTINGS):
+        self.name = name
+        self.settings = settings
+        self.state = CLOSED
+        # (time, failed, slow) for calls finished while closed
+        self.outcomes: Deque[Tuple[float, bool, bool]] = deque()
+        self.failures = 0
+        self.slow = 0
+        self.opened_at = 0.0
+        self.trials = 0
+        self.successes = 0
+        self.trips = 0
+        BREAKER_STATE.labels(name).set(0)
+
+    def _set(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker for {self.name}: {self.state} -> {state}")
+        self.state = state
+        BREAKER_STATE.labels(self.name).set(STATE_VALUES[state])
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """Whether routing may send a request here now."""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic() if now is None else now
+        if self.state == OPEN and now - self.opened_at >= self.settings.open_seconds:
+            self._set(HALF_OPEN)
+            self.trials = self.successes = 0
+        return self.state == HALF_OPEN and self.trials < self.settings.half_open_requests
+
+    def started(self) -> None:
+        if self.state == HALF_OPEN:
+            self.trials += 1
+
+    def abandoned(self) -> None:
+        """A started request ended without telling us anything about the node."""
+        if self.state == HALF_OPEN and self.trials > 0:
+            self.trials -= 1
+
+    def record(self, failed: bool, latency: float = 0.0, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        if self.state == HALF_OPEN:
+            self.abandoned()
+            if failed:
+                self._trip(now)
+            else:
+                self.successes += 1
+                if self.successes >= self.settings.half_open_requests:
+                    self._set(CLOSED)
+            return
+        if self.state == OPEN:
+            return
+        slow = latency >= self.settings.slow_seconds > 0
+        self.outcomes.append((now, failed, slow))
+        self.failures += failed
+        self.slow += slow
+        horizon = now - self.settings.window
+        while self.outcomes and self.outcomes[0][0] < horizon:
+            _, old_failed, old_slow = self.outcomes.popleft()
+            self.failures -= old_failed
+            self.slow -= old_slow
+        total = len(self.outcomes)
+        if total >= self.settings.min_requests and (
+            self.failures >= self.settings.error_rate * total or self.slow >= self.settings.slow_rate * total
+        ):
+            self._trip(now)
+
+    def _trip(self, now: float) -> None:
+        self.opened_at = now
+        self.trips += 1
+        self.outcomes.clear()
+        self.failures = self.slow = 0
+        BREAKER_TRIPS.labels(self.name).inc()
+        self._set(OPEN)
+
+    def snapshot(self) -> Dict[str, Any]:
+        total = len(self.outcomes)
+        return {
+            "state": self.state,
+            "window_requests": total,
+            "window_error_rate": round(self.failures / total, 4) if total else 0.0,
+            "trips": self.trips,
+        }
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    retries: int = 2
+    backoff: float = 0.1
+    max_backoff: float = 2.0
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "RetryPolicy":
+        return cls(
+            int(env.get("UPSTREAM_RETRIES", "2")),
+            float(env.get("UPSTREAM_RETRY_BACKOFF_MS", "100")) / 1000.0,
+            float(env.get("UPSTREAM_RETRY_MAX_BACKOFF_MS", "2000")) / 1000.0,
+        )
+
+    def delay(self, retry: int) -> float:
+        """Full-jitter backoff before retry number ``retry`` (1-based)."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (retry - 1)))
+
+
+# attempt(tried) picks a node not in ``tried`` when it can and adds the one it used.
+Attempt = Callable[[Set[str]], Awaitable[T]]
+
+
+async def with_retries(attempt: Attempt, policy: RetryPolicy, model: str = "") -> T:
+    tried: Set[str] = set()
+    retry = 0
+    while True:
+        try:
+            return await attempt(tried)
+        except Exception as e:
+            if retry >= policy.retries or not backend_failure(e):
+                raise
+            retry += 1
+            RETRIES.labels(model).inc()
+            logger.warning(f"Retrying {model} after {type(e).__name__}: {e} (retry {retry}/{policy.retries})")
+            await asyncio.sleep(policy.delay(retry))
+
+
+async def hedged(
+    attempt: Attempt, delay: float, tried: Set[str], model: str = "", discard: Optional[Callable[[T], Any]] = None
+) -> T:
+    """``attempt`` once, and again on another node if the first is slower than ``delay``.
+
+    Every successful result other than the one returned, including one that
+    finished together with the winner, is handed to ``discard``.
+    """
+    primary = asyncio.ensure_future(attempt(tried))
+    tasks = [primary]
+    winner: Optional[asyncio.Future] = None
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            winner = primary
+            return primary.result()
+        secondary = asyncio.ensure_future(attempt(tried))
+        tasks.append(secondary)
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                    HEDGES.labels(model, "hedge" if task is secondary else "primary").inc()
+                    return task.result()
+                error = task.exception()
+        HEDGES.labels(model, "none").inc()
+        raise error
+    finally:
+        losers = [task for task in tasks if task is not winner]
+        for task in losers:
+            task.cancel()
+        if losers:
+            await asyncio.gather(*losers, return_exceptions=True)
+        for task in losers:
+            if discard is not None and not task.cancelled() and task.exception() is None:
+                discard(task.result())
+
+
+class LatencyTracker:
+    """Recent latencies per model, for the hedging delay."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20, min_delay: float = 0.05):
+        self.size = size
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.samples: Dict[str, Deque[float]] = {}
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "LatencyTracker":
+        return cls(
+            int(env.get("HEDGE_WINDOW", "200")),
+            int(env.get("HEDGE_MIN_SAMPLES", "20")),
+            float(env.get("HEDGE_MIN_DELAY_MS", "50")) / 1000.0,
+        )
+
+    def observe(self, model: str, seconds: float) -> None:
+        samples = self.samples.get(model)
+        if samples is None:
+            samples = self.samples[model] = deque(maxlen=self.size)
+        samples.append(seconds)
+
+    def p95(self, model: str) -> Optional[float]:
+        samples = self.samples.get(model)
+        if samples is None or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """How long to wait before hedging, or None until enough samples."""
+        p95 = self.p95(model)
+        return None if p95 is None else max(p95, self.min_delay)
@@ -0,0 +1,401 @@
+"""
+Semantic response cache: serve a stored completion for a paraphrase.
+
+Keys opt in with ``semantic_cache`` in their policy (see
+``gateway/policies.py``). For a non-streaming chat request under such a
+key, the final user turn is embedded (``SEMANTIC_CACHE_MODEL``, by
+default ``EMBEDDING_MODEL``) and searched among earlier completions with
+the same scope: the same policy, model, system prompt and earlier turns,
+so only the last question may differ. If the nearest stored prompt has a cosine
+similarity of at least the policy's ``threshold`` and is younger than
+its ``ttl``, its completion is returned; otherwise the generated
+completion is stored under the new embedding. A scope with nothing
+stored yet is not searched, and its prompt is only embedded when the
+completion is stored.
+
+Each scope has its own ``VectorIndex`` of unit vectors in NumPy arrays,
+searched with one matrix-vector product per inverted list. Small indexes
+are flat (one list, exact search). Once an index reaches
+``SEMANTIC_CACHE_IVF_MIN`` entries it is clustered (spherical k-means,
+about ``SEMANTIC_CACHE_LIST_SIZE`` vectors per list) in a worker thread
+and a lookup only scans the ``SEMANTIC_CACHE_NPROBE`` lists nearest to
+the query; it is re-clustered whenever it has doubled since.
+
+At most ``SEMANTIC_CACHE_MAX_ENTRIES`` completions are kept. Expired
+entries are dropped first, then those nearest to expiry; TTLs differ per
+policy, so this is not insertion order. NumPy is required; without it
+the cache is disabled.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+from gateway.metrics import REGISTRY
+from gateway.transform import dumps
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; the semantic cache is disabled without it
+    np = None
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05)
+
+SEMANTIC_LOOKUPS = REGISTRY.counter(
+    "gateway_semantic_cache_lookups_total", "Semantic cache lookups.", ("key", "result")
+)
+SEMANTIC_LOOKUP_SECONDS = REGISTRY.histogram(
+    "gateway_semantic_cache_lookup_seconds",
+    "Time to search the semantic cache index, excluding the query embedding.",
+    (),
+    LOOKUP_BUCKETS,
+)
+
+# (model, inputs) -> (embeddings, prompt tokens)
+Embed = Callable[[str, List[str]], Awaitable[Tuple[List[List[float]], int]]]
+
+
+@dataclass(frozen=True)
+class SemanticSettings:
+    """A policy's ``semantic_cache``: ``true`` or ``{threshold, ttl}``."""
+
+    threshold: float = 0.92
+    ttl: float = 3600.0
+
+    @classmethod
+    def compile(cls, spec: Any, env: Mapping[str, str] = os.environ) -> Optional["SemanticSettings"]:
+        if not spec:
+            return None
+        spec = spec if isinstance(spec, Mapping) else {}
+        return cls(
+            float(spec.get("threshold", env.get("SEMANTIC_CACHE_THRESHOLD", "0.92"))),
+            float(spec.get("ttl", env.get("SEMANTIC_CACHE_TTL", "3600"))),
+        )
+
+
+def semantic_query(policy_id: str, ollama_payload: Mapping[str, Any]) -> Optional[Tuple[str, str]]:
+    """(scope, text) for a request ending in a user turn, else None."""
+    messages = ollama_payload["messages"]
+    if not messages or messages[-1].get("role") != "user" or not isinstance(messages[-1].get("content"), str):
+        return None
+    context = dumps([policy_id, ollama_payload["model"], messages[:-1]])
+    return hashlib.sha256(context).hexdigest(), messages[-1]["content"]
+
+
+def unit(vector: List[float]) -> "np.ndarray":
+    query = np.asarray(vector, dtype=np.float32)
+    query /= max(float(np.linalg.norm(query)), 1e-12)
+    return query
+
+
+def kmeans(
+    vectors: "np.ndarray", lists: int, iterations: int = 8, seed: int = 0
+) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Spherical k-means on a sample: (unit centroids, list of every vector)."""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), lists * 64), replace=False)]
+    centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = (sample @ centroids.T).argmax(axis=1)
+        order = assignment.argsort(kind="stable")
+        labels, starts = np.unique(assignment[order], return_index=True)
+        sums = centroids.copy()
+        sums[labels] = np.add.reduceat(sample[order], starts)
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    assignment = np.concatenate([
+        (vectors[i:i + 8192] @ centroids.T).argmax(axis=1) for i in range(0, len(vectors), 8192)
+    ])
+    return centroids.astype(np.float32), assignment
+
+
+class _List:
+    """One inverted list: contiguous unit vectors and their entry ids."""
+
+    __slots__ = ("vectors", "ids", "size")
+
+    def __init__(self, vectors: "np.ndarray", ids: "np.ndarray"):
+        self.vectors = vectors
+        self.ids = ids
+        self.size = len(ids)
+
+    @classmethod
+    def empty(cls, dim: int, capacity: int = 64) -> "_List":
+        items = cls(np.empty((capacity, dim), np.float32), np.empty(capacity, np.int64))
+        items.size = 0
+        return items
+
+    def append(self, id: int, vector: "np.ndarray") -> int:
+        if self.size == len(self.ids):
+            capacity = max(2 * self.size, 64)
+            vectors = np.empty((capacity, self.vectors.shape[1]), np.float32)
+            vectors[:self.size] = self.vectors[:self.size]
+            ids = np.empty(capacity, np.int64)
+            ids[:self.size] = self.ids[:self.size]
+            self.vectors, self.ids = vectors, ids
+        self.vectors[self.size] = vector
+        self.ids[self.size] = id
+        self.size += 1
+        return self.size - 1
+
+    def remove(self, pos: int) -> Optional[int]:
+        """Drop the vector at ``pos``; returns the id moved into its place, if any."""
+        self.size -= 1
+        if pos == self.size:
+            return None
+        self.vectors[pos] = self.vectors[self.size]
+        self.ids[pos] = self.ids[self.size]
+        return int(self.ids[pos])
+
+    def best(self, query: "np.ndarray") -> Tuple[int, float]:
+        if not self.size:
+            return -1, -1.0
+        scores = self.vectors[:self.size] @ query
+        pos = int(scores.argmax())
+        return pos, float(scores[pos])
+
+
+class VectorIndex:
+    """Unit vectors of one scope; flat until ``train`` clusters them."""
+
+    def __init__(self, dim: int, nprobe: int = 8, list_size: int = 250):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.list_size = list_size
+        self.centroids: Optional["np.ndarray"] = None
+        self.lists = [_List.empty(dim)]
+        # id -> (list, position)
+        self.where: Dict[int, Tuple[int, int]] = {}
+        self.trained_size = 0
+        self.training = False
+
+    def __len__(self) -> int:
+        return len(self.where)
+
+    @property
+    def mode(self) -> str:
+        return "flat" if self.centroids is None else "ivf"
+
+    def _nearest(self, vector: "np.ndarray") -> int:
+        return 0 if self.centroids is None else int((self.centroids @ vector).argmax())
+
+    def add(self, id: int, vector: "np.ndarray") -> None:
+        nearest = self._nearest(vector)
+        self.where[id] = (nearest, self.lists[nearest].append(id, vector))
+
+    def remove(self, id: int) -> None:
+        nearest, pos = self.where.pop(id)
+        moved = self.lists[nearest].remove(pos)
+        if moved is not None:
+            self.where[moved] = (nearest, pos)
+
+    def search(self, query: "np.ndarray") -> Tuple[Optional[int], float]:
+        """The id of the nearest vector and its cosine similarity."""
+        if self.centroids is None:
+            probe = [0]
+        else:
+            scores = self.centroids @ query
+            count = min(self.nprobe, len(scores))
+            probe = np.argpartition(-scores, count - 1)[:count]
+        best_id, best = None, -1.0
+        for nearest in probe:
+            items = self.lists[nearest]
+            pos, score = items.best(query)
+            if score > best:
+                best_id, best = int(items.ids[pos]), score
+        return best_id, best
+
+    def needs_training(self, minimum: int) -> bool:
+        return not self.training and len(self) >= minimum and len(self) >= 2 * self.trained_size
+
+    async def train(self) -> None:
+        """Re-cluster in a worker thread, then fold in changes made meanwhile."""
+        self.training = True
+        try:
+            ids = np.concatenate([items.ids[:items.size] for items in self.lists])
+            vectors = np.concatenate([items.vectors[:items.size] for items in self.lists])
+            count = max(1, min(len(ids) // self.list_size, len(ids)))
+            centroids, lists, where = await asyncio.to_thread(self._cluster, ids, vectors, count)
+
+            current = self.where
+            for id in [id for id in where if id not in current]:
+                nearest, pos = where.pop(id)
+                moved = lists[nearest].remove(pos)
+                if moved is not None:
+                    where[moved] = (nearest, pos)
+            for id in [id for id in current if id not in where]:
+                nearest, pos = current[id]
+                vector = self.lists[nearest].vectors[pos]
+                target = int((centroids @ vector).argmax())
+                where[id] = (target, lists[target].append(id, vector))
+            self.centroids, self.lists, self.where = centroids, lists, where
+            self.trained_size = len(where)
+        finally:
+            self.training = False
+
+    @staticmethod
+    def _cluster(
+        ids: "np.ndarray", vectors: "np.ndarray", count: int
+    ) -> Tuple["np.ndarray", List[_List], Dict[int, Tuple[int, int]]]:
+        centroids, assignment = kmeans(vectors, count)
+        order = assignment.argsort(kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(count + 1))
+        lists, where = [], {}
+        for nearest in range(count):
+            rows = order[bounds[nearest]:bounds[nearest + 1]]
+            lists.append(_List(vectors[rows], ids[rows]))
+            for pos, id in enumerate(ids[rows].tolist()):
+                where[id] = (nearest, pos)
+        return centroids, lists, where
+
+
+class _Entry:
+    __slots__ = ("scope", "body", "expires")
+
+    def __init__(self, scope: str, body: bytes, expires: float):
+        self.scope = scope
+        self.body = body
+        self.expires = expires
+
+
+class SemanticCache:
+    """Completions indexed by the embedding of the prompt that produced them."""
+
+    def __init__(
+        self,
+        embed: Embed,
+        model: str,
+        max_entries: int = 100_000,
+        ivf_min: int = 20_000,
+        nprobe: int = 8,
+        list_size: int = 250,
+    ):
+        self.embed = embed
+        self.model = model
+        self.max_entries = max_entries
+        self.ivf_min = ivf_min
+        self.nprobe = nprobe
+        self.list_size = list_size
+        self.indexes: Dict[str, VectorIndex] = {}
+        self.entries: Dict[int, _Entry] = {}
+        # (expires, id), popped lazily: ids no longer in entries are skipped.
+        self.expiry: List[Tuple[float, int]] = []
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+        self._tasks: Set[asyncio.Task] = set()
+
+    @classmethod
+    def from_env(cls, embed: Embed, env: Mapping[str, str] = os.environ) -> Optional["SemanticCache"]:
+        if np is None:
+            logger.warning("numpy is not installed; semantic_cache policies are ignored")
+            return None
+        return cls(
+            embed,
+            env.get("SEMANTIC_CACHE_MODEL") or env.get("EMBEDDING_MODEL", "nomic-embed-text"),
+            int(env.get("SEMANTIC_CACHE_MAX_ENTRIES", "100000")),
+            int(env.get("SEMANTIC_CACHE_IVF_MIN", "20000")),
+            int(env.get("SEMANTIC_CACHE_NPROBE", "8")),
+            int(env.get("SEMANTIC_CACHE_LIST_SIZE", "250")),
+        )
+
+    async def lookup(
+        self,
+        settings: SemanticSettings,
+        scope: str,
+        text: str,
+        key: str = "",
+    ) -> Tuple[Optional[Tuple[bytes, float]], Optional["np.ndarray"]]:
+        """((body, similarity) or None, the query's unit embedding).
+
+        The embedding is None when the scope has no entries to search;
+        ``store`` computes it if the completion is kept.
+        """
+        hit, query = None, None
+        if scope in self.indexes:
+            vectors, _ = await self.embed(self.model, [text])
+            query = unit(vectors[0])
+
+            started = time.perf_counter()
+            index = self.indexes.get(scope)
+            if index is not None and index.dim == len(query):
+                id, similarity = index.search(query)
+                if id is not None and similarity >= settings.threshold:
+                    entry = self.entries[id]
+                    if entry.expires > time.time():
+                        hit = entry.body, similarity
+                    else:
+                        self._remove(id)
+            elapsed = time.perf_counter() - started
+            self.lookup_seconds += elapsed
+            SEMANTIC_LOOKUP_SECONDS.labels().observe(elapsed)
+
+        if hit is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        SEMANTIC_LOOKUPS.labels(key, "hit" if hit is not None else "miss").inc()
+        return hit, query
+
+    async def store(
+        self, settings: SemanticSettings, scope: str, text: str, query: Optional["np.ndarray"], body: bytes
+    ) -> None:
+        """``put`` after a miss, embedding ``text`` if ``lookup`` did not."""
+        if query is None:
+            vectors, _ = await self.embed(self.model, [text])
+            query = unit(vectors[0])
+        self.put(settings, scope, query, body)
+
+    def put(self, settings: SemanticSettings, scope: str, query: "np.ndarray", body: bytes) -> None:
+        now = time.time()
+        expiry = self.expiry
+        while expiry and (expiry[0][0] <= now or len(self.entries) >= self.max_entries):
+            expires, id = heapq.heappop(expiry)
+            entry = self.entries.get(id)
+            if entry is not None and entry.expires == expires:
+                self._remove(id)
+
+        index = self.indexes.get(scope)
+        if index is not None and index.dim != len(query):
+            for id in list(index.where):
+                self._remove(id)
+            index = None
+        if index is None:
+            index = self.indexes[scope] = VectorIndex(len(query), self.nprobe, self.list_size)
+        id = self.next_id
+        self.next_id += 1
+        self.entries[id] = _Entry(scope, body, now + settings.ttl)
+        heapq.heappush(expiry, (now + settings.ttl, id))
+        index.add(id, query)
+        if index.needs_training(self.ivf_min):
+            task = asyncio.get_running_loop().create_task(index.train())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _remove(self, id: int) -> None:
+        entry = self.entries.pop(id)
+        index = self.indexes[entry.scope]
+        index.remove(id)
+        if not len(index) and not index.training:
+            del self.indexes[entry.scope]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        modes: Dict[str, int] = {}
+        for index in self.indexes.values():
+            modes[index.mode] = modes.get(index.mode, 0) + 1
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.entries),
+            "indexes": modes,
+            "mean_lookup_ms": round(1000 * self.lookup_seconds / lookups, 4) if lookups else 0.0,
+        }
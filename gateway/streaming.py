@@ -0,0 +1,124 @@
+"""
+Server-sent events pipeline for ``stream: true`` chat completions.
+
+Ollama's ``/api/chat`` answers with one JSON object per line. Each line is
+turned into an OpenAI ``chat.completion.chunk`` frame and handed to the
+client as soon as it arrives. The next line is only read after the
+previous frame has been sent, so a slow client slows the upstream read
+instead of growing a buffer. When the client goes away the upstream
+request is closed so Ollama stops generating.
+
+The first and last frames are built as dicts; every content chunk in
+between is spliced into the stream's ``ChunkTemplate``. As with OpenAI,
+a finished stream ends with a ``data: [DONE]`` line. If Ollama's stream
+ends without its ``done`` line (a node crash or a proxy cutting the
+connection), the client gets an error frame and ``data: [DONE]`` rather
+than a silently truncated answer, and the truncation is logged and
+counted in ``gateway_stream_truncations_total``.
+"""
+
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from gateway.metrics import REGISTRY
+from gateway.transform import ChunkTemplate, dumps, loads, new_completion_id, ollama_chunk_to_openai
+from gateway.upstream import UpstreamStream
+
+logger = logging.getLogger(__name__)
+
+SSE_DONE = b"data: [DONE]\n\n"
+
+TRUNCATIONS = REGISTRY.counter(
+    "gateway_stream_truncations_total", "Ollama streams that ended without a done chunk.", ("model",)
+)
+
+
+def sse_frame(data: Dict[str, Any]) -> bytes:
+    return b"data: " + dumps(data) + b"\n\n"
+
+
+async def stream_chat_completion(
+    stream: UpstreamStream,
+    model: str,
+    on_done: Optional[Callable[[Dict[str, Any]], None]] = None,
+    allow_chunk: Optional[Callable[[Dict[str, Any]], bool]] = None,
+) -> AsyncIterator[bytes]:
+    """Yield SSE frames for an open Ollama chat stream, closing it at the end.
+
+    ``on_done`` receives the final chunk, which carries Ollama's counters
+    and durations. ``allow_chunk`` sees every chunk before it is sent;
+    when it returns False the stream ends with ``finish_reason: "length"``
+    and the upstream request is closed.
+    """
+    completion_id = new_completion_id()
+    created = int(time.time())
+    first = True
+    template: Optional[ChunkTemplate] = None
+    try:
+        async for line in stream.aiter_lines():
+            if not line:
+                continue
+            chunk = loads(line)
+            if "error" in chunk:
+                logger.error(f"Ollama stream error: {chunk['error']}")
+                yield sse_frame({"error": {"message": chunk["error"], "type": "api_error", "code": 502}})
+                return
+            if allow_chunk is not None and not allow_chunk(chunk):
+                cutoff = {"done": True, "done_reason": "length"}
+                yield sse_frame(ollama_chunk_to_openai(cutoff, completion_id, created, model, first))
+                yield SSE_DONE
+                return
+            if template is not None and not chunk.get("done"):
+                yield template.frame((chunk.get("message") or {}).get("content"))
+                continue
+            yield sse_frame(ollama_chunk_to_openai(chunk, completion_id, created, model, first))
+            if first:
+                template = ChunkTemplate(completion_id, created, chunk.get("model", model))
+                first = False
+            if chunk.get("done"):
+                if on_done is not None:
+                    on_done(chunk)
+                yield SSE_DONE
+                return
+        logger.warning(f"Ollama stream for {model} ended without a done chunk")
+        TRUNCATIONS.labels(model).inc()
+        message = "Upstream stream ended before the completion finished"
+        yield sse_frame({"error": {"message": message, "type": "api_error", "code": 502}})
+        yield SSE_DONE
+    finally:
+        await stream.aclose()
+
+
+class SSEResponse(StreamingResponse):
+    """``StreamingResponse`` that always closes its iterator.
+
+    Starlette stops iterating when the client disconnects but leaves the
+    generator for the garbage collector; closing it here is what aborts
+    the upstream request promptly. ``on_close`` also runs when the body
+    was never iterated at all.
+    """
+
+    media_type = "text/event-stream"
+
+    def __init__(
+        self,
+        content: AsyncIterator[bytes],
+        on_close: Optional[Callable[[], Awaitable[None]]] = None,
+        **kwargs: Any,
+    ):
+        self.on_close = on_close
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        headers.update(kwargs.pop("headers", None) or {})
+        super().__init__(content, headers=headers, **kwargs)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            if self.on_close is not None:
+                await self.on_close()
@@ -0,0 +1,117 @@
+"""
+Per-request latency breakdown.
+
+``RequestTiming`` splits a request into the gateway's own phases and
+Ollama's reported durations:
+
+* ``parse``: from the first byte reaching the gateway until the handler
+  runs (body read and JSON decode);
+* ``auth``: API key lookup and rate limits;
+* ``queue``: routing plus waiting for an admission slot;
+* ``upstream``: connecting to Ollama and moving bytes, i.e. the round
+  trip minus Ollama's ``total_duration``; streams record ``connect``
+  instead, the time until Ollama answered with headers;
+* ``load``, ``prompt_eval``, ``eval``: Ollama's ``load_duration``,
+  ``prompt_eval_duration`` and ``eval_duration``;
+* ``serialize``: building the response body.
+
+The phases go out as a ``Server-Timing`` header, and once the request
+is finished as one JSON event on the ``gateway.events`` logger. Streamed
+responses send their headers before Ollama has reported anything, so
+their header carries the gateway phases only; the event has them all.
+"""
+
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+event_logger = logging.getLogger("gateway.events")
+
+OLLAMA_PHASES = (
+    ("load", "load_duration"),
+    ("prompt_eval", "prompt_eval_duration"),
+    ("eval", "eval_duration"),
+)
+
+
+class TimingMiddleware:
+    """Stamps when a request arrived so handlers can time their parse phase."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["received"] = time.perf_counter()
+        await self.app(scope, receive, send)
+
+
+class RequestTiming:
+    """Phase durations for one request, in seconds."""
+
+    __slots__ = ("received", "last", "phases", "fields", "emitted")
+
+    def __init__(self, received: Optional[float] = None):
+        self.received = time.perf_counter() if received is None else received
+        self.last = self.received
+        self.phases: Dict[str, float] = {}
+        self.fields: Dict[str, Any] = {}
+        self.emitted = False
+
+    def mark(self, phase: str) -> float:
+        """Charge the time since the previous mark to ``phase``."""
+        now = time.perf_counter()
+        elapsed = now - self.last
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+        self.last = now
+        return elapsed
+
+    def ollama(self, response: Dict[str, Any]) -> None:
+        """Take Ollama's own durations from a final response or chunk."""
+        for phase, field in OLLAMA_PHASES:
+            ns = response.get(field)
+            if ns:
+                self.phases[phase] = ns / 1e9
+        total = response.get("total_duration")
+        if total and "upstream" in self.phases:
+            self.phases["upstream"] = max(0.0, self.phases["upstream"] - total / 1e9)
+        eval_count = response.get("eval_count")
+        eval_duration = response.get("eval_duration")
+        if eval_count and eval_duration:
+            self.fields["tokens_per_sec"] = round(eval_count / (eval_duration / 1e9), 1)
+        self.fields["prompt_tokens"] = response.get("prompt_eval_count", 0)
+        self.fields["completion_tokens"] = response.get("eval_count", 0)
+
+    def header(self) -> str:
+        parts = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in self.phases.items()]
+        tokens_per_sec = self.fields.get("tokens_per_sec")
+        if tokens_per_sec is not None:
+            parts.append(f'tps;desc="{tokens_per_sec}"')
+        parts.append(f"total;dur={(time.perf_counter() - self.received) * 1000:.1f}")
+        return ", ".join(parts)
+
+    def event(self, **fields: Any) -> Dict[str, Any]:
+        return {
+            "event": "request",
+            "ts": round(time.time(), 3),
+            **self.fields,
+            **fields,
+            "timings_ms": {phase: round(seconds * 1000, 1) for phase, seconds in self.phases.items()},
+            "total_ms": round((time.perf_counter() - self.received) * 1000, 1),
+        }
+
+    def emit(self, **fields: Any) -> Optional[Dict[str, Any]]:
+        """Log the request's event once and return it; later calls return None."""
+        if self.emitted:
+            return None
+        self.emitted = True
+        event = self.event(**fields)
+        if event_logger.isEnabledFor(logging.INFO):
+            event_logger.info(
+                json.dumps(event, separators=(",", ":")),
+                extra={"fields": event, "route": event.get("route")}
+            )
+        return event
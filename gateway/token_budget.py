@@ -0,0 +1,165 @@
+"""
+Tokens-per-minute quotas charged from Ollama's real eval counts.
+
+Each key has a token bucket holding up to its per-minute allowance and
+refilling continuously. A request goes through three steps:
+
+1. ``reserve`` takes an estimate up front (prompt characters / 4 plus
+   ``max_tokens`` or ``DEFAULT_COMPLETION_TOKENS``) and refuses the
+   request if the bucket cannot cover it.
+2. ``Reservation.settle`` corrects the bucket with the actual
+   ``prompt_eval_count + eval_count`` once Ollama is done, refunding or
+   charging the difference (the balance may go negative).
+3. For streams, ``Reservation.allow_chunk`` counts each chunk as a token
+   and, once the reserved completion estimate is used up, draws further
+   tokens from the bucket one by one; when the bucket is empty the
+   stream is cut off with ``finish_reason: "length"``.
+
+The allowance is ``TOKENS_PER_MINUTE`` (``rate_limit.tokensperminute``,
+0 disables it) or the policy's ``tokens_per_minute``.
+"""
+
+import asyncio
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from gateway.admission import AdmissionRejected
+
+DEFAULT_COMPLETION_TOKENS = int(os.getenv("DEFAULT_COMPLETION_TOKENS", "256"))
+
+
+class TokenBudgetExceeded(AdmissionRejected):
+    def __init__(self, retry_after: float):
+        super().__init__("Token rate limit exceeded", 429, max(1, math.ceil(retry_after)))
+
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Rough prompt size: ~4 characters per token plus per-message framing."""
+    return sum(len(str(m.get("content") or "")) // 4 + 4 for m in messages)
+
+
+class Reservation:
+    """Tokens held for one request until it is settled."""
+
+    __slots__ = ("budget", "key", "limit", "prompt_estimate", "reserved", "completion_tokens", "settled")
+
+    def __init__(self, budget: "TokenBudget", key: str, limit: int, prompt_estimate: int, reserved: int):
+        self.budget = budget
+        self.key = key
+        self.limit = limit
+        self.prompt_estimate = prompt_estimate
+        self.reserved = reserved
+        self.completion_tokens = 0
+        self.settled = False
+
+    def allow_chunk(self, chunk: Dict[str, Any]) -> bool:
+        """Count a streamed chunk; False means the key is out of tokens."""
+        if chunk.get("done") or not (chunk.get("message") or {}).get("content"):
+            return True
+        self.completion_tokens += 1
+        if self.prompt_estimate + self.completion_tokens <= self.reserved:
+            return True
+        if self.budget.take(self.key, self.limit, 1):
+            self.reserved += 1
+            return True
+        return False
+
+    def settle(self, response: Optional[Dict[str, Any]] = None) -> int:
+        """Charge actual usage (from ``response`` or what was counted)."""
+        if self.settled:
+            return 0
+        self.settled = True
+        if response is not None and ("prompt_eval_count" in response or "eval_count" in response):
+            used = response.get("prompt_eval_count", 0) + response.get("eval_count", 0)
+        elif response is None and not self.completion_tokens:
+            used = 0  # failed before Ollama produced anything
+        else:
+            used = self.prompt_estimate + self.completion_tokens
+        self.budget.adjust(self.key, self.limit, self.reserved - used)
+        return used
+
+
+class TokenBudget:
+    """Per-key token buckets refilled at ``limit / 60`` tokens per second."""
+
+    def __init__(self, tokens_per_minute: int = 0):
+        self.tokens_per_minute = tokens_per_minute
+        # key -> [tokens, last refill time, limit]
+        self.buckets: Dict[str, List[float]] = {}
+
+    @classmethod
+    def from_env(cls) -> "TokenBudget":
+        return cls(int(os.getenv("TOKENS_PER_MINUTE", "0")))
+
+    def _bucket(self, key: str, limit: int, now: Optional[float]) -> List[float]:
+        now = time.monotonic() if now is None else now
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [float(limit), now, limit]
+        else:
+            bucket[0] = min(float(limit), bucket[0] + (now - bucket[1]) * limit / 60.0)
+            bucket[1] = now
+            bucket[2] = limit
+        return bucket
+
+    def reserve(
+        self,
+        key: str,
+        messages: List[Dict[str, Any]],
+        max_tokens: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        now: Optional[float] = None,
+    ) -> Optional[Reservation]:
+        """Hold the estimated tokens or raise ``TokenBudgetExceeded``.
+
+        Returns None when no limit applies to the key.
+        """
+        limit = tokens_per_minute or self.tokens_per_minute
+        if not limit:
+            return None
+        prompt = estimate_tokens(messages)
+        estimate = min(prompt + (max_tokens or DEFAULT_COMPLETION_TOKENS), limit)
+        bucket = self._bucket(key, limit, now)
+        if bucket[0] < estimate:
+            raise TokenBudgetExceeded((estimate - bucket[0]) * 60.0 / limit)
+        bucket[0] -= estimate
+        return Reservation(self, key, limit, prompt, estimate)
+
+    def take(self, key: str, limit: int, tokens: int, now: Optional[float] = None) -> bool:
+        bucket = self._bucket(key, limit, now)
+        if bucket[0] < tokens:
+            return False
+        bucket[0] -= tokens
+        return True
+
+    def adjust(self, key: str, limit: int, tokens: int, now: Optional[float] = None) -> None:
+        bucket = self._bucket(key, limit, now)
+        bucket[0] = min(float(limit), bucket[0] + tokens)
+
+    def remaining(self, key: str, limit: Optional[int] = None, now: Optional[float] = None) -> float:
+        return self._bucket(key, limit or self.tokens_per_minute, now)[0]
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Drop buckets that have refilled completely; return how many."""
+        now = time.monotonic() if now is None else now
+        idle = [
+            key for key, (tokens, last, limit) in self.buckets.items()
+            if tokens + (now - last) * limit / 60.0 >= limit
+        ]
+        for key in idle:
+            del self.buckets[key]
+        return len(idle)
+
+    def tracked(self) -> List[str]:
+        return list(self.buckets)
+
+    def forget(self, keys: List[str]) -> None:
+        for key in keys:
+            self.buckets.pop(key, None)
+
+    async def run_eviction(self, interval: float = 60.0) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
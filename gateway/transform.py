@@ -0,0 +1,203 @@
+"""
+OpenAI <-> Ollama mapping and the JSON codec used on the hot path.
+
+``dumps``/``loads`` use orjson when it is installed and fall back to the
+standard library; ``dumps`` always returns compact UTF-8 bytes.
+
+Requests: ``ChatRequest`` holds the fields of an OpenAI chat request the
+gateway understands, ``ollama_chat`` builds the ``/api/chat`` body, and
+``transform_openai_to_ollama`` combines the two for callers without a
+key policy.
+
+Responses: ``transform_ollama_to_openai`` maps a final ``/api/chat``
+response onto a ``chat.completion`` (or one streamed chunk onto a
+``chat.completion.chunk``). For streams, ``ChunkTemplate`` serializes
+the frame around the delta once per stream, so each content chunk costs
+one JSON string encode and one join instead of a dict tree and a full
+``json.dumps``.
+"""
+
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Mapping, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib codec is ~3x slower
+    orjson = None
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value)
+else:
+    loads = json.loads
+
+    def dumps(value: Any) -> bytes:
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def new_completion_id() -> str:
+    return f"chatcmpl-{uuid.uuid4().hex}"
+
+
+class ChatRequest:
+    """The parts of an OpenAI chat request that map onto Ollama."""
+
+    __slots__ = ("model", "messages", "stream", "temperature", "max_tokens", "top_p", "stop", "seed")
+
+    def __init__(
+        self,
+        model: Optional[str],
+        messages: List[Dict[str, Any]],
+        stream: bool = False,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        top_p: Optional[float] = None,
+        stop: Any = None,
+        seed: Optional[int] = None,
+    ):
+        self.model = model
+        self.messages = messages
+        self.stream = stream
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.top_p = top_p
+        self.stop = stop
+        self.seed = seed
+
+    @classmethod
+    def from_openai(cls, payload: Mapping[str, Any]) -> "ChatRequest":
+        return cls(
+            payload.get("model"),
+            payload.get("messages") or [],
+            bool(payload.get("stream", False)),
+            payload.get("temperature"),
+            payload.get("max_tokens"),
+            payload.get("top_p"),
+            payload.get("stop"),
+            payload.get("seed"),
+        )
+
+    def options(self) -> Dict[str, Any]:
+        """Ollama ``options`` for the sampling fields that were set."""
+        options: Dict[str, Any] = {}
+        if self.temperature is not None:
+            options["temperature"] = self.temperature
+        if self.top_p is not None:
+            options["top_p"] = self.top_p
+        if self.max_tokens is not None:
+            options["num_predict"] = self.max_tokens
+        if self.stop is not None:
+            options["stop"] = [self.stop] if isinstance(self.stop, str) else list(self.stop)
+        if self.seed is not None:
+            options["seed"] = self.seed
+        return options
+
+
+def ollama_chat(
+    model: str,
+    messages: List[Dict[str, Any]],
+    options: Dict[str, Any],
+    stream: bool,
+    system_message: Optional[Dict[str, str]] = None,
+    keep_alive: Optional[str] = None,
+) -> Dict[str, Any]:
+    """The ``/api/chat`` body. ``messages`` is only copied to prepend a system message."""
+    body = {
+        "model": model,
+        "messages": [system_message, *messages] if system_message else messages,
+        "options": options,
+        "stream": stream,
+    }
+    if keep_alive is not None:
+        body["keep_alive"] = keep_alive
+    return body
+
+
+def transform_openai_to_ollama(payload: Mapping[str, Any], default_model: str = "llama3") -> Dict[str, Any]:
+    request = ChatRequest.from_openai(payload)
+    return ollama_chat(request.model or default_model, request.messages, request.options(), request.stream)
+
+
+def finish_reason(chunk: Mapping[str, Any]) -> Optional[str]:
+    if not chunk.get("done"):
+        return None
+    return "length" if chunk.get("done_reason") == "length" else "stop"
+
+
+def usage(response: Mapping[str, Any]) -> Dict[str, int]:
+    prompt = response.get("prompt_eval_count", 0)
+    completion = response.get("eval_count", 0)
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def ollama_chunk_to_openai(
+    chunk: Dict[str, Any],
+    completion_id: str,
+    created: int,
+    model: str,
+    first: bool = False,
+) -> Dict[str, Any]:
+    """Map one Ollama NDJSON chunk onto an OpenAI ``chat.completion.chunk``."""
+    delta: Dict[str, Any] = {}
+    if first:
+        delta["role"] = "assistant"
+    content = (chunk.get("message") or {}).get("content")
+    if content:
+        delta["content"] = content
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": chunk.get("model", model),
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason(chunk)}],
+    }
+
+
+def ollama_response_to_openai(
+    response: Mapping[str, Any],
+    completion_id: str,
+    created: int,
+    model: str,
+) -> Dict[str, Any]:
+    """Map a final ``/api/chat`` response onto an OpenAI ``chat.completion``."""
+    message = response.get("message") or {}
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": response.get("model", model),
+        "choices": [{
+            "index": 0,
+            "message": {"role": message.get("role", "assistant"), "content": message.get("content", "")},
+            "finish_reason": finish_reason(response) or "stop",
+        }],
+        "usage": usage(response),
+    }
+
+
+def transform_ollama_to_openai(response: Dict[str, Any], stream: bool = False, model: str = "") -> Dict[str, Any]:
+    if stream:
+        return ollama_chunk_to_openai(response, new_completion_id(), int(time.time()), model)
+    return ollama_response_to_openai(response, new_completion_id(), int(time.time()), model)
+
+
+class ChunkTemplate:
+    """Pre-serialized SSE frames for one stream's content chunks."""
+
+    __slots__ = ("prefix", "suffix", "empty")
+
+    def __init__(self, completion_id: str, created: int, model: str):
+        head = dumps({"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model})
+        head = b"data: " + head[:-1] + b',"choices":[{"index":0,"delta":{'
+        self.prefix = head + b'"content":'
+        self.suffix = b'},"finish_reason":null}]}\n\n'
+        self.empty = head + self.suffix
+
+    def frame(self, content: Optional[str]) -> bytes:
+        if not content:
+            return self.empty
+        return b"".join((self.prefix, dumps(content), self.suffix))
@@ -0,0 +1,177 @@
+"""
+Pooled async HTTP client for talking to Ollama.
+
+A single ``httpx.AsyncClient`` lives for the lifetime of the app, so
+connections to Ollama are kept alive and reused instead of being opened
+for every chat. All limits and timeouts come from the environment, which
+mirrors the ``ollama`` section of the Configuration reference.
+"""
+
+import asyncio
+import os
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Mapping, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+DEFAULT_OLLAMA_HOST = "http://ollama:11434"
+
+
+def normalize_host(host: str) -> str:
+    """Return ``host`` as a base URL (``OLLAMA_HOST`` may omit the scheme)."""
+    host = host.strip().rstrip("/")
+    if "://" not in host:
+        host = f"http://{host}"
+    return host
+
+
+@dataclass(frozen=True)
+class UpstreamSettings:
+    """Connection pool and timeout settings for the upstream client."""
+
+    host: str = DEFAULT_OLLAMA_HOST
+    timeout: float = 60.0
+    connect_timeout: float = 5.0
+    read_timeout: Optional[float] = None
+    max_connections: int = 1000
+    max_keepalive_connections: int = 100
+    keepalive_expiry: float = 30.0
+    max_connections_per_host: int = 0
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "UpstreamSettings":
+        """Build settings from ``OLLAMA_*`` environment variables."""
+        read_timeout = env.get("OLLAMA_READ_TIMEOUT")
+        return cls(
+            host=normalize_host(env.get("OLLAMA_HOST", DEFAULT_OLLAMA_HOST)),
+            timeout=float(env.get("OLLAMA_TIMEOUT", cls.timeout)),
+            connect_timeout=float(env.get("OLLAMA_CONNECT_TIMEOUT", cls.connect_timeout)),
+            read_timeout=float(read_timeout) if read_timeout else None,
+            max_connections=int(env.get("OLLAMA_POOL_SIZE", cls.max_connections)),
+            max_keepalive_connections=int(
+                env.get("OLLAMA_POOL_KEEPALIVE", cls.max_keepalive_connections)
+            ),
+            keepalive_expiry=float(env.get("OLLAMA_KEEPALIVE_EXPIRY", cls.keepalive_expiry)),
+            max_connections_per_host=int(
+                env.get("OLLAMA_PER_HOST_LIMIT", cls.max_connections_per_host)
+            ),
+        )
+
+    def httpx_timeout(self) -> httpx.Timeout:
+        """Per-phase httpx timeouts, not a deadline for the whole request.
+
+        ``ollama.timeout`` bounds each write and pool wait, and each read
+        unless ``OLLAMA_READ_TIMEOUT`` is set; connecting is capped by
+        ``OLLAMA_CONNECT_TIMEOUT``. Every read restarts the clock, so a
+        stream that keeps producing tokens can run longer than any of them.
+        """
+        read = self.read_timeout if self.read_timeout is not None else self.timeout
+        return httpx.Timeout(
+            self.timeout,
+            connect=min(self.connect_timeout, self.timeout),
+            read=read,
+        )
+
+    def httpx_limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+
+class UpstreamClient:
+    """App-lifetime owner of the pooled ``httpx.AsyncClient``.
+
+    The underlying client is created lazily on first use so that the app
+    works whether or not startup events have run, and is closed on
+    shutdown. ``max_connections_per_host`` caps concurrent requests to a
+    single Ollama node on top of the global pool size.
+    """
+
+    def __init__(self, settings: Optional[UpstreamSettings] = None):
+        self.settings = settings or UpstreamSettings.from_env()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.settings.httpx_timeout(),
+                limits=self.settings.httpx_limits(),
+            )
+        return self._client
+
+    def url(self, path: str, host: Optional[str] = None) -> str:
+        return f"{host or self.settings.host}{path}"
+
+    @asynccontextmanager
+    async def host_slot(self, url: str) -> AsyncIterator[None]:
+        """Hold one of the per-host connection slots for ``url``."""
+        limit = self.settings.max_connections_per_host
+        if limit <= 0:
+            yield
+            return
+        netloc = urlsplit(url).netloc
+        slot = self._host_slots.get(netloc)
+        if slot is None:
+            slot = self._host_slots[netloc] = asyncio.Semaphore(limit)
+        async with slot:
+            yield
+
+    async def post_json(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST ``payload`` to ``url`` and return the decoded JSON body."""
+        async with self.host_slot(url):
+            response = await self.client.post(url, json=payload)
+            response.raise_for_status()
+            return response.json()
+
+    async def open_stream(self, url: str, payload: Dict[str, Any]) -> "UpstreamStream":
+        """POST ``payload`` and return the response without reading the body.
+
+        Connection errors and non-2xx statuses are raised here, before any
+        bytes are sent to the caller. The returned stream holds the host
+        slot and the connection until it is closed.
+        """
+        stack = AsyncExitStack()
+        try:
+            await stack.enter_async_context(self.host_slot(url))
+            request = self.client.build_request("POST", url, json=payload)
+            response = await self.client.send(request, stream=True)
+            stack.push_async_callback(response.aclose)
+            response.raise_for_status()
+        except BaseException:
+            await stack.aclose()
+            raise
+        return UpstreamStream(response, stack)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class UpstreamStream:
+    """An open streamed response from Ollama.
+
+    Closing it aborts the upstream request, which makes Ollama stop
+    generating tokens for it.
+    """
+
+    def __init__(self, response: httpx.Response, stack: AsyncExitStack):
+        self.response = response
+        self._stack = stack
+
+    def aiter_lines(self) -> AsyncIterator[str]:
+        return self.response.aiter_lines()
+
+    def on_close(self, callback: Callable[[], Any]) -> None:
+        """Run ``callback`` when the stream is closed."""
+        self._stack.callback(callback)
+
+    async def aclose(self) -> None:
+        """Close the stream; safe to call more than once."""
+        await self._stack.aclose()
@@ -0,0 +1,266 @@
+"""
+Usage accounting, batched off the request path.
+
+``UsageAggregator.record`` only adds to in-process counters keyed by
+(key id, model): requests, prompt tokens, completion tokens and the
+estimated cost from ``MODEL_COSTS``. A background task hands the
+accumulated batch to a sink every ``USAGE_FLUSH_MS`` milliseconds, or
+sooner once ``USAGE_FLUSH_EVENTS`` records have arrived, and once more
+on shutdown. Sinks run in a worker thread so a slow Redis or disk never
+shows up in a response's latency.
+
+``USAGE_SINK`` picks the sink: ``redis`` (one pipeline per batch,
+``REDIS_URL``), ``sqlite`` or ``jsonl`` (``USAGE_PATH``), or ``none`` to
+keep totals in memory only. At most ``USAGE_MAX_PENDING`` distinct
+(key, model) pairs wait for a flush; past that, increments for new pairs
+are dropped and counted in ``dropped``.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from gateway.admission import model_env_name
+
+logger = logging.getLogger(__name__)
+
+# Estimated cost per token, keyed by model_env_name(model).
+MODEL_COSTS = {
+    "llama3": 0.000002,
+    "llama3_70b": 0.00002,
+}
+
+UsageKey = Tuple[str, str]
+# [requests, prompt_tokens, completion_tokens, cost]
+Counters = List[Any]
+Batch = Dict[UsageKey, Counters]
+
+
+def estimate_cost(model: str, tokens: int) -> float:
+    name = model_env_name(model)
+    cost = MODEL_COSTS.get(name)
+    if cost is None and name.endswith("_latest"):
+        cost = MODEL_COSTS.get(name[: -len("_latest")])
+    return tokens * (cost or 0.0)
+
+
+class JsonlSink:
+    """Appends one JSON line per (key, model) per flush."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+
+    def write(self, batch: Batch) -> None:
+        now = time.time()
+        with open(self.path, "a", encoding="utf-8") as f:
+            for (key, model), (requests, prompt, completion, cost) in batch.items():
+                f.write(json.dumps({
+                    "ts": now,
+                    "key": key,
+                    "model": model,
+                    "requests": requests,
+                    "prompt_tokens": prompt,
+                    "completion_tokens": completion,
+                    "cost": cost,
+                }, separators=(",", ":")) + "\n")
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteSink:
+    """Keeps running totals per (key, model), one transaction per flush."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS usage "
+            "(key TEXT NOT NULL, model TEXT NOT NULL, requests INTEGER NOT NULL, "
+            "prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, "
+            "cost REAL NOT NULL, PRIMARY KEY (key, model))"
+        )
+        self._db.commit()
+
+    def write(self, batch: Batch) -> None:
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key, model) DO UPDATE SET "
+                "requests = requests + excluded.requests, "
+                "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                "completion_tokens = completion_tokens + excluded.completion_tokens, "
+                "cost = cost + excluded.cost",
+                [(key, model, *counters) for (key, model), counters in batch.items()],
+            )
+
+    def totals(self) -> Dict[UsageKey, Tuple[int, int, int, float]]:
+        rows = self._db.execute("SELECT * FROM usage").fetchall()
+        return {(row[0], row[1]): tuple(row[2:]) for row in rows}
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class RedisSink:
+    """``HINCRBY`` into ``usage:<key>`` hashes, one pipeline per flush."""
+
+    def __init__(self, client: Any, prefix: str = "usage:"):
+        self.client = client
+        self.prefix = prefix
+
+    def write(self, batch: Batch) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for (key, model), (requests, prompt, completion, cost) in batch.items():
+            name = f"{self.prefix}{key}"
+            pipe.hincrby(name, f"{model}:requests", requests)
+            pipe.hincrby(name, f"{model}:prompt_tokens", prompt)
+            pipe.hincrby(name, f"{model}:completion_tokens", completion)
+            pipe.hincrby(name, f"{model}:tokens", prompt + completion)
+            if cost:
+                pipe.hincrbyfloat(name, f"{model}:cost", cost)
+        pipe.execute()
+
+    def close(self) -> None:
+        pass
+
+
+class UsageAggregator:
+    """In-process counters flushed to a sink in batches."""
+
+    def __init__(
+        self,
+        sink: Optional[Any] = None,
+        flush_interval: float = 1.0,
+        flush_events: int = 500,
+        max_pending: int = 10_000,
+    ):
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self.max_pending = max_pending
+        self.totals: Batch = {}
+        self.flushed = 0
+        self.dropped = 0
+        self.failures = 0
+        self._pending: Batch = {}
+        self._events = 0
+        self._lock = threading.Lock()
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "UsageAggregator":
+        kind = env.get("USAGE_SINK", "none").lower()
+        sink: Optional[Any] = None
+        if kind == "jsonl":
+            sink = JsonlSink(env.get("USAGE_PATH", "data/usage.jsonl"))
+        elif kind == "sqlite":
+            sink = SQLiteSink(env.get("USAGE_PATH", "data/usage.db"))
+        elif kind == "redis":
+            import redis
+
+            sink = RedisSink(redis.Redis.from_url(env.get("REDIS_URL", "redis://localhost:6379/0")))
+        return cls(
+            sink,
+            float(env.get("USAGE_FLUSH_MS", "1000")) / 1000,
+            int(env.get("USAGE_FLUSH_EVENTS", "500")),
+            int(env.get("USAGE_MAX_PENDING", "10000")),
+        )
+
+    def record(self, key: str, model: str, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+        """Count one completed request; never blocks on I/O."""
+        cost = estimate_cost(model, prompt_tokens + completion_tokens)
+        with self._lock:
+            for counters, bounded in ((self._pending, True), (self.totals, False)):
+                entry = counters.get((key, model))
+                if entry is None:
+                    if bounded and len(counters) >= self.max_pending:
+                        self.dropped += 1
+                        return
+                    entry = counters[(key, model)] = [0, 0, 0, 0.0]
+                entry[0] += 1
+                entry[1] += prompt_tokens
+                entry[2] += completion_tokens
+                entry[3] += cost
+            self._events += 1
+            wake = self._events >= self.flush_events or len(self._pending) >= self.max_pending
+        if wake and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _take(self) -> Batch:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._events = 0
+        return batch
+
+    def _restore(self, batch: Batch) -> None:
+        """Put an unwritten batch back so the next flush retries it."""
+        with self._lock:
+            for usage_key, counters in batch.items():
+                entry = self._pending.setdefault(usage_key, [0, 0, 0, 0.0])
+                for i, value in enumerate(counters):
+                    entry[i] += value
+
+    async def flush(self) -> int:
+        """Write everything pending to the sink; return the rows written."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            batch = self._take()
+            if not batch or self.sink is None:
+                return 0
+            try:
+                await asyncio.to_thread(self.sink.write, batch)
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Usage flush failed, will retry: {e}")
+                self._restore(batch)
+                return 0
+            self.flushed += len(batch)
+            return len(batch)
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def close(self) -> None:
+        """Final flush, then release the sink."""
+        await self.flush()
+        if self.sink is not None:
+            self.sink.close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            usage: Dict[str, Dict[str, Any]] = {}
+            for (key, model), (requests, prompt, completion, cost) in self.totals.items():
+                usage.setdefault(key, {})[model] = {
+                    "requests": requests,
+                    "prompt_tokens": prompt,
+                    "completion_tokens": completion,
+                    "cost": round(cost, 6),
+                }
+            return {
+                "usage": usage,
+                "pending": len(self._pending),
+                "flushed": self.flushed,
+                "dropped": self.dropped,
+                "failures": self.failures,
+            }
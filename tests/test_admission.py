@@ -0,0 +1,123 @@
+# tests/test_admission.py
+import asyncio
+
+import pytest
+
+from gateway.admission import AdmissionController, AdmissionRejected, ModelGate
+
+
+async def hold_and_record(gate, key, order, weight=1.0):
+    ticket = await gate.acquire(key, weight)
+    order.append(key)
+    await asyncio.sleep(0)
+    ticket.release()
+
+
+def test_admits_up_to_slot_count():
+    """Test that requests run immediately while slots are free."""
+    async def run():
+        gate = ModelGate(slots=2, max_queue=4)
+        first = await gate.acquire("a")
+        second = await gate.acquire("a")
+        assert (first.wait, second.wait) == (0.0, 0.0)
+        assert gate.active == 2
+
+        waiter = asyncio.ensure_future(gate.acquire("a"))
+        await asyncio.sleep(0)
+        assert gate.waiting == 1
+        first.release()
+        third = await waiter
+        assert gate.active == 2
+        assert gate.waiting == 0
+        second.release()
+        third.release()
+        assert gate.active == 0
+
+    asyncio.run(run())
+
+
+def test_rejects_when_queue_full():
+    """Test that a full queue rejects with 429 instead of waiting."""
+    async def run():
+        gate = ModelGate(slots=1, max_queue=1)
+        ticket = await gate.acquire("a")
+        waiter = asyncio.ensure_future(gate.acquire("a"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as exc:
+            await gate.acquire("b")
+        assert exc.value.status_code == 429
+        ticket.release()
+        (await waiter).release()
+
+    asyncio.run(run())
+
+
+def test_fair_across_keys():
+    """Test that a key with a deep backlog cannot starve another key."""
+    async def run():
+        gate = ModelGate(slots=1, max_queue=100)
+        blocker = await gate.acquire("batch")
+        order = []
+        tasks = [asyncio.ensure_future(hold_and_record(gate, "batch", order)) for _ in range(6)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.ensure_future(hold_and_record(gate, "chat", order)) for _ in range(2)]
+        await asyncio.sleep(0)
+        blocker.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(run())
+    # Both interactive requests are served within the first four slots.
+    assert order[:4].count("chat") == 2
+
+
+def test_weights_share_queue():
+    """Test that a key with weight 2 gets twice the turns of weight 1."""
+    async def run():
+        gate = ModelGate(slots=1, max_queue=100)
+        blocker = await gate.acquire("x")
+        order = []
+        tasks = [asyncio.ensure_future(hold_and_record(gate, "heavy", order, 2.0)) for _ in range(8)]
+        tasks += [asyncio.ensure_future(hold_and_record(gate, "light", order, 1.0)) for _ in range(8)]
+        await asyncio.sleep(0)
+        blocker.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(run())
+    assert order[:6].count("heavy") == 4
+
+
+def test_queue_timeout_and_cancel_do_not_leak_slots():
+    """Test that waiters that give up leave the gate consistent."""
+    async def run():
+        gate = ModelGate(slots=1, max_queue=4)
+        ticket = await gate.acquire("a")
+        with pytest.raises(AdmissionRejected) as exc:
+            await gate.acquire("a", timeout=0.01)
+        assert exc.value.status_code == 503
+
+        waiter = asyncio.ensure_future(gate.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert gate.waiting == 0
+
+        ticket.release()
+        ticket.release()
+        assert gate.active == 0
+        assert (await gate.acquire("c")).wait == 0.0
+
+    asyncio.run(run())
+
+
+def test_controller_per_model_slots():
+    """Test MODEL_CONCURRENCY_<model> overrides and per-backend gates."""
+    controller = AdmissionController.from_env({
+        "OLLAMA_MODEL_CONCURRENCY": "3",
+        "MODEL_CONCURRENCY_llama3_70b": "1",
+    })
+
+    assert controller.gate("http://a:11434", "llama3:70b").slots == 1
+    assert controller.gate("http://a:11434", "phi").slots == 3
+    assert controller.gate("http://b:11434", "phi") is not controller.gate("http://a:11434", "phi")
@@ -0,0 +1,86 @@
+# tests/test_affinity.py
+from gateway.affinity import PrefixStats, keep_alive_for, prefix_key
+from gateway.backends import Backend, BackendPool
+
+SYSTEM = {"role": "system", "content": "You are a strict senior engineer."}
+
+
+def conversation(*turns):
+    return [SYSTEM] + [{"role": "user", "content": t} for t in turns]
+
+
+def test_prefix_key_follows_the_conversation():
+    """Test that later turns and other questions under one system prompt keep the key."""
+    base = prefix_key("llama3", conversation("Hi"))
+    follow_up = conversation("Hi") + [{"role": "assistant", "content": "Hello!"}, {"role": "user", "content": "And Y?"}]
+
+    assert base == prefix_key("llama3", follow_up)
+    assert base == prefix_key("llama3", conversation("Explain X"))
+    assert base != prefix_key("phi", conversation("Hi"))
+    other_system = [{"role": "system", "content": "Be creative."}] + conversation("Hi")[1:]
+    assert base != prefix_key("llama3", other_system)
+
+    # Without a system prompt the first turn is the shared opening.
+    bare = [{"role": "user", "content": "Hi"}]
+    assert prefix_key("llama3", bare) == prefix_key("llama3", bare + follow_up[2:])
+    assert prefix_key("llama3", bare) != prefix_key("llama3", [{"role": "user", "content": "Hello"}])
+
+
+def test_keep_alive_precedence():
+    """Test that policy beats per-model env, which beats the global default."""
+    env = {"OLLAMA_KEEP_ALIVE": "5m", "KEEP_ALIVE_llama3_70b": "1h"}
+
+    assert keep_alive_for("llama3:70b", {}, env) == "1h"
+    assert keep_alive_for("phi", {}, env) == "5m"
+    assert keep_alive_for("phi", {"keep_alive": "30m"}, env) == "30m"
+    assert keep_alive_for("phi", {}, {}) is None
+
+
+def test_affinity_is_sticky():
+    """Test that one prefix keeps landing on the same node."""
+    pool = BackendPool([Backend(f"http://gpu{i}:11434") for i in range(4)])
+    key = prefix_key("llama3", conversation("Hi"))
+
+    hosts = set()
+    for _ in range(8):
+        lease = pool.acquire("llama3", affinity=key)
+        hosts.add(lease.backend.host)
+        lease.release()
+    assert len(hosts) == 1
+
+
+def test_affinity_spreads_distinct_prefixes():
+    """Test that different prefixes are spread across nodes."""
+    pool = BackendPool([Backend(f"http://gpu{i}:11434") for i in range(4)])
+    hosts = {
+        pool.select("llama3", affinity=prefix_key("llama3", [{"role": "user", "content": f"topic {i}"}])).host
+        for i in range(40)
+    }
+    assert len(hosts) > 1
+
+
+def test_affinity_yields_to_load():
+    """Test that a busy preferred node gives way to an idle one."""
+    pool = BackendPool([Backend("http://a:11434"), Backend("http://b:11434")])
+    key = prefix_key("llama3", conversation("Hi"))
+    preferred = pool.select("llama3", affinity=key)
+    preferred.inflight = 10
+
+    assert pool.select("llama3", affinity=key) is not preferred
+
+
+def test_prefix_stats():
+    """Test that prompt eval counters are kept per prefix."""
+    stats = PrefixStats(max_prefixes=1)
+    stats.record("p1", "llama3", "http://a:11434", {"prompt_eval_count": 400, "prompt_eval_duration": 80_000_000})
+    stats.record("p1", "llama3", "http://a:11434", {"prompt_eval_count": 20, "prompt_eval_duration": 4_000_000})
+
+    entry = stats.snapshot()["p1"]
+    assert entry["requests"] == 2
+    assert entry["first_prompt_eval_count"] == 400
+    assert entry["avg_prompt_eval_count"] == 210
+    assert entry["avg_prompt_eval_duration_ms"] == 42.0
+    assert entry["backends"] == {"http://a:11434": 2}
+
+    stats.record("p2", "llama3", "http://a:11434", {"prompt_eval_count": 5})
+    assert list(stats.snapshot()) == ["p2"]
@@ -1,7 +1,29 @@
 # tests/test_auth.py
 import pytest
+from unittest.mock import patch
+
+from gateway.keys import KeyRegistry, build_index
 from gateway.main import validate_api_key, extract_api_key
 
+# Keys are configured, not inferred from their shape.
+API_KEYS = {
+    "API_KEYS": "sk-1234567890abcdef,sk-llama2-model=llama2,sk-llama2-prod=llama2,"
+                "sk-mistral-dev=mistral,sk-llama2-key=llama2,sk-mistral-key=mistral,"
+                "sk-codellama-key=codellama"
+}
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    registry = KeyRegistry(build_index({}, {}, API_KEYS), env=API_KEYS)
+    with patch("gateway.main.keys", registry):
+        yield registry
+
+
+def extract_model_from_key(api_key):
+    from gateway.main import keys
+    return keys.lookup(api_key).model
+
 def test_extract_api_key_valid():
     """Test extraction of valid API key from header."""
     # Test Bearer token
@@ -47,7 +69,7 @@ def test_api_key_parametrized(api_key, expected):
 
 def test_api_key_model_mapping():
     """Test that API keys map to correct models."""
-    # Assuming API keys contain model names
+    # Keys map to models through API_KEYS ("key=model")
     test_cases = [
         ("sk-llama2-key", "llama2"),
         ("sk-mistral-key", "mistral"),
@@ -55,6 +77,5 @@ def test_api_key_model_mapping():
     ]
     
     for api_key, expected_model in test_cases:
-        # This would depend on your actual implementation
-        model = extract_model_from_key(api_key)  # You need to implement this
+        model = extract_model_from_key(api_key)
         assert model == expected_model
@@ -0,0 +1,184 @@
+# tests/test_backends.py
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from gateway.backends import Backend, BackendPool
+from gateway.health import HealthProber
+from gateway.upstream import UpstreamClient, UpstreamSettings
+
+
+def test_pool_from_env():
+    """Test parsing of OLLAMA_NODES with optional weights."""
+    pool = BackendPool.from_env({"OLLAMA_NODES": "http://gpu1:11434=2, gpu2:11434"})
+
+    assert [b.host for b in pool.backends] == ["http://gpu1:11434", "http://gpu2:11434"]
+    assert [b.weight for b in pool.backends] == [2.0, 1.0]
+
+
+def test_pool_falls_back_to_ollama_host():
+    """Test that a single OLLAMA_HOST still works without OLLAMA_NODES."""
+    pool = BackendPool.from_env({"OLLAMA_HOST": "http://localhost:11434"})
+    assert [b.host for b in pool.backends] == ["http://localhost:11434"]
+
+
+def test_least_outstanding_requests():
+    """Test that requests spread to the node with the fewest in flight."""
+    pool = BackendPool([Backend("http://a:11434"), Backend("http://b:11434")])
+
+    first = pool.acquire("llama3")
+    second = pool.acquire("llama3")
+    assert first.backend is not second.backend
+
+    first.release()
+    third = pool.acquire("llama3")
+    assert third.backend is first.backend
+
+
+def test_weights_scale_share():
+    """Test that a node with twice the weight takes twice the load."""
+    big, small = Backend("http://big:11434", weight=2), Backend("http://small:11434")
+    pool = BackendPool([big, small])
+
+    for _ in range(6):
+        pool.acquire("llama3")
+
+    assert big.inflight == 4
+    assert small.inflight == 2
+
+
+def test_routes_only_to_nodes_serving_model():
+    """Test that nodes that do not have the model are skipped."""
+    coder = Backend("http://coder:11434", models=frozenset({"codellama:13b"}))
+    general = Backend("http://general:11434", models=frozenset({"llama3:latest"}))
+    pool = BackendPool([coder, general])
+
+    for _ in range(3):
+        assert pool.acquire("llama3").backend is general
+    assert pool.acquire("codellama:13b").backend is coder
+    # Unknown everywhere: any node may pull it.
+    assert pool.acquire("phi").backend in (coder, general)
+
+
+def test_lease_release_is_idempotent():
+    """Test that releasing twice does not corrupt in-flight counts."""
+    backend = Backend("http://a:11434")
+    lease = BackendPool([backend]).acquire("llama3")
+    lease.release(failed=True)
+    lease.release(failed=True)
+
+    assert backend.inflight == 0
+    assert backend.errors == 1
+
+
+def test_empty_pool_rejected():
+    """Test that a pool needs at least one node."""
+    with pytest.raises(ValueError):
+        BackendPool([])
+
+
+@patch('gateway.upstream.httpx.AsyncClient.get')
+def test_refresh_models(mock_get):
+    """Test that /api/tags populates each node's model list."""
+    response = MagicMock()
+    response.json.return_value = {"models": [{"name": "llama3:latest"}, {"name": "phi:latest"}]}
+    mock_get.return_value = response
+    pool = BackendPool([Backend("http://a:11434")])
+
+    asyncio.run(pool.refresh_models(UpstreamClient(UpstreamSettings())))
+
+    assert pool.backends[0].models == frozenset({"llama3:latest", "phi:latest"})
+    assert pool.backends[0].serves("llama3")
+
+
+def test_prefers_warm_node():
+    """Test that a node with the model loaded wins over an idle cold node."""
+    cold, warm = Backend("http://cold:11434"), Backend("http://warm:11434")
+    warm.resident = frozenset({"llama3:latest"})
+    pool = BackendPool([cold, warm])
+
+    leases = [pool.acquire("llama3") for _ in range(3)]
+    assert all(lease.backend is warm for lease in leases)
+
+
+def test_warm_node_spills_when_overloaded():
+    """Test that load eventually outweighs the cold-load penalty."""
+    cold, warm = Backend("http://cold:11434"), Backend("http://warm:11434")
+    warm.resident = frozenset({"llama3"})
+    warm.inflight = 50
+    assert BackendPool([cold, warm]).select("llama3") is cold
+
+
+def test_cold_loads_pack_onto_same_node():
+    """Test that a model keeps loading onto the same node instead of thrashing."""
+    nodes = [Backend(f"http://gpu{i}:11434") for i in range(4)]
+    pool = BackendPool(nodes)
+
+    lease = pool.acquire("phi")
+    lease.record_response("phi", {"load_duration": 3_000_000_000})
+    lease.release()
+    home = lease.backend
+    assert home.cold_loads == 1
+    assert home.is_resident("phi")
+
+    for _ in range(5):
+        lease = pool.acquire("phi")
+        lease.record_response("phi", {"load_duration": 1_000_000})
+        lease.release()
+        assert lease.backend is home
+    assert home.cold_loads == 1
+    assert home.snapshot()["cold_load_rate"] == round(1 / 6, 4)
+
+
+def test_cold_model_avoids_busy_node():
+    """Test that a new model goes to a node with nothing to evict."""
+    busy, empty = Backend("http://busy:11434"), Backend("http://empty:11434")
+    busy.resident = frozenset({"llama3:latest", "codellama:13b"})
+    assert BackendPool([busy, empty]).select("phi") is empty
+
+
+@patch('gateway.upstream.httpx.AsyncClient.get')
+def test_health_probe_refreshes_residency(mock_get):
+    """Test that the health prober's /api/ps check replaces each node's resident set."""
+    response = MagicMock()
+    response.json.return_value = {"models": [{"name": "llama3:latest"}]}
+    mock_get.return_value = response
+    backend = Backend("http://a:11434")
+    backend.resident = frozenset({"phi:latest"})
+
+    asyncio.run(HealthProber(BackendPool([backend]), UpstreamClient(UpstreamSettings())).probe_all())
+
+    assert "http://a:11434/api/ps" in [call.args[0] for call in mock_get.call_args_list]
+    assert backend.resident == frozenset({"llama3:latest"})
+    assert backend.is_resident("llama3")
+
+
+@patch('gateway.main.httpx.AsyncClient.post')
+def test_chat_releases_backend(mock_post, monkeypatch):
+    """Test that a chat is counted on its backend and released afterwards."""
+    from fastapi.testclient import TestClient
+    import gateway.main as gateway_main
+
+    mock_response = MagicMock()
+    mock_response.json.return_value = {"model": "llama3", "message": {"content": "Hi"}, "done": True}
+    mock_post.return_value = mock_response
+    pool = BackendPool([Backend("http://gpu1:11434"), Backend("http://gpu2:11434")])
+    monkeypatch.setattr(gateway_main, "pool", pool)
+    monkeypatch.setattr(gateway_main, "ADMIN_KEY", "admin-secret")
+    client = TestClient(gateway_main.app)
+
+    response = client.post(
+        "/v1/chat/completions",
+        headers={"Authorization": "Bearer creative-key-456"},
+        json={"messages": [{"role": "user", "content": "Hi"}]}
+    )
+    assert response.status_code == 200
+    assert mock_post.call_args.args[0].endswith("/api/chat")
+    assert float(response.headers["X-Queue-Wait-Ms"]) >= 0
+
+    snapshot = client.get("/admin/backends", headers={"X-Admin-Key": "admin-secret"}).json()
+    assert sum(b["requests"] for b in snapshot["backends"]) == 1
+    assert all(b["inflight"] == 0 for b in snapshot["backends"])
+
+    assert client.get("/admin/backends").status_code == 403
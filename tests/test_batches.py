@@ -0,0 +1,175 @@
+# tests/test_batches.py
+import asyncio
+import json
+import time
+from unittest.mock import MagicMock, patch
+
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+
+from gateway.batches import BatchManager
+from gateway.keys import Policy, key_digest
+from gateway.main import app, dispatch_chat
+from gateway.transform import dumps
+
+OWNER = key_digest("batch-key").hex()
+POLICY = Policy.compile("batch-owner", {"model": "llama3"}, {})
+
+
+def input_lines(n):
+    lines = []
+    for i in range(n):
+        request = {"custom_id": f"req-{i}", "method": "POST", "url": "/v1/chat/completions",
+                   "body": {"messages": [{"role": "user", "content": f"n={i}"}]}}
+        lines.append(json.dumps(request).encode())
+    return b"\n".join(lines) + b"\n"
+
+
+async def chunks(data):
+    for i in range(0, len(data), 100):
+        yield data[i:i + 100]
+
+
+def echo_dispatch(delays=None, calls=None):
+    async def dispatch(payload, key, policy):
+        content = payload["messages"][-1]["content"]
+        if calls is not None:
+            calls.append(content)
+        await asyncio.sleep((delays or {}).get(content, 0))
+        if content == "fail":
+            raise RuntimeError("upstream went away")
+        return Response(dumps({"object": "chat.completion", "echo": content}), media_type="application/json")
+    return dispatch
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_batch_writes_results_in_input_order(tmp_path):
+    """Test ordered output, the error file and the counts despite uneven latency."""
+    manager = BatchManager(str(tmp_path), echo_dispatch({"n=0": 0.05}), lambda d: POLICY, concurrency=4)
+
+    async def scenario():
+        data = input_lines(20).replace(b'"n=7"', b'"fail"')
+        meta = await manager.files.save(chunks(data), "in.jsonl", "batch", OWNER)
+        job = await manager.create(meta["id"], OWNER)
+        await job.task
+        return job
+
+    job = asyncio.run(scenario())
+    view = job.view()
+    assert view["status"] == "completed"
+    assert view["request_counts"] == {"total": 20, "completed": 19, "failed": 1}
+    assert view["progress"]["percent"] == 100.0
+
+    output = read_lines(manager.files.path(view["output_file_id"]))
+    assert [r["custom_id"] for r in output] == [f"req-{i}" for i in range(20) if i != 7]
+    assert output[0]["response"]["body"]["echo"] == "n=0"
+    errors = read_lines(manager.files.path(view["error_file_id"]))
+    assert errors == [{**errors[0], "custom_id": "req-7", "response": None,
+                       "error": {"code": "upstream_error", "message": "upstream went away"}}]
+    assert manager.files.meta(view["output_file_id"])["bytes"] > 0
+
+
+def test_invalid_file_fails_validation(tmp_path):
+    """Test that a malformed input file fails the batch before any request is sent."""
+    calls = []
+    manager = BatchManager(str(tmp_path), echo_dispatch(calls=calls), lambda d: POLICY)
+
+    async def scenario():
+        meta = await manager.files.save(chunks(b'{"custom_id": 1, "body": {}}\n'), "in.jsonl", "batch", OWNER)
+        job = await manager.create(meta["id"], OWNER)
+        await job.task
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.batch["status"] == "failed"
+    assert job.batch["errors"]["data"][0]["line"] == 1
+    assert calls == []
+
+
+def test_batch_resumes_after_restart(tmp_path):
+    """Test that a stopped batch resumes from its checkpoint without duplicates."""
+    calls = []
+    first = BatchManager(str(tmp_path), echo_dispatch({"n=5": 3600}, calls), lambda d: POLICY,
+                         concurrency=2, window=2, checkpoint_interval=0)
+
+    async def stop_midway():
+        meta = await first.files.save(chunks(input_lines(12)), "in.jsonl", "batch", OWNER)
+        job = await first.create(meta["id"], OWNER)
+        while "n=5" not in calls:
+            await asyncio.sleep(0.01)
+        await first.close()
+        return job.id
+
+    batch_id = asyncio.run(stop_midway())
+    calls.clear()
+    second = BatchManager(str(tmp_path), echo_dispatch(calls=calls), lambda d: POLICY, concurrency=2)
+
+    async def resume():
+        await second.start()
+        job = second.jobs[batch_id]
+        await job.task
+        return job
+
+    job = asyncio.run(resume())
+    assert job.batch["status"] == "completed"
+    assert calls[0] in ("n=4", "n=5")
+    output = read_lines(second.files.path(job.batch["output_file_id"]))
+    assert [r["custom_id"] for r in output] == [f"req-{i}" for i in range(12)]
+    assert job.batch["request_counts"]["completed"] == 12
+
+
+@patch('gateway.main.httpx.AsyncClient.post')
+def test_batch_endpoints(mock_post, tmp_path):
+    """Test upload, batch creation, polling and the output file over HTTP."""
+    mock_response = MagicMock()
+    mock_response.json.return_value = {"model": "llama3", "message": {"role": "assistant", "content": "ok"},
+                                       "done": True, "prompt_eval_count": 3, "eval_count": 1}
+    mock_response.raise_for_status = MagicMock()
+    mock_post.return_value = mock_response
+    headers = {"Authorization": "Bearer creative-key-456"}
+    manager = BatchManager(
+        str(tmp_path),
+        lambda payload, key, policy: dispatch_chat(payload, key, policy),
+        lambda digest: POLICY
+    )
+
+    with patch("gateway.main.batches", manager), TestClient(app) as client:
+        uploaded = client.post("/v1/files?purpose=batch", content=input_lines(5), headers=headers).json()
+        assert uploaded["object"] == "file" and "owner" not in uploaded
+        batch = client.post("/v1/batches", json={"input_file_id": uploaded["id"]}, headers=headers).json()
+        assert batch["status"] == "validating"
+
+        for _ in range(200):
+            batch = client.get(f"/v1/batches/{batch['id']}", headers=headers).json()
+            if batch["status"] == "completed":
+                break
+            time.sleep(0.01)
+        assert batch["request_counts"]["completed"] == 5
+
+        content = client.get(f"/v1/files/{batch['output_file_id']}/content", headers=headers).text
+        records = [json.loads(line) for line in content.splitlines()]
+        assert records[0]["response"]["body"]["choices"][0]["message"]["content"] == "ok"
+        assert client.get(f"/v1/batches/{batch['id']}", headers={"Authorization": "Bearer dev-key-123"}).status_code == 404
+
+
+def test_chat_and_batches_share_the_key_identity():
+    """Test that interactive chats run under the same key digest that batches store as their owner."""
+    seen = []
+
+    async def dispatch(payload, key, policy, timing=None):
+        seen.append(key)
+        return Response(dumps({"ok": True}), media_type="application/json")
+
+    with patch("gateway.main.dispatch_chat", side_effect=dispatch):
+        response = TestClient(app).post(
+            "/v1/chat/completions",
+            headers={"Authorization": "Bearer dev-key-123", "X-Gateway-Cache": "bypass"},
+            json={"messages": [{"role": "user", "content": "hi"}]},
+        )
+
+    assert response.status_code == 200
+    assert seen == [key_digest("dev-key-123").hex()]
@@ -0,0 +1,111 @@
+# tests/test_cache.py
+import asyncio
+from unittest.mock import MagicMock, patch
+
+from fastapi.testclient import TestClient
+
+import gateway.main as gateway_main
+from gateway.cache import DiskCache, ResponseCache, cache_key, is_deterministic
+
+
+def payload(content="Hello", temperature=0, **options):
+    return {
+        "model": "llama3",
+        "messages": [{"role": "system", "content": "Be brief."}, {"role": "user", "content": content}],
+        "options": {"temperature": temperature, **options},
+        "stream": False,
+    }
+
+
+def test_cache_key_is_canonical():
+    """Test that key order does not matter but content and options do."""
+    a = payload()
+    b = {"stream": False, "options": {"temperature": 0}, "messages": a["messages"], "model": "llama3"}
+
+    assert cache_key(a) == cache_key(b)
+    assert cache_key(a) != cache_key(payload("Hi"))
+    assert cache_key(a) != cache_key(payload(num_predict=10))
+
+
+def test_is_deterministic():
+    """Test which sampling settings make a request cacheable."""
+    assert is_deterministic({"temperature": 0})
+    assert is_deterministic({"temperature": 0.7, "seed": 42})
+    assert not is_deterministic({"temperature": 0.1})
+
+
+def test_lru_bounded_by_bytes():
+    """Test that the least recently used entries go first once over budget."""
+    cache = ResponseCache(max_bytes=30)
+
+    async def run():
+        await cache.put("a", b"x" * 10)
+        await cache.put("b", b"x" * 10)
+        await cache.get("a")
+        await cache.put("c", b"x" * 15)
+        return await cache.get("a"), await cache.get("b"), await cache.get("c")
+
+    a, b, c = asyncio.run(run())
+    assert a is not None and c is not None
+    assert b is None
+    assert cache.bytes == 25
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    """Test that entries written to disk are found by a new cache."""
+    path = str(tmp_path / "cache" / "responses.db")
+
+    first = ResponseCache(disk=DiskCache(path, max_bytes=1024))
+    asyncio.run(first.put("k", b'{"done":true}'))
+    first.close()
+
+    second = ResponseCache(disk=DiskCache(path, max_bytes=1024))
+    assert asyncio.run(second.get("k")) == b'{"done":true}'
+    assert second.stats()["disk_hits"] == 1
+    # Promoted to memory: the next hit does not touch disk.
+    assert second.get_memory("k") == b'{"done":true}'
+    second.close()
+
+
+def test_disk_tier_trims_oldest(tmp_path):
+    """Test that the disk tier stays within its byte budget."""
+    disk = DiskCache(str(tmp_path / "responses.db"), max_bytes=20)
+    disk.put("a", b"x" * 10)
+    disk.put("b", b"x" * 10)
+    disk.put("c", b"x" * 10)
+
+    assert disk.get("a") is None
+    assert disk.get("c") is not None
+    assert disk.bytes == 20
+    disk.close()
+
+
+@patch('gateway.main.httpx.AsyncClient.post')
+def test_chat_serves_repeat_from_cache(mock_post, monkeypatch):
+    """Test that an opted-in repeat request does not reach Ollama."""
+    mock_response = MagicMock()
+    mock_response.json.return_value = {"model": "deepseek-coder", "message": {"content": "42"}, "done": True}
+    mock_post.return_value = mock_response
+    monkeypatch.setattr(gateway_main, "response_cache", ResponseCache())
+    client = TestClient(gateway_main.app)
+    request = {
+        "headers": {"Authorization": "Bearer dev-key-123", "X-Gateway-Cache": "use"},
+        "json": {"messages": [{"role": "user", "content": "Answer?"}]},
+    }
+
+    first = client.post("/v1/chat/completions", **request)
+    second = client.post("/v1/chat/completions", **request)
+
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.json() == first.json()
+    assert mock_post.call_count == 1
+
+    # Non-deterministic requests without the header are never cached.
+    client.post(
+        "/v1/chat/completions",
+        headers={"Authorization": "Bearer dev-key-123"},
+        json={"messages": [{"role": "user", "content": "Answer?"}]}
+    )
+    assert mock_post.call_count == 2
@@ -0,0 +1,176 @@
+# tests/test_coalesce.py
+import asyncio
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi.responses import JSONResponse
+
+from gateway.coalesce import Coalescer
+from gateway.keys import KeyIndex, key_digest, policy_entries
+from gateway.main import app, keys
+from gateway.streaming import SSEResponse
+
+
+async def read_body(response):
+    return [chunk async for chunk in response.body_iterator]
+
+
+def test_do_shares_one_call():
+    """Test that concurrent identical keys run the work once."""
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"answer": 42}
+
+    async def run():
+        coalescer = Coalescer()
+        results = await asyncio.gather(*(coalescer.do("k", work) for _ in range(5)))
+        return coalescer, results
+
+    coalescer, results = asyncio.run(run())
+    assert calls == 1
+    assert coalescer.coalesced == 4
+    assert all(r == {"answer": 42} for r in results)
+
+
+def test_do_shares_errors_and_forgets_key():
+    """Test that a failure reaches every waiter and the next call retries."""
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        coalescer = Coalescer()
+        results = await asyncio.gather(*(coalescer.do("k", work) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        with pytest.raises(RuntimeError):
+            await coalescer.do("k", work)
+
+    asyncio.run(run())
+    assert calls == 2
+
+
+def test_leader_disconnect_keeps_flight_for_followers():
+    """Test that cancelling one waiter does not cancel shared work."""
+    async def work():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def run():
+        coalescer = Coalescer()
+        leader = asyncio.ensure_future(coalescer.do("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(coalescer.do("k", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(run()) == "done"
+
+
+def test_last_waiter_cancels_work():
+    """Test that the upstream work stops once nobody waits for it."""
+    finished = False
+
+    async def work():
+        nonlocal finished
+        await asyncio.sleep(1)
+        finished = True
+
+    async def run():
+        coalescer = Coalescer()
+        waiter = asyncio.ensure_future(coalescer.do("k", work))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+        assert coalescer._flights == {}
+
+    asyncio.run(run())
+    assert not finished
+
+
+def test_response_copies_plain_responses():
+    """Test that each caller gets its own copy of a JSON response."""
+    async def start():
+        await asyncio.sleep(0.01)
+        return JSONResponse({"ok": True}, headers={"X-Queue-Wait-Ms": "0.0"})
+
+    async def run():
+        coalescer = Coalescer()
+        return await asyncio.gather(coalescer.response("k", start), coalescer.response("k", start))
+
+    first, second = asyncio.run(run())
+    assert first is not second
+    assert first.body == second.body == b'{"ok":true}'
+    assert second.headers["X-Queue-Wait-Ms"] == "0.0"
+
+
+def test_streaming_followers_get_same_frames():
+    """Test that followers of a stream, even late ones, get every frame."""
+    closed = []
+    starts = 0
+
+    async def frames():
+        for i in range(5):
+            await asyncio.sleep(0.005)
+            yield f"data: {i}\n\n".encode()
+
+    async def start():
+        nonlocal starts
+        starts += 1
+
+        async def on_close():
+            closed.append(True)
+
+        return SSEResponse(frames(), on_close=on_close)
+
+    async def run():
+        coalescer = Coalescer()
+        first = await coalescer.response("k", start)
+        await asyncio.sleep(0.012)
+        late = await coalescer.response("k", start)
+        bodies = await asyncio.gather(read_body(first), read_body(late))
+        await asyncio.sleep(0)
+        return coalescer, bodies
+
+    coalescer, (first, late) = asyncio.run(run())
+    assert starts == 1
+    assert coalescer.coalesced == 1
+    assert first == late == [f"data: {i}\n\n".encode() for i in range(5)]
+    assert closed == [True]
+
+
+def test_chat_flights_are_scoped_to_the_caller():
+    """Test that identical requests from two keys are dispatched, admitted and charged separately."""
+    owners = []
+
+    async def dispatch(payload, owner, policy, timing=None):
+        owners.append(owner)
+        await asyncio.sleep(0.05)
+        return JSONResponse({"ok": True})
+
+    index = KeyIndex(policy_entries({"key-a": {"model": "llama3"}, "key-b": {"model": "llama3"}}, {}))
+    body = {"messages": [{"role": "user", "content": "scoped flight"}], "seed": 1}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+            return await asyncio.gather(*(
+                client.post("/v1/chat/completions", headers={"Authorization": f"Bearer {key}"}, json=body)
+                for key in ("key-a", "key-a", "key-b")
+            ))
+
+    with patch.object(keys, "index", index), patch("gateway.main.dispatch_chat", side_effect=dispatch), \
+            patch("gateway.main.response_cache.get", return_value=None):
+        responses = asyncio.run(run())
+
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    assert sorted(owners) == sorted([key_digest("key-a").hex(), key_digest("key-b").hex()])
@@ -0,0 +1,186 @@
+# tests/test_config.py
+import asyncio
+import os
+import signal
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.rate_limit import RateLimiter
+from gateway.__main__ import main as cli
+from gateway.backends import Backend, BackendPool
+from gateway.config import ConfigError, ConfigManager, build_snapshot, validate_config
+from gateway.keys import KeyRegistry, key_digest
+from gateway.main import app
+from gateway.token_budget import TokenBudget
+
+CONFIG = """
+ollama:
+  nodes: ["http://a:11434", "http://b:11434=2"]
+rate_limit:
+  requestsperminute: 30
+  tokensperminute: 1000
+models:
+  coder:
+    model: codellama
+    version: "13b"
+    max_tokens: 100
+auth:
+  keys:
+    - id: one
+      key: k1
+      model: coder
+    - id: two
+      key: k2
+"""
+
+
+def make_manager(path, env=None):
+    env = {"CONFIG_PATH": str(path), **(env or {})}
+    keys = KeyRegistry.from_env({}, env)
+    pool = BackendPool([Backend("http://a:11434")])
+    return ConfigManager(keys, pool, RateLimiter(60, 60), TokenBudget(), env)
+
+
+def test_validate_reports_every_problem():
+    """Test types, unknown fields, required fields and model mappings."""
+    errors = validate_config({
+        "server": {"port": "8080"},
+        "rate_limit": {"enabled": "yes", "requestsperminute": -1},
+        "models": {"bad": {"version": "13b"}, "tagged": {"model": "llama3:8b", "version": "latest"}},
+        "auth": {"keys": [{"id": "a"}, {"id": "b", "key_sha256": "zz"}, {"id": "a", "key": "x", "colour": 1}]},
+        "extra": {},
+    })
+
+    assert "server.port: expected int, got str" in errors
+    assert "rate_limit.enabled: expected bool, got str" in errors
+    assert "rate_limit.requestsperminute: must not be negative" in errors
+    assert "models.bad.model: required" in errors
+    assert "models.tagged: 'model' already has a tag, drop 'version'" in errors
+    assert "auth.keys[0]: needs 'key' or 'key_sha256'" in errors
+    assert "auth.keys[1].key_sha256: expected 64 hex characters" in errors
+    assert "auth.keys[2].colour: unknown field" in errors
+    assert "auth.keys[2].id: duplicate id 'a'" in errors
+    assert "extra: unknown section" in errors
+    assert validate_config({}) == []
+
+
+def test_snapshot_resolves_models_and_env_wins():
+    """Test model aliases, max_tokens caps and environment precedence."""
+    import yaml
+
+    config = yaml.safe_load(CONFIG)
+    snapshot = build_snapshot({}, config, {})
+    policy = snapshot.keys.lookup("k1")
+    assert policy.model == "codellama:13b"
+    assert policy.options["num_predict"] == 100
+    assert policy.ollama_payload({"messages": [], "max_tokens": 500})["options"]["num_predict"] == 100
+    assert snapshot.nodes == (("http://a:11434", 1.0), ("http://b:11434", 2.0))
+    assert (snapshot.max_requests, snapshot.tokens_per_minute) == (30, 1000)
+
+    env = {"OLLAMA_HOST": "http://env:11434", "RATE_LIMIT_REQUESTS": "5", "TOKENS_PER_MINUTE": "7"}
+    snapshot = build_snapshot({}, config, env)
+    assert snapshot.nodes == (("http://env:11434", 1.0),)
+    assert (snapshot.max_requests, snapshot.tokens_per_minute) == (5, 7)
+
+    with pytest.raises(ConfigError):
+        build_snapshot({}, {"models": {"x": {}}}, {})
+
+
+def test_reload_swaps_tables_and_keeps_state(tmp_path):
+    """Test the atomic swap, carried-over limiter state and a rejected file."""
+    path = tmp_path / "config.yml"
+    path.write_text(CONFIG)
+    manager = make_manager(path)
+    asyncio.run(manager.reload())
+
+    backend_a = manager.pool.backends[0]
+    held = manager.keys.lookup("k1")
+    assert [b.host for b in manager.pool.backends] == ["http://a:11434", "http://b:11434"]
+    assert manager.rate_limiter.max_requests == 30
+    manager.rate_limiter.allow(key_digest("k1").hex())
+    manager.rate_limiter.allow(key_digest("k2").hex())
+    manager.token_budget.take(key_digest("k2").hex(), 1000, 10)
+
+    path.write_text(CONFIG.replace("    - id: two\n      key: k2\n", "").replace('"http://b:11434=2"', '"http://c:11434"'))
+    asyncio.run(manager.reload())
+
+    assert manager.pool.backends[0] is backend_a
+    assert [b.host for b in manager.pool.backends] == ["http://a:11434", "http://c:11434"]
+    assert manager.keys.lookup("k2") is None
+    assert key_digest("k1").hex() in manager.rate_limiter.state
+    assert key_digest("k2").hex() not in manager.rate_limiter.state
+    assert key_digest("k2").hex() not in manager.token_budget.buckets
+    assert held.model == "codellama:13b"
+
+    path.write_text("rate_limit:\n  requestsperminute: lots\n")
+    with pytest.raises(ConfigError):
+        asyncio.run(manager.reload())
+    assert manager.keys.lookup("k1") is not None
+    assert manager.failures == 1
+    assert manager.status()["snapshot"]["keys"] == 1
+
+
+def test_disabled_rate_limit_admits_past_the_default(tmp_path):
+    """Test that ``rate_limit.enabled: false`` turns limiting off instead of falling back to 60."""
+    path = tmp_path / "config.yml"
+    path.write_text(CONFIG.replace("rate_limit:\n", "rate_limit:\n  enabled: false\n"))
+    manager = make_manager(path)
+    asyncio.run(manager.reload())
+    assert (manager.snapshot.max_requests, manager.snapshot.tokens_per_minute) == (None, 0)
+    assert manager.status()["snapshot"]["max_requests"] is None
+
+    mock_response = MagicMock()
+    mock_response.json.return_value = {
+        "model": "llama3", "message": {"role": "assistant", "content": "ok"}, "done": True
+    }
+    mock_response.raise_for_status = MagicMock()
+    client = TestClient(app)
+    with patch("gateway.main.keys", manager.keys), \
+            patch("gateway.main.rate_limiter", manager.rate_limiter), \
+            patch("gateway.main.httpx.AsyncClient.post", return_value=mock_response):
+        statuses = {
+            client.post(
+                "/v1/chat/completions",
+                headers={"Authorization": "Bearer k2"},
+                json={"messages": [{"role": "user", "content": f"Hi {i}"}]},
+            ).status_code
+            for i in range(61)
+        }
+    assert statuses == {200}
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGHUP"), reason="SIGHUP is POSIX only")
+def test_sighup_triggers_reload(tmp_path):
+    """Test that SIGHUP reloads without waiting for the file poll."""
+    path = tmp_path / "config.yml"
+    path.write_text(CONFIG)
+    manager = make_manager(path)
+
+    async def scenario():
+        task = asyncio.create_task(manager.run(interval=3600))
+        await asyncio.sleep(0)
+        os.kill(os.getpid(), signal.SIGHUP)
+        for _ in range(100):
+            if manager.reloads:
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert manager.reloads == 1
+
+
+def test_validate_command(tmp_path, capsys):
+    """Test the exit status and output of ``python -m gateway validate``."""
+    good = tmp_path / "good.yml"
+    good.write_text(CONFIG)
+    bad = tmp_path / "bad.yml"
+    bad.write_text("models:\n  coder: {version: 1}\n")
+
+    assert cli(["validate", str(good)]) == 0
+    assert "OK" in capsys.readouterr().out
+    assert cli(["validate", str(bad)]) == 1
+    assert "models.coder.model: required" in capsys.readouterr().err
@@ -0,0 +1,174 @@
+# tests/test_embedding_cache.py
+import asyncio
+import os
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from gateway.embedding_cache import KEY_BYTES, EmbeddingCache, Segment
+from gateway.main import app
+
+client = TestClient(app)
+
+
+def fake_embed(calls):
+    async def embed(model, inputs):
+        calls.append(list(inputs))
+        return [[float(len(text)), 0.5] for text in inputs], 3 * len(inputs)
+    return embed
+
+
+def test_only_distinct_misses_go_upstream(tmp_path):
+    """Test batched lookups, normalization and in-request duplicates."""
+    cache = EmbeddingCache(str(tmp_path))
+    calls = []
+
+    vectors, tokens = asyncio.run(cache.embed("nomic", ["a", "bb", "a"], fake_embed(calls)))
+    assert calls == [["a", "bb"]]
+    assert vectors == [[1.0, 0.5], [2.0, 0.5], [1.0, 0.5]]
+    assert tokens == 6
+
+    vectors, tokens = asyncio.run(cache.embed("nomic", ["  bb\n", "ccc", "a"], fake_embed(calls)))
+    assert calls[-1] == ["ccc"]
+    assert vectors == [[2.0, 0.5], [3.0, 0.5], [1.0, 0.5]]
+    assert tokens == 3
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 4)
+    assert stats["models"]["nomic"]["vectors"] == 3
+    assert stats["models"]["nomic"]["bytes_per_vector"] == 2 * 4 + KEY_BYTES
+    cache.close()
+
+
+def test_segments_survive_reopen_and_are_per_model(tmp_path):
+    """Test that vectors are read back from the mapped files after a restart."""
+    cache = EmbeddingCache(str(tmp_path))
+    asyncio.run(cache.embed("nomic", ["one", "three"], fake_embed([])))
+    asyncio.run(cache.embed("mxbai:large", ["one"], fake_embed([])))
+    cache.close()
+
+    reopened = EmbeddingCache(str(tmp_path))
+    calls = []
+    vectors, _ = asyncio.run(reopened.embed("nomic", ["three", "one"], fake_embed(calls)))
+    assert calls == []
+    assert vectors == [[5.0, 0.5], [3.0, 0.5]]
+    _, found = reopened.lookup("mxbai:large", ["one", "three"])
+    assert found == [[3.0, 0.5], None]
+    assert sorted(reopened.stats()["models"]) == ["mxbai:large", "nomic"]
+    reopened.close()
+
+
+def test_segment_size_is_bounded(tmp_path):
+    """Test CLOCK eviction keeps the file size fixed and spares recently read rows."""
+    row = 2 * 4 + KEY_BYTES
+    cache = EmbeddingCache(str(tmp_path), segment_bytes=4 * row)
+    embed = fake_embed([])
+    asyncio.run(cache.embed("nomic", ["a", "b", "c", "d"], embed))
+    # A full sweep clears every reference bit, then "a" makes way for "e".
+    asyncio.run(cache.embed("nomic", ["e"], embed))
+    cache.lookup("nomic", ["b"])
+    # "b" was read since the sweep and gets a second chance; "c" goes.
+    asyncio.run(cache.embed("nomic", ["f"], embed))
+
+    stats = cache.stats()["models"]["nomic"]
+    assert (stats["vectors"], stats["capacity"]) == (4, 4)
+    _, found = cache.lookup("nomic", ["a", "b", "c", "d", "e", "f"])
+    assert [vector is not None for vector in found] == [False, True, False, True, True, True]
+    assert os.path.getsize(os.path.join(cache._directory("nomic"), "vectors.f32")) == 4 * 2 * 4
+    cache.close()
+
+
+def test_evicted_key_never_maps_to_the_new_vector(tmp_path):
+    """Test that a crash while a row is reused leaves the evicted key unknown, not wrong."""
+    row = 2 * 4 + KEY_BYTES
+    cache = EmbeddingCache(str(tmp_path), segment_bytes=2 * row)
+    asyncio.run(cache.embed("nomic", ["a", "b"], fake_embed([])))
+    segment = cache.segment("nomic", 2)
+    segment.flush()
+
+    class CrashBeforeKey:
+        """The keys map, dying just before the new key is written."""
+
+        def __init__(self, keys):
+            self.keys = keys
+
+        def __getitem__(self, item):
+            return self.keys[item]
+
+        def __setitem__(self, item, value):
+            if value == new_key:
+                raise RuntimeError("crashed")
+            self.keys[item] = value
+
+        def __getattr__(self, name):
+            return getattr(self.keys, name)
+
+        def __len__(self):
+            return len(self.keys)
+
+    new_key = b"n" * KEY_BYTES
+    keys, segment.keys = segment.keys, CrashBeforeKey(segment.keys)
+    with pytest.raises(RuntimeError):
+        segment.put(new_key, [9.0, 9.0])
+    segment.keys = keys
+
+    reopened = EmbeddingCache(str(tmp_path), segment_bytes=2 * row)
+    _, found = reopened.lookup("nomic", ["a", "b"])
+    assert found == [None, [1.0, 0.5]]
+    reopened.close()
+    cache.close()
+
+
+def test_embed_keeps_file_io_off_the_event_loop(tmp_path):
+    """Test that segment opens and evicted-key flushes run in threads and reserved rows are not shared."""
+    row = 2 * 4 + KEY_BYTES
+    cache = EmbeddingCache(str(tmp_path), segment_bytes=2 * row)
+    asyncio.run(cache.embed("nomic", ["a", "b"], fake_embed([])))
+    cache.close()
+
+    threads = []
+
+    def recorded(function):
+        def call(*args):
+            threads.append((function.__name__, threading.get_ident()))
+            return function(*args)
+        return call
+
+    async def scenario():
+        reopened = EmbeddingCache(str(tmp_path), segment_bytes=2 * row)
+        embed = fake_embed([])
+        await asyncio.gather(reopened.embed("nomic", ["ccc"], embed), reopened.embed("nomic", ["dddd"], embed))
+        return reopened, threading.get_ident()
+
+    with patch.object(Segment, "open_existing", recorded(Segment.open_existing)), \
+            patch.object(Segment, "sync_keys", recorded(Segment.sync_keys)):
+        reopened, loop_thread = asyncio.run(scenario())
+
+    assert {name for name, _ in threads} == {"open_existing", "sync_keys"}
+    assert all(thread != loop_thread for _, thread in threads)
+    _, found = reopened.lookup("nomic", ["a", "b", "ccc", "dddd"])
+    assert found == [None, None, [3.0, 0.5], [4.0, 0.5]]
+    reopened.close()
+
+
+@patch('gateway.main.httpx.AsyncClient.post')
+def test_embeddings_endpoint_uses_cache(mock_post, tmp_path):
+    """Test that a repeated request is served without calling Ollama."""
+    mock_response = MagicMock()
+    mock_response.json.return_value = {"embeddings": [[0.25, 0.75]], "prompt_eval_count": 2}
+    mock_response.raise_for_status = MagicMock()
+    mock_post.return_value = mock_response
+    headers = {"Authorization": "Bearer dev-key-123"}
+    payload = {"model": "nomic", "input": "cached text"}
+
+    with patch("gateway.main.embedding_cache", EmbeddingCache(str(tmp_path))) as cache:
+        first = client.post("/v1/embeddings", headers=headers, json=payload)
+        second = client.post("/v1/embeddings", headers=headers, json=payload)
+        cache.close()
+
+    assert mock_post.call_count == 1
+    assert first.json()["data"] == second.json()["data"]
+    assert second.json()["data"][0]["embedding"] == [0.25, 0.75]
+    assert second.json()["usage"]["prompt_tokens"] == 0
@@ -0,0 +1,134 @@
+# tests/test_embeddings.py
+import asyncio
+import base64
+from array import array
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from gateway.embeddings import MicroBatcher
+from gateway.keys import KeyIndex, key_digest, policy_entries
+from gateway.main import app, keys
+
+client = TestClient(app)
+
+
+def fake_embed(calls, fail=False):
+    async def embed(model, inputs, key="", weight=1.0):
+        calls.append(list(inputs))
+        await asyncio.sleep(0.001)
+        if fail:
+            raise RuntimeError("ollama is down")
+        return [[float(text.split("-")[1])] for text in inputs], 10 * len(inputs)
+    return embed
+
+
+def test_concurrent_requests_share_one_upstream_call():
+    """Test that concurrent single inputs are sent together and sliced back."""
+    calls = []
+    batcher = MicroBatcher(fake_embed(calls), max_batch=64, max_wait=0.01)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.embed("nomic", [f"t-{i}"]) for i in range(50)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1 and len(calls[0]) == 50
+    assert [vectors for vectors, _ in results] == [[[float(i)]] for i in range(50)]
+    # Tokens are shared out by input length and rounded per caller.
+    assert abs(sum(tokens for _, tokens in results) - 500) <= 25
+    assert results[1][1] < results[10][1]
+    assert batcher.snapshot()["mean_batch"] == 50
+
+
+def test_batches_are_capped_and_split_per_model():
+    """Test the size cap, separate models and multi-input requests."""
+    calls = []
+    batcher = MicroBatcher(fake_embed(calls), max_batch=4, max_wait=0.01)
+
+    async def scenario():
+        return await asyncio.gather(
+            *(batcher.embed("a", [f"t-{i}"]) for i in range(6)),
+            batcher.embed("b", ["t-7", "t-8"]),
+            batcher.embed("a", [f"t-{i}" for i in range(4)]),
+        )
+
+    results = asyncio.run(scenario())
+    assert sorted(len(c) for c in calls) == [2, 2, 4, 4]
+    assert results[6][0] == [[7.0], [8.0]]
+    assert results[7][0] == [[0.0], [1.0], [2.0], [3.0]]
+
+
+def test_upstream_failure_reaches_every_caller():
+    """Test that a failed batch raises in each waiting request."""
+    batcher = MicroBatcher(fake_embed([], fail=True), max_wait=0.01)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.embed("a", ["t-1"]) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(scenario()))
+
+
+def test_batches_are_per_key_and_carry_its_weight():
+    """Test that two keys never share an upstream call and each is queued under its own weight."""
+    sent = []
+
+    async def embed(model, inputs, key, weight):
+        sent.append((key, weight, list(inputs)))
+        await asyncio.sleep(0.001)
+        return [[0.0] for _ in inputs], len(inputs)
+
+    batcher = MicroBatcher(embed, max_batch=64, max_wait=0.01)
+
+    async def scenario():
+        await asyncio.gather(
+            *(batcher.embed("nomic", [f"a-{i}"], "heavy", 1.0) for i in range(5)),
+            batcher.embed("nomic", ["b-0"], "light", 3.0),
+        )
+
+    asyncio.run(scenario())
+    assert sorted(sent) == [("heavy", 1.0, [f"a-{i}" for i in range(5)]), ("light", 3.0, ["b-0"])]
+
+
+def test_embeddings_are_admitted_under_the_caller():
+    """Test that the endpoint queues upstream calls under the key digest and policy weight."""
+    index = KeyIndex(policy_entries({"embed-key": {"model": "llama3", "weight": 3}}, {}))
+    seen = []
+
+    async def embed_upstream(model, inputs, key, weight):
+        seen.append((key, weight))
+        return [[0.5] for _ in inputs], 1
+
+    with patch.object(keys, "index", index), patch("gateway.main.embed_upstream", side_effect=embed_upstream):
+        response = client.post("/v1/embeddings", headers={"Authorization": "Bearer embed-key"}, json={"input": "x"})
+
+    assert response.status_code == 200
+    assert seen == [(key_digest("embed-key").hex(), 3)]
+
+
+@patch('gateway.main.httpx.AsyncClient.post')
+def test_embeddings_endpoint(mock_post):
+    """Test the OpenAI response shape for string, array and base64 requests."""
+    mock_response = MagicMock()
+    mock_response.json.return_value = {"model": "nomic", "embeddings": [[0.5, -1.0]], "prompt_eval_count": 4}
+    mock_response.raise_for_status = MagicMock()
+    mock_post.return_value = mock_response
+    headers = {"Authorization": "Bearer dev-key-123"}
+
+    response = client.post("/v1/embeddings", headers=headers, json={"model": "nomic", "input": "hello"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["object"] == "list"
+    assert data["data"] == [{"object": "embedding", "index": 0, "embedding": [0.5, -1.0]}]
+    assert data["usage"] == {"prompt_tokens": 4, "total_tokens": 4}
+    sent = mock_post.call_args.kwargs["json"]
+    assert sent == {"model": "nomic", "input": ["hello"]}
+
+    response = client.post(
+        "/v1/embeddings", headers=headers, json={"model": "nomic", "input": ["hello"], "encoding_format": "base64"}
+    )
+    encoded = response.json()["data"][0]["embedding"]
+    assert list(array("f", base64.b64decode(encoded))) == pytest.approx([0.5, -1.0])
+
+    assert client.post("/v1/embeddings", headers=headers, json={"input": [1, 2]}).status_code == 400
+    assert client.post("/v1/embeddings", json={"input": "x"}).status_code == 401
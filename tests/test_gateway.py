@@ -4,10 +4,18 @@ from unittest.mock import AsyncMock, MagicMock, patch
 from fastapi.testclient import TestClient
 import json
 from datetime import datetime
-from gateway.main import app  # Assuming this is your main FastAPI app
+from gateway.keys import KeyIndex, policy_entries
+from gateway.main import app, keys  # Assuming this is your main FastAPI app
 
 client = TestClient(app)
 
+
+@pytest.fixture(autouse=True)
+def test_key():
+    """Register ``test-key`` in the hashed key index."""
+    with patch.object(keys, "index", KeyIndex(policy_entries({"test-key": {"model": "llama2"}}, {}))):
+        yield
+
 def test_health_endpoint():
     """Test the health check endpoint."""
     response = client.get("/health")
@@ -56,19 +64,26 @@ def test_v1_chat_completions_success(mock_post):
     assert data["choices"][0]["message"]["content"] == "Hello there!"
     assert data["model"] == "llama2"
 
-@patch('gateway.main.httpx.AsyncClient.post')
-def test_v1_chat_completions_streaming(mock_post):
+@patch('gateway.main.httpx.AsyncClient.send')
+def test_v1_chat_completions_streaming(mock_send):
     """Test streaming chat completions."""
     # Mock streaming response from Ollama
-    mock_response = MagicMock()
-    mock_response.iter_lines.return_value = [
+    lines = [
         '{"model":"llama2","message":{"role":"assistant","content":"Hello"},"done":false}',
         '{"model":"llama2","message":{"role":"assistant","content":" there"},"done":false}',
         '{"model":"llama2","done":true}'
     ]
+
+    async def aiter_lines():
+        for line in lines:
+            yield line
+
+    mock_response = MagicMock()
+    mock_response.aiter_lines = aiter_lines
+    mock_response.aclose = AsyncMock()
     mock_response.raise_for_status.return_value = None
-    mock_post.return_value = mock_response
-    
+    mock_send.return_value = mock_response
+
     response = client.post(
         "/v1/chat/completions",
         headers={"Authorization": "Bearer test-key"},
@@ -78,17 +93,16 @@ def test_v1_chat_completions_streaming(mock_post):
             "stream": True
         }
     )
-    
+
     assert response.status_code == 200
     assert "text/event-stream" in response.headers.get("content-type", "")
-    
+
     # Parse streaming response
-    lines = response.text.strip().split('\n')
-    assert len(lines) > 0
-    for line in lines:
-        if line.startswith("data: "):
-            data = json.loads(line[6:])
-            assert "choices" in data
+    lines = [line for line in response.text.strip().split('\n') if line.startswith("data: ")]
+    assert lines[-1] == "data: [DONE]"
+    chunks = [json.loads(line[6:]) for line in lines[:-1]]
+    assert "".join(c["choices"][0]["delta"].get("content", "") for c in chunks) == "Hello there"
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
 
 def test_v1_models_endpoint():
     """Test the models endpoint."""
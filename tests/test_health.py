@@ -0,0 +1,103 @@
+# tests/test_health.py
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import httpx
+from fastapi.testclient import TestClient
+
+from gateway.backends import Backend, BackendPool
+from gateway.config import build_snapshot, validate_config
+from gateway.health import HealthProber
+from gateway.main import app
+from gateway.upstream import UpstreamClient, UpstreamSettings
+
+client = TestClient(app)
+
+
+def fake_ollama(down):
+    """A patched ``AsyncClient.get`` where hosts in ``down`` refuse connections."""
+
+    async def get(url, **kwargs):
+        if any(host in url for host in down):
+            raise httpx.ConnectError("refused")
+        response = MagicMock()
+        if url.endswith("/api/version"):
+            response.json.return_value = {"version": "0.5.7"}
+        else:
+            response.json.return_value = {"models": [{"name": "llama3:latest"}]}
+        return response
+
+    return get
+
+
+def test_probe_records_state_and_transitions():
+    """Test that a node goes down after repeated failures and back up after one success."""
+    a, b = Backend("http://a:11434"), Backend("http://b:11434")
+    pool = BackendPool([a, b])
+    prober = HealthProber(pool, UpstreamClient(UpstreamSettings()), interval=5, failures=2)
+    down = {"http://b"}
+
+    with patch("gateway.upstream.httpx.AsyncClient.get", side_effect=fake_ollama(down)):
+        asyncio.run(prober.probe_all())
+        assert prober.table["http://a:11434"].version == "0.5.7"
+        assert prober.table["http://a:11434"].loaded == ["llama3:latest"]
+        assert a.is_resident("llama3") and a.healthy
+        assert b.healthy and prober.table["http://b:11434"].failures == 1
+
+        asyncio.run(prober.probe_all())
+        assert not b.healthy
+        assert prober.table["http://b:11434"].error.startswith("ConnectError")
+        assert prober.status()["status"] == "degraded"
+        assert {pool.select("llama3").host for _ in range(3)} == {"http://a:11434"}
+
+        down.add("http://a")
+        asyncio.run(prober.probe_all())
+        asyncio.run(prober.probe_all())
+        assert prober.status()["status"] == "unhealthy"
+        # With nothing healthy, routing still tries a node.
+        assert pool.select("llama3") in (a, b)
+
+        down.clear()
+        asyncio.run(prober.probe_all())
+        assert a.healthy and b.healthy and prober.status()["status"] == "healthy"
+        assert prober.table["http://b:11434"].changed_at is not None
+
+
+def test_health_endpoint_answers_from_the_table():
+    """Test that /health reports the table without calling Ollama, and 503 when all nodes are down."""
+    pool = BackendPool([Backend("http://a:11434")])
+    prober = HealthProber(pool, UpstreamClient(UpstreamSettings()), failures=1)
+
+    with patch("gateway.main.health", prober), patch("gateway.upstream.httpx.AsyncClient.get") as get:
+        response = client.get("/health")
+        assert response.status_code == 200
+        assert response.json()["backends"] == {"http://a:11434": {"healthy": True}}
+        assert not get.called
+
+        get.side_effect = fake_ollama({"http://a"})
+        asyncio.run(prober.probe_all())
+        response = client.get("/health")
+        assert response.status_code == 503
+        assert response.json()["status"] == "unhealthy"
+        assert response.json()["backends"]["http://a:11434"]["failures"] == 1
+
+
+def test_interval_from_config_and_environment():
+    """Test ollama.healthcheck_interval, its validation and the HEALTHCHECK_INTERVAL override."""
+    pool = BackendPool([Backend("http://a:11434")])
+    snapshot = build_snapshot({}, {"ollama": {"healthcheck_interval": 3}}, {})
+    assert snapshot.healthcheck_interval == 3.0
+    assert validate_config({"ollama": {"healthcheck_interval": 0}}) == [
+        "ollama.healthcheck_interval: must be positive"
+    ]
+
+    prober = HealthProber.from_env(pool, UpstreamClient(UpstreamSettings()), {"HEALTHCHECK_JITTER": "0.2"})
+    prober.configure(snapshot.healthcheck_interval)
+    assert prober.interval == 3.0
+    assert all(2.4 <= prober.delay() <= 3.6 for _ in range(50))
+    prober.configure(None)
+    assert prober.interval == 10.0
+
+    pinned = HealthProber.from_env(pool, UpstreamClient(UpstreamSettings()), {"HEALTHCHECK_INTERVAL": "30"})
+    pinned.configure(3.0)
+    assert pinned.interval == 30.0
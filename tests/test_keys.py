@@ -0,0 +1,88 @@
+# tests/test_keys.py
+import hashlib
+import time
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from gateway.keys import KeyIndex, KeyRegistry, Policy, build_index, key_digest
+from gateway.main import app
+
+client = TestClient(app)
+
+POLICIES = {
+    "dev-key": {"model": "deepseek-coder", "temperature": 0.1, "system_prompt": "Be precise.", "weight": 2},
+}
+
+
+def test_policy_is_precompiled():
+    """Test the payload built from a compiled policy."""
+    policy = build_index(POLICIES, {}, {}).lookup("dev-key")
+
+    payload = policy.ollama_payload({"messages": [{"role": "user", "content": "Hi"}], "max_tokens": 5})
+    assert payload["model"] == "deepseek-coder"
+    assert payload["messages"][0] is policy.system_message
+    assert payload["options"] == {"temperature": 0.1, "num_predict": 5}
+    assert policy.options == {"temperature": 0.1}
+    assert policy.get("weight") == 2
+
+    messages = [{"role": "user", "content": "Hi"}]
+    bare = Policy.compile("plain", {"model": "llama3"}, {})
+    assert bare.ollama_payload({"messages": messages})["messages"] is messages
+
+
+def test_caller_sampling_options_pass_through():
+    """Test that seed, top_p and stop reach Ollama while the policy keeps its temperature."""
+    policy = build_index(POLICIES, {}, {}).lookup("dev-key")
+    payload = policy.ollama_payload(
+        {"messages": [], "temperature": 1.5, "top_p": 0.9, "stop": "###", "seed": 42, "stream": True}
+    )
+    assert payload["options"] == {"temperature": 0.1, "top_p": 0.9, "stop": ["###"], "seed": 42}
+    assert payload["stream"] is True
+    assert policy.options == {"temperature": 0.1}
+
+
+def test_config_and_env_sources():
+    """Test config.yml entries, hashed keys, scopes and API_KEYS precedence."""
+    config = {"auth": {"keys": [
+        {"id": "admin", "key": "admin-secret", "scopes": ["*"]},
+        {"id": "readonly", "key_sha256": hashlib.sha256(b"ro-secret").hexdigest(), "scopes": ["chat:read"]},
+        {"id": "shadowed", "key": "env-key", "model": "phi"},
+    ]}}
+    index = build_index(POLICIES, config, {"API_KEYS": "env-key=mistral,bare-key", "DEFAULT_MODEL": "llama3"})
+
+    assert index.lookup("admin-secret").id == "admin"
+    readonly = index.lookup("ro-secret")
+    assert readonly.id == "readonly"
+    assert not readonly.allows("chat:write")
+    assert index.lookup("admin-secret").allows("chat:write")
+    assert index.lookup("env-key").model == "mistral"
+    assert index.lookup("bare-key").model == "llama3"
+    assert index.lookup("missing") is None
+    assert index.lookup("") is None
+    assert index.lookup(None) is None
+
+
+def test_lookup_stays_fast_with_100k_keys():
+    """Test that lookups do not degrade with the number of keys."""
+    policy = Policy.compile("shared", {"model": "llama3"}, {})
+    index = KeyIndex((key_digest(f"sk-{i}"), policy) for i in range(100_000))
+    assert len(index) == 100_000
+
+    started = time.perf_counter()
+    for i in range(0, 100_000, 10):
+        assert index.lookup(f"sk-{i}") is policy
+    per_lookup = (time.perf_counter() - started) / 10_000
+    assert per_lookup < 50e-6
+
+
+def test_readonly_key_cannot_chat():
+    """Test that a key without chat:write is refused."""
+    index = build_index({}, {"auth": {"keys": [{"id": "ro", "key": "ro-key", "scopes": ["chat:read"]}]}}, {})
+    with patch("gateway.main.keys", KeyRegistry(index)):
+        response = client.post(
+            "/v1/chat/completions",
+            headers={"Authorization": "Bearer ro-key"},
+            json={"messages": [{"role": "user", "content": "Hi"}]}
+        )
+    assert response.status_code == 403
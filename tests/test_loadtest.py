@@ -0,0 +1,57 @@
+# tests/test_loadtest.py
+import json
+
+from fastapi.testclient import TestClient
+
+from benchmarks.fake_ollama import Profile, create_app
+from benchmarks.loadtest import Samples, parse_mix, percentile, regressions, report
+
+
+def test_fake_ollama_endpoints():
+    """Test the simulated chat stream, embeddings, tags, ps and errors."""
+    client = TestClient(create_app(Profile(ttft_ms=0, tokens_per_second=0, tokens=3, load_ms=0, dim=4)))
+
+    assert [m["name"] for m in client.get("/api/tags").json()["models"]] == ["llama3", "nomic-embed-text"]
+    assert client.get("/api/ps").json() == {"models": []}
+
+    response = client.post("/api/chat", json={"model": "llama3", "messages": [{"role": "user", "content": "hi"}]})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["done"] for line in lines] == [False, False, False, True]
+    assert lines[-1]["eval_count"] == 3
+    assert [m["name"] for m in client.get("/api/ps").json()["models"]] == ["llama3"]
+
+    response = client.post("/api/chat", json={"model": "llama3", "messages": [], "stream": False,
+                                              "options": {"num_predict": 2}})
+    assert response.json()["message"]["content"] == " tok0 tok1"
+    assert response.json()["done_reason"] == "stop"
+
+    embeddings = client.post("/api/embed", json={"model": "nomic-embed-text", "input": ["a", "b"]}).json()
+    assert len(embeddings["embeddings"]) == 2 and len(embeddings["embeddings"][0]) == 4
+
+    failing = TestClient(create_app(Profile(error_rate=1.0)))
+    assert failing.post("/api/chat", json={"messages": []}).status_code == 500
+
+
+def test_report_and_regression_check():
+    """Test percentiles, the JSON report and what counts as a regression."""
+    assert percentile(list(range(1, 101)), 95) == 95
+    assert parse_mix("stream=2,embed") == {"stream": 2.0, "embed": 1.0}
+
+    stream = Samples()
+    for i in range(1, 101):
+        stream.record(200, i / 1000.0, i / 10000.0)
+    stream.record(502, 0.5)
+    baseline = report({"stream": stream}, elapsed=10.0)
+    assert baseline["throughput_rps"] == 10.0
+    assert baseline["kinds"]["stream"]["latency_ms"]["p99"] == 99.0
+    assert baseline["kinds"]["stream"]["ttft_ms"]["p50"] == 5.0
+    assert baseline["errors"] == 1
+    baseline["gateway"] = {"cpu_ms_per_request": 2.0}
+
+    assert regressions(baseline, baseline, 0.1) == []
+    slower = json.loads(json.dumps(baseline))
+    slower["throughput_rps"] = 8.0
+    slower["kinds"]["stream"]["latency_ms"]["p95"] = 120.0
+    slower["gateway"]["cpu_ms_per_request"] = 2.1
+    problems = regressions(slower, baseline, 0.1)
+    assert [p.split(":")[0] for p in problems] == ["throughput_rps", "stream.latency_ms.p95"]
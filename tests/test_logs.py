@@ -0,0 +1,132 @@
+# tests/test_logs.py
+import json
+import logging
+import queue
+import threading
+import time
+
+from gateway.logs import (
+    AuditLog,
+    DroppingQueueHandler,
+    JsonFormatter,
+    LogListener,
+    SamplingFilter,
+    parse_sample_rates,
+    redact,
+    redact_text,
+)
+
+
+def make_record(msg, level=logging.INFO, **extra):
+    record = logging.LogRecord("test", level, __file__, 1, msg, (), None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_redact_headers_and_contents():
+    """Test that secrets are masked and message bodies reduced to lengths."""
+    data = {
+        "headers": {"Authorization": "Bearer dev-key-123", "accept": "*/*"},
+        "messages": [{"role": "user", "content": "my secret prompt"}],
+        "api_key": "dev-key-123",
+    }
+    clean = redact(data)
+
+    assert clean["headers"] == {"Authorization": "[REDACTED]", "accept": "*/*"}
+    assert clean["messages"] == [{"role": "user", "content": "[16 chars]"}]
+    assert clean["api_key"] == "[REDACTED]"
+    assert "dev-key-123" not in redact_text("Headers: {'authorization': 'Bearer dev-key-123'}")
+    assert "dev-key-123" not in redact_text("sent Bearer dev-key-123 upstream")
+
+
+def test_json_formatter():
+    """Test compact JSON output with extra and structured fields."""
+    formatter = JsonFormatter()
+    line = json.loads(formatter.format(make_record("hello Bearer abc", route="/health", status=200)))
+    assert line["msg"] == "hello Bearer [REDACTED]"
+    assert line["route"] == "/health"
+    assert line["status"] == 200
+    assert line["level"] == "info"
+
+    event = json.loads(formatter.format(make_record("{...}", fields={"event": "request", "model": "llama3"})))
+    assert event["event"] == "request"
+    assert "msg" not in event and "fields" not in event
+
+
+def test_sampling_keeps_warnings():
+    """Test that sampling drops INFO records per route but never warnings."""
+    sampler = SamplingFilter(parse_sample_rates("/health=0,/v1/chat/completions=0.5"))
+
+    assert not sampler.filter(make_record("ok", route="/health"))
+    assert sampler.filter(make_record("bad", logging.WARNING, route="/health"))
+    assert sampler.filter(make_record("other", route="/v1/models"))
+    kept = sum(sampler.filter(make_record("chat", route="/v1/chat/completions")) for _ in range(2000))
+    assert 800 < kept < 1200
+
+
+def test_slow_writer_never_blocks_logging():
+    """Test that a stalled writer makes records drop instead of blocking."""
+    release = threading.Event()
+
+    class StalledHandler(logging.Handler):
+        def emit(self, record):
+            release.wait()
+
+    handler = DroppingQueueHandler(queue.Queue(100))
+    listener = LogListener(handler.queue, StalledHandler())
+    listener.start()
+    logger = logging.getLogger("test.slow")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        started = time.perf_counter()
+        for i in range(5000):
+            logger.warning("record %d", i)
+        assert time.perf_counter() - started < 1.0
+        assert handler.dropped >= 4800
+    finally:
+        release.set()
+        listener.stop()
+        logger.removeHandler(handler)
+
+
+def test_audit_log_batches_and_redacts(tmp_path):
+    """Test that every queued entry is written on close, without secrets."""
+    path = tmp_path / "audit.log"
+    audit = AuditLog(str(path), fsync_interval=10)
+    for i in range(1000):
+        audit.record({"key": "key-1234", "model": "llama3", "n": i, "authorization": "Bearer x"})
+    audit.close()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["n"] for line in lines] == list(range(1000))
+    assert lines[0]["authorization"] == "[REDACTED]"
+    assert audit.dropped == 0
+
+
+def test_audit_log_rotates_by_size(tmp_path):
+    """Test size-based rotation and the number of kept backups."""
+    path = tmp_path / "audit.log"
+    audit = AuditLog(str(path), max_bytes=200, backups=2, fsync_interval=0)
+    for i in range(50):
+        audit.record({"n": i, "pad": "x" * 40})
+        time.sleep(0.001)
+    audit.close()
+
+    files = sorted(p.name for p in tmp_path.iterdir())
+    assert files == ["audit.log", "audit.log.1", "audit.log.2"]
+    last = [json.loads(line)["n"] for line in path.read_text().splitlines()]
+    assert last[-1] == 49
+
+
+def test_audit_log_rotates_by_age(tmp_path):
+    """Test that an old file is rotated before the next write."""
+    path = tmp_path / "audit.log"
+    audit = AuditLog(str(path), rotate_seconds=0.05, fsync_interval=0)
+    audit.record({"n": 1})
+    time.sleep(0.2)
+    audit.record({"n": 2})
+    audit.close()
+
+    assert json.loads((tmp_path / "audit.log.1").read_text())["n"] == 1
+    assert json.loads(path.read_text())["n"] == 2
@@ -0,0 +1,118 @@
+# tests/test_metrics.py
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from gateway.main import app
+from gateway.metrics import REGISTRY, RequestMetrics, Registry, key_label
+
+client = TestClient(app)
+
+
+def test_counter_and_gauge_exposition():
+    """Test the text format for labeled counters and gauges."""
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.", ("model",))
+    inflight = registry.gauge("inflight", "In flight.")
+    requests.labels("llama3").inc()
+    requests.labels("llama3").inc(2)
+    requests.labels('we"ird').inc()
+    inflight.labels().inc()
+
+    text = registry.expose()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{model="llama3"} 3' in text
+    assert 'requests_total{model="we\\"ird"} 1' in text
+    assert "inflight 1" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    """Test histogram bucket counts, sum, count and quantiles."""
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency.", ("model",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.labels("llama3").observe(value)
+
+    text = registry.expose()
+    assert 'latency_seconds_bucket{model="llama3",le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{model="llama3",le="1"} 3' in text
+    assert 'latency_seconds_bucket{model="llama3",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{model="llama3"} 4' in text
+
+    entry = registry.snapshot()["latency_seconds"][0]
+    assert entry["count"] == 4
+    assert entry["sum"] == pytest.approx(3.65)
+    assert entry["p50"] == 0.1
+
+
+def test_labels_must_match():
+    """Test that a wrong number of label values is rejected."""
+    registry = Registry()
+    counter = registry.counter("c", "C.", ("model", "key"))
+    with pytest.raises(ValueError):
+        counter.labels("llama3")
+
+
+def test_request_metrics_lifecycle():
+    """Test that one request updates every gateway series once."""
+    model = "metrics-test-model"
+    m = RequestMetrics(model, key_label("secret-key"), "http://a:11434", queue_wait=0.02, started=100.0)
+    m.first_token(100.3)
+    m.first_token(100.9)
+    m.finished({"prompt_eval_count": 12, "eval_count": 40, "eval_duration": 2_000_000_000})
+    m.end(101.5)
+    m.end(102.0, failed=True)
+
+    snapshot = REGISTRY.snapshot()
+
+    def series(name):
+        return [s for s in snapshot[name] if s["labels"].get("model") == model]
+
+    assert series("gateway_inflight_requests")[0]["value"] == 0
+    assert series("gateway_requests_total")[0]["labels"]["key"] == key_label("secret-key")
+    assert series("gateway_requests_total")[0]["value"] == 1
+    assert series("gateway_upstream_errors_total") == []
+    assert series("gateway_time_to_first_token_seconds")[0]["count"] == 1
+    assert series("gateway_tokens_per_second")[0]["sum"] == 20
+    assert series("gateway_request_duration_seconds")[0]["sum"] == pytest.approx(1.5)
+    assert "secret-key" not in REGISTRY.expose()
+
+
+@patch('gateway.main.httpx.AsyncClient.post')
+def test_metrics_endpoint_after_chat(mock_post):
+    """Test that a chat completion shows up on /metrics."""
+    mock_response = MagicMock()
+    mock_response.json.return_value = {
+        "model": "llama3",
+        "message": {"role": "assistant", "content": "Hi"},
+        "done": True,
+        "prompt_eval_count": 10,
+        "eval_count": 5,
+        "eval_duration": 500_000_000,
+    }
+    mock_response.raise_for_status = MagicMock()
+    mock_post.return_value = mock_response
+
+    response = client.post(
+        "/v1/chat/completions",
+        headers={"Authorization": "Bearer creative-key-456", "X-Gateway-Cache": "bypass"},
+        json={"messages": [{"role": "user", "content": "Hello"}]}
+    )
+    assert response.status_code == 200
+
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+    assert 'gateway_tokens_total{model="llama3",key="%s",kind="completion"}' % key_label("creative-key-456") in metrics.text
+    assert "creative-key-456" not in metrics.text
+
+
+def test_admin_metrics_requires_admin_key():
+    """Test that the JSON view is protected by X-Admin-Key."""
+    assert client.get("/admin/metrics").status_code == 403
+
+    with patch("gateway.main.ADMIN_KEY", "admin"):
+        response = client.get("/admin/metrics", headers={"X-Admin-Key": "admin"})
+    assert response.status_code == 200
+    assert "gateway_request_duration_seconds" in response.json()["metrics"]
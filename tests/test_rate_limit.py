@@ -0,0 +1,209 @@
+# tests/test_rate_limit.py
+import asyncio
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.rate_limit import RateLimitConfig, RateLimiter, RedisRateLimiter, check_rate_limit
+from gateway.keys import KeyIndex, key_digest, policy_entries
+from gateway.main import app, keys
+
+
+@pytest.mark.parametrize("mode", ["gcra", "sliding_window"])
+def test_allows_up_to_limit_then_blocks(mode):
+    """Test that a burst of max_requests passes and the next one is refused."""
+    limiter = RateLimiter(max_requests=5, window_seconds=60, mode=mode)
+
+    for _ in range(5):
+        assert limiter.allow("key", now=1000.0)[0] is True
+    allowed, retry_after = limiter.allow("key", now=1000.0)
+    assert allowed is False
+    assert retry_after > 0
+
+
+def test_gcra_refills_one_request_per_interval():
+    """Test that GCRA lets one request through every window / max_requests."""
+    limiter = RateLimiter(max_requests=6, window_seconds=60)
+    for _ in range(6):
+        limiter.allow("key", now=0.0)
+
+    assert limiter.allow("key", now=9.0) == (False, pytest.approx(1.0))
+    assert limiter.allow("key", now=10.0)[0] is True
+    assert limiter.allow("key", now=10.0)[0] is False
+
+
+def test_sliding_window_weights_previous_window():
+    """Test that the previous window still counts while it overlaps."""
+    limiter = RateLimiter(max_requests=10, window_seconds=60, mode="sliding_window")
+    for _ in range(10):
+        limiter.allow("key", now=30.0)
+
+    # Halfway through the next window, half of the previous 10 still count.
+    results = [limiter.allow("key", now=90.0)[0] for _ in range(6)]
+    assert results == [True] * 5 + [False]
+
+
+def test_per_key_limits():
+    """Test that a per-key limit overrides the default."""
+    limiter = RateLimiter(max_requests=2, window_seconds=60)
+
+    assert [limiter.allow("vip", 4, now=0.0)[0] for _ in range(5)] == [True] * 4 + [False]
+    assert [limiter.allow("std", now=0.0)[0] for _ in range(3)] == [True, True, False]
+
+
+def test_check_raises_429_with_retry_after():
+    """Test that check() keeps the HTTPException contract."""
+    limiter = RateLimiter(max_requests=1, window_seconds=60)
+    limiter.check("key")
+
+    with pytest.raises(HTTPException) as exc:
+        limiter.check("key")
+    assert exc.value.status_code == 429
+    assert int(exc.value.headers["Retry-After"]) >= 1
+
+
+@pytest.mark.parametrize("mode", ["gcra", "sliding_window"])
+def test_evict_idle_keys(mode):
+    """Test that recovered keys are dropped and recently active ones kept."""
+    limiter = RateLimiter(max_requests=10, window_seconds=60, mode=mode)
+    for i in range(100):
+        limiter.allow(f"old-{i}", now=0.0)
+    limiter.allow("active", now=179.0)
+
+    assert limiter.evict_idle(now=180.0) == 100
+    assert list(limiter.state) == ["active"]
+
+
+def test_check_rate_limit_helper():
+    """Test the non-raising helper used by app/main.py."""
+    config = RateLimitConfig(max_requests=1, window_seconds=60)
+
+    assert check_rate_limit("helper-key", config)[0] is True
+    allowed, info = check_rate_limit("helper-key", config)
+    assert allowed is False
+    assert info["max_requests"] == 1
+    assert info["retry_after"] > 0
+
+
+def fake_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+
+def test_redis_limiter_counts_requests_in_same_instant():
+    """Test that requests within the same second are all counted."""
+    limiter = RedisRateLimiter(max_requests=5, window_seconds=60, client=fake_redis())
+
+    granted = [limiter.reserve("key", 5, now_ms=1_000_000)[0] for _ in range(6)]
+    assert granted == [1, 1, 1, 1, 1, 0]
+    assert limiter.round_trips == 6
+
+
+def test_redis_limiter_refills_per_interval():
+    """Test the server-side GCRA arithmetic and retry hint."""
+    limiter = RedisRateLimiter(max_requests=6, window_seconds=60, client=fake_redis())
+    for _ in range(6):
+        limiter.reserve("key", 6, now_ms=0)
+
+    assert limiter.reserve("key", 6, now_ms=9_000) == (0, 1.0)
+    assert limiter.reserve("key", 6, now_ms=10_000)[0] == 1
+
+
+def test_redis_limiter_is_shared_across_replicas():
+    """Test that two gateway instances draw from one budget."""
+    client = fake_redis()
+    replicas = [RedisRateLimiter(10, 60, client=client) for _ in range(2)]
+
+    allowed = sum(replicas[i % 2].allow("key")[0] for i in range(20))
+    assert allowed == 10
+
+
+def test_redis_lease_mode_cuts_round_trips():
+    """Test that lease mode spends local tokens and stays within the limit."""
+    client = fake_redis()
+    replicas = [RedisRateLimiter(100, 60, client=client, lease_size=10, lease_ttl=6) for _ in range(2)]
+
+    allowed = sum(replicas[i % 2].allow("key")[0] for i in range(150))
+    for replica in replicas:
+        replica.close()
+
+    # At most a lease plus a pending refill per replica is left unspent.
+    assert 100 - 2 * 2 * 10 <= allowed <= 100
+    assert sum(r.round_trips for r in replicas) <= 30
+
+
+class BrokenRedis:
+    def register_script(self, script):
+        def call(keys, args):
+            raise ConnectionError("redis timed out")
+        return call
+
+
+def test_redis_fail_open_and_closed():
+    """Test the limiter's policy when Redis is unavailable."""
+    open_limiter = RedisRateLimiter(1, 60, client=BrokenRedis(), fail_open=True)
+    assert open_limiter.allow("key") == (True, 0.0)
+    assert open_limiter.failures == 1
+
+    closed_limiter = RedisRateLimiter(1, 60, client=BrokenRedis(), fail_open=False)
+    with pytest.raises(HTTPException) as exc:
+        closed_limiter.check("key")
+    assert exc.value.status_code == 503
+
+
+def test_redis_lease_is_sized_by_rate_and_async_check_uses_a_thread():
+    """Test that slow keys skip leasing and that check_async keeps Redis off the event loop."""
+    limiter = RedisRateLimiter(60, 60, client=fake_redis(), lease_size=10, lease_ttl=1)
+    assert limiter.lease_for(60) == 0
+    assert limiter.lease_for(1200) == 10
+    assert limiter.lease_for(300) == 5
+
+    threads = []
+    reserve = limiter.reserve
+
+    def spy(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return reserve(*args, **kwargs)
+
+    limiter.reserve = spy
+
+    async def scenario():
+        for _ in range(60):
+            await limiter.check_async("key")
+        with pytest.raises(HTTPException) as exc:
+            await limiter.check_async("key")
+        return exc.value.status_code
+
+    assert asyncio.run(scenario()) == 429
+    assert threads and threading.main_thread() not in threads
+    # No lease at this rate: each allowed request was one round trip, then the refusal is remembered.
+    assert limiter.round_trips == 61
+    limiter.close()
+
+
+def test_gateway_limits_by_key_digest():
+    """Test that neither Redis nor the limiter state ever sees the plaintext key."""
+    client = fake_redis()
+    limiter = RedisRateLimiter(10, 60, client=client)
+    mock_response = MagicMock()
+    mock_response.json.return_value = {
+        "model": "llama3", "message": {"role": "assistant", "content": "ok"}, "done": True
+    }
+    mock_response.raise_for_status = MagicMock()
+
+    with patch.object(keys, "index", KeyIndex(policy_entries({"plain-secret": {"model": "llama3"}}, {}))), \
+            patch("gateway.main.rate_limiter", limiter), \
+            patch("gateway.main.httpx.AsyncClient.post", return_value=mock_response):
+        response = TestClient(app).post(
+            "/v1/chat/completions",
+            headers={"Authorization": "Bearer plain-secret"},
+            json={"messages": [{"role": "user", "content": "Hi"}]},
+        )
+    limiter.close()
+
+    assert response.status_code == 200
+    assert client.keys() == [f"rl:{key_digest('plain-secret').hex()}".encode()]
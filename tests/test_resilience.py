@@ -0,0 +1,229 @@
+# tests/test_resilience.py
+import asyncio
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from gateway.backends import Backend, BackendPool
+from gateway.keys import KeyIndex, policy_entries
+from gateway.main import app, keys
+from gateway.metrics import REGISTRY
+from gateway.resilience import (
+    BreakerSettings,
+    CircuitBreaker,
+    LatencyTracker,
+    RetryPolicy,
+    backend_failure,
+    hedged,
+    with_retries,
+)
+
+client = TestClient(app)
+
+SETTINGS = BreakerSettings(window=10, min_requests=4, error_rate=0.5, slow_seconds=1, slow_rate=0.75,
+                           open_seconds=5, half_open_requests=2)
+
+
+def status_error(code):
+    request = httpx.Request("POST", "http://a/api/chat")
+    return httpx.HTTPStatusError("boom", request=request, response=httpx.Response(code, request=request))
+
+
+def test_breaker_opens_half_opens_and_closes():
+    """Test the closed -> open -> half-open -> closed/open cycle."""
+    breaker = CircuitBreaker("http://a:11434", SETTINGS)
+    for failed in (False, True, False):
+        breaker.record(failed, now=1)
+    assert breaker.state == "closed"
+    breaker.record(True, now=2)
+    assert breaker.state == "open" and not breaker.available(now=3)
+
+    assert breaker.available(now=7) and breaker.state == "half_open"
+    breaker.started()
+    breaker.started()
+    assert not breaker.available(now=7)
+    breaker.record(True, now=8)
+    assert breaker.state == "open" and breaker.trips == 2
+
+    assert breaker.available(now=13)
+    for _ in range(2):
+        breaker.started()
+        breaker.record(False, now=14)
+    assert breaker.state == "closed"
+
+
+def test_breaker_counts_slow_calls_and_forgets_old_ones():
+    """Test latency-driven trips and the sliding window."""
+    breaker = CircuitBreaker("http://a:11434", SETTINGS)
+    for _ in range(3):
+        breaker.record(False, latency=2.0, now=0)
+    breaker.record(False, latency=0.1, now=20)
+    assert breaker.state == "closed" and breaker.snapshot()["window_requests"] == 1
+    for _ in range(3):
+        breaker.record(False, latency=2.0, now=21)
+    assert breaker.state == "open"
+
+    assert backend_failure(httpx.ConnectError("refused"))
+    assert backend_failure(status_error(503))
+    assert not backend_failure(status_error(404))
+    assert not backend_failure(asyncio.CancelledError())
+
+
+def test_pool_skips_open_breakers():
+    """Test that routing avoids an open node until every node is open."""
+    a, b = Backend("http://a:11434"), Backend("http://b:11434")
+    pool = BackendPool([a, b])
+    for _ in range(10):
+        a.breaker.record(True)
+    assert a.breaker.state == "open"
+    assert {pool.acquire("llama3").backend.host for _ in range(4)} == {"http://b:11434"}
+    for _ in range(10):
+        b.breaker.record(True)
+    assert pool.acquire("llama3").backend in (a, b)
+    assert pool.select("llama3", exclude={"http://a:11434"}) is b
+
+
+def test_retries_move_to_another_node_with_backoff():
+    """Test that failures before the first byte are retried elsewhere, others are not."""
+    calls = []
+
+    def attempt_failing(error, times):
+        async def attempt(tried):
+            host = ["http://a", "http://b", "http://c"][len(tried)]
+            tried.add(host)
+            calls.append(host)
+            if len(calls) <= times:
+                raise error
+            return host
+        return attempt
+
+    policy = RetryPolicy(retries=2, backoff=0.001, max_backoff=0.002)
+    assert asyncio.run(with_retries(attempt_failing(httpx.ConnectTimeout("slow"), 2), policy)) == "http://c"
+    assert calls == ["http://a", "http://b", "http://c"]
+
+    calls.clear()
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(with_retries(attempt_failing(status_error(400), 1), policy))
+    assert calls == ["http://a"]
+
+    calls.clear()
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(with_retries(attempt_failing(httpx.ConnectError("down"), 5), policy))
+    assert len(calls) == 3
+    assert all(0 <= policy.delay(n) <= 0.002 for n in range(1, 10))
+
+
+def test_hedge_wins_and_cancels_the_slow_call():
+    """Test that a second call goes out after the delay and the loser is cancelled."""
+    cancelled = []
+
+    async def attempt(tried):
+        slow = not tried
+        tried.add("slow" if slow else "fast")
+        try:
+            await asyncio.sleep(1.0 if slow else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append("slow" if slow else "fast")
+            raise
+        return "slow" if slow else "fast"
+
+    async def scenario():
+        return await hedged(attempt, 0.02, set())
+
+    assert asyncio.run(scenario()) == "fast"
+    assert cancelled == ["slow"]
+
+    tracker = LatencyTracker(size=100, min_samples=10, min_delay=0.05)
+    assert tracker.hedge_delay("llama3") is None
+    for i in range(100):
+        tracker.observe("llama3", i / 100)
+    assert tracker.p95("llama3") == 0.94
+    assert tracker.hedge_delay("llama3") == 0.94
+
+
+def test_chat_retries_on_another_backend():
+    """Test that a refused connection on one node is retried on the other."""
+    pool = BackendPool([Backend("http://sick:11434"), Backend("http://well:11434")])
+    hosts = []
+
+    async def post_json(url, payload):
+        hosts.append(url.split("/api")[0])
+        if "sick" in url:
+            raise httpx.ConnectError("refused")
+        return {"model": payload["model"], "message": {"role": "assistant", "content": "ok"}, "done": True}
+
+    with patch("gateway.main.pool", pool), patch("gateway.main.upstream.post_json", side_effect=post_json), \
+            patch("gateway.main.retry_policy", RetryPolicy(retries=2, backoff=0.001)):
+        for _ in range(2):
+            response = client.post(
+                "/v1/chat/completions",
+                headers={"Authorization": "Bearer dev-key-123"},
+                json={"messages": [{"role": "user", "content": "hi"}]},
+            )
+            assert response.status_code == 200
+            assert response.json()["choices"][0]["message"]["content"] == "ok"
+
+    assert hosts.count("http://well:11434") == 2
+    assert pool.backends[0].errors >= 1 and pool.backends[1].errors == 0
+
+
+def test_deterministic_chat_is_hedged():
+    """Test that a slow primary is hedged onto the other backend and released."""
+    pool = BackendPool([Backend("http://a:11434"), Backend("http://b:11434")])
+    tracker = LatencyTracker(min_samples=1, min_delay=0.01)
+    model = "hedge-test-model"
+    tracker.observe(model, 0.02)
+    index = KeyIndex(policy_entries({"exact-key": {"model": model, "temperature": 0}}, {}))
+    hosts = []
+
+    async def post_json(url, payload):
+        hosts.append(url.split("/api")[0])
+        await asyncio.sleep(1.0 if len(hosts) == 1 else 0.01)
+        return {"model": payload["model"], "message": {"role": "assistant", "content": url}, "done": True}
+
+    with patch.object(keys, "index", index), patch("gateway.main.pool", pool), \
+            patch("gateway.main.latencies", tracker), patch("gateway.main.HEDGE_ENABLED", True), \
+            patch("gateway.main.upstream.post_json", side_effect=post_json):
+        response = client.post(
+            "/v1/chat/completions",
+            headers={"Authorization": "Bearer exact-key", "X-Gateway-Cache": "bypass"},
+            json={"messages": [{"role": "user", "content": "hi"}]},
+        )
+
+    assert response.status_code == 200
+    assert len(hosts) == 2 and hosts[0] != hosts[1]
+    assert response.json()["choices"][0]["message"]["content"].startswith(hosts[1])
+    assert [b.inflight for b in pool.backends] == [0, 0]
+    assert [b.errors for b in pool.backends] == [0, 0]
+
+    # The cancelled loser is counted as abandoned, not as an upstream error.
+    snapshot = REGISTRY.snapshot()
+    assert [s for s in snapshot["gateway_upstream_errors_total"] if s["labels"]["model"] == model] == []
+    abandoned = [s for s in snapshot["gateway_upstream_abandoned_total"] if s["labels"]["model"] == model]
+    assert [(s["labels"]["backend"], s["value"]) for s in abandoned] == [(hosts[0], 1)]
+
+
+def test_hedge_discards_a_loser_that_finished_together():
+    """Test that a result completing in the same wakeup as the winner is handed back, not leaked."""
+    held = []
+    discarded = []
+
+    async def scenario():
+        both = asyncio.Event()
+
+        async def attempt(tried):
+            name = "hedge" if tried else "primary"
+            tried.add(name)
+            held.append(name)
+            if name == "hedge":
+                both.set()
+            await both.wait()
+            return name
+
+        return await hedged(attempt, 0.01, set(), discard=discarded.append)
+
+    winner = asyncio.run(scenario())
+    assert sorted(held) == ["hedge", "primary"]
+    assert discarded == [{"primary": "hedge", "hedge": "primary"}[winner]]
@@ -0,0 +1,156 @@
+# tests/test_semantic_cache.py
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from gateway.config import validate_config
+from gateway.keys import KeyIndex, policy_entries
+from gateway.main import app, keys
+from gateway.semantic_cache import SemanticCache, SemanticSettings, VectorIndex, semantic_query
+
+np = pytest.importorskip("numpy")
+
+client = TestClient(app)
+
+# Paraphrases share a direction; the third component tells them apart.
+VECTORS = {
+    "How do I reset my password?": [1.0, 0.0, 0.0],
+    "how can I reset my password": [0.98, 0.0, 0.2],
+    "What are your opening hours?": [0.0, 1.0, 0.0],
+}
+
+
+def fake_embed(calls):
+    async def embed(model, inputs):
+        calls.append(list(inputs))
+        return [VECTORS[text] for text in inputs], len(inputs)
+    return embed
+
+
+def test_settings_and_validation():
+    """Test policy opt-in, defaults and config.yml checks."""
+    assert SemanticSettings.compile(None) is None
+    assert SemanticSettings.compile(True, {"SEMANTIC_CACHE_TTL": "60"}) == SemanticSettings(0.92, 60.0)
+    assert SemanticSettings.compile({"threshold": 0.8}).threshold == 0.8
+
+    errors = validate_config({"auth": {"keys": [
+        {"id": "a", "key": "k1", "semantic_cache": True},
+        {"id": "b", "key": "k2", "semantic_cache": {"threshold": 2, "size": 1}},
+    ]}})
+    assert errors == [
+        "auth.keys[1].semantic_cache.size: unknown field",
+        "auth.keys[1].semantic_cache.threshold: must be in (0, 1]",
+    ]
+
+
+def test_paraphrase_hits_within_scope_threshold_and_ttl():
+    """Test that a paraphrase hits and a different question, scope or stale entry misses."""
+    cache = SemanticCache(fake_embed([]), "nomic")
+    settings = SemanticSettings(threshold=0.95, ttl=3600)
+    payload = {"model": "llama3", "messages": [{"role": "user", "content": "How do I reset my password?"}]}
+    scope, text = semantic_query("support", payload)
+
+    async def scenario():
+        hit, vector = await cache.lookup(settings, scope, text)
+        assert hit is None
+        await cache.store(settings, scope, text, vector, b'{"answer": 1}')
+
+        hit, _ = await cache.lookup(settings, scope, "how can I reset my password")
+        assert hit[0] == b'{"answer": 1}' and 0.95 <= hit[1] < 1
+        hit, _ = await cache.lookup(settings, scope, "What are your opening hours?")
+        assert hit is None
+        hit, _ = await cache.lookup(settings, semantic_query("other", payload)[0], text)
+        assert hit is None
+        hit, _ = await cache.lookup(SemanticSettings(threshold=0.999), scope, "how can I reset my password")
+        assert hit is None
+
+        cache.entries[0].expires = 0
+        hit, _ = await cache.lookup(settings, scope, text)
+        assert hit is None and not cache.entries
+
+    asyncio.run(scenario())
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 5, 0)
+
+    with_history = {"model": "llama3", "messages": [{"role": "assistant", "content": "Hi"}, *payload["messages"]]}
+    assert semantic_query("support", with_history)[0] != scope
+    assert semantic_query("support", {"model": "llama3", "messages": [{"role": "assistant", "content": "x"}]}) is None
+
+
+def test_empty_scope_skips_embedding_and_eviction_follows_expiry():
+    """Test that a first lookup embeds nothing and a full cache drops the entry expiring soonest."""
+    calls = []
+    cache = SemanticCache(fake_embed(calls), "nomic", max_entries=2)
+    long, short = SemanticSettings(ttl=3600), SemanticSettings(ttl=60)
+
+    async def scenario():
+        hit, vector = await cache.lookup(long, "faq", "How do I reset my password?")
+        assert (hit, vector, calls) == (None, None, [])
+        await cache.store(long, "faq", "How do I reset my password?", vector, b"long")
+        assert calls == [["How do I reset my password?"]]
+        await cache.store(short, "hours", "What are your opening hours?", None, b"short")
+        await cache.store(long, "faq2", "how can I reset my password", None, b"newest")
+
+    asyncio.run(scenario())
+    assert sorted(entry.body for entry in cache.entries.values()) == [b"long", b"newest"]
+    assert sorted(cache.indexes) == ["faq", "faq2"]
+
+
+def test_ivf_training_keeps_every_entry_reachable():
+    """Test clustering, and entries added or removed while it runs."""
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((3000, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = VectorIndex(16, nprobe=4, list_size=100)
+    for id, vector in enumerate(vectors[:2000]):
+        index.add(id, vector)
+
+    async def scenario():
+        training = asyncio.create_task(index.train())
+        await asyncio.sleep(0)
+        for id in range(2000, 3000):
+            index.add(id, vectors[id])
+        for id in range(0, 100):
+            index.remove(id)
+        await training
+
+    asyncio.run(scenario())
+    assert index.mode == "ivf" and len(index.lists) == 20
+    assert len(index) == 2900
+    assert sorted(index.where) == list(range(100, 3000))
+    for id in range(100, 3000, 7):
+        assert index.search(vectors[id]) == (id, pytest.approx(1.0, abs=1e-5))
+
+
+def test_chat_served_from_semantic_cache():
+    """Test that an opted-in key gets a stored completion for a paraphrase."""
+    index = KeyIndex(policy_entries({"faq-key": {"model": "llama3", "semantic_cache": {"threshold": 0.95}}}, {}))
+    calls = []
+    mock_response = MagicMock()
+    mock_response.json.return_value = {
+        "model": "llama3", "message": {"role": "assistant", "content": "Use the reset link."}, "done": True
+    }
+    mock_response.raise_for_status = MagicMock()
+    headers = {"Authorization": "Bearer faq-key"}
+
+    with patch.object(keys, "index", index), \
+            patch("gateway.main.semantic_cache", SemanticCache(fake_embed(calls), "nomic")), \
+            patch("gateway.main.httpx.AsyncClient.post", return_value=mock_response) as mock_post:
+        first = client.post("/v1/chat/completions", headers=headers, json={
+            "messages": [{"role": "user", "content": "How do I reset my password?"}]
+        })
+        second = client.post("/v1/chat/completions", headers=headers, json={
+            "messages": [{"role": "user", "content": "how can I reset my password"}]
+        })
+        other = client.post("/v1/chat/completions", headers=headers, json={
+            "messages": [{"role": "user", "content": "What are your opening hours?"}]
+        })
+
+    assert first.status_code == second.status_code == other.status_code == 200
+    assert mock_post.call_count == 2
+    assert second.headers["X-Cache"] == "SEMANTIC"
+    assert second.json()["choices"][0]["message"]["content"] == "Use the reset link."
+    assert "X-Cache" not in other.headers
+    assert len(calls) == 3
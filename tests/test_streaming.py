@@ -0,0 +1,153 @@
+# tests/test_streaming.py
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi.testclient import TestClient
+
+from gateway.main import app
+from gateway.metrics import REGISTRY
+from gateway.streaming import SSEResponse, ollama_chunk_to_openai, stream_chat_completion
+
+client = TestClient(app)
+
+
+class FakeStream:
+    """Stand-in for UpstreamStream that yields lines until closed."""
+
+    def __init__(self, lines=None):
+        self.lines = lines
+        self.closed = False
+        self.read = 0
+
+    async def aiter_lines(self):
+        if self.lines is not None:
+            for line in self.lines:
+                self.read += 1
+                yield line
+            return
+        while True:
+            self.read += 1
+            yield json.dumps({"model": "llama2", "message": {"content": "tok"}, "done": False})
+
+    async def aclose(self):
+        self.closed = True
+
+
+def parse_frames(body):
+    lines = [line for line in body.split("\n") if line.startswith("data: ")]
+    assert lines[-1] == "data: [DONE]"
+    return [json.loads(line[6:]) for line in lines[:-1]]
+
+
+def test_chunk_mapping():
+    """Test mapping of Ollama chunks onto chat.completion.chunk objects."""
+    chunk = {"model": "llama2", "message": {"role": "assistant", "content": "Hi"}, "done": False}
+    mapped = ollama_chunk_to_openai(chunk, "chatcmpl-1", 123, "llama2", first=True)
+
+    assert mapped["object"] == "chat.completion.chunk"
+    assert mapped["choices"][0]["delta"] == {"role": "assistant", "content": "Hi"}
+    assert mapped["choices"][0]["finish_reason"] is None
+
+    final = ollama_chunk_to_openai({"model": "llama2", "done": True}, "chatcmpl-1", 123, "llama2")
+    assert final["choices"][0]["delta"] == {}
+    assert final["choices"][0]["finish_reason"] == "stop"
+
+
+def test_stream_closes_upstream_when_done():
+    """Test that the upstream response is closed after the final chunk."""
+    stream = FakeStream([
+        '{"model":"llama2","message":{"content":"Hello"},"done":false}',
+        '',
+        '{"model":"llama2","done":true}',
+    ])
+
+    async def run():
+        return [frame async for frame in stream_chat_completion(stream, "llama2")]
+
+    frames = asyncio.run(run())
+    assert len(frames) == 3
+    assert all(frame.endswith(b"\n\n") for frame in frames)
+    assert frames[-1] == b"data: [DONE]\n\n"
+    assert stream.closed
+
+
+def test_stream_cut_short_upstream_ends_with_an_error():
+    """Test that an upstream that closes without a done chunk is reported, not passed off as finished."""
+    stream = FakeStream(['{"model":"llama2","message":{"content":"Hel"},"done":false}'])
+    done = []
+
+    async def run():
+        return [frame async for frame in stream_chat_completion(stream, "truncated-model", on_done=done.append)]
+
+    frames = parse_frames(b"".join(asyncio.run(run())).decode())
+    assert frames[0]["choices"][0]["delta"]["content"] == "Hel"
+    assert frames[-1]["error"]["code"] == 502
+    assert not done and stream.closed
+    truncations = REGISTRY.snapshot()["gateway_stream_truncations_total"]
+    assert [s["value"] for s in truncations if s["labels"]["model"] == "truncated-model"] == [1]
+
+
+def test_stream_aborts_upstream_on_disconnect():
+    """Test that a client disconnect closes the upstream request."""
+    stream = FakeStream()
+    response = SSEResponse(stream_chat_completion(stream, "llama2"))
+    sent = []
+
+    async def send(message):
+        if message["type"] == "http.response.body" and len(sent) >= 3:
+            raise OSError("client went away")
+        sent.append(message)
+
+    async def receive():
+        await asyncio.sleep(3600)
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+
+    async def run():
+        try:
+            await response(scope, receive, send)
+        except Exception:
+            pass
+
+    asyncio.run(run())
+    assert stream.closed
+    assert stream.read < 10
+
+
+@patch('gateway.main.httpx.AsyncClient.send')
+def test_streaming_endpoint(mock_send):
+    """Test that stream: true returns OpenAI chunks as server-sent events."""
+    lines = [
+        '{"model":"deepseek-coder","message":{"role":"assistant","content":"Hello"},"done":false}',
+        '{"model":"deepseek-coder","message":{"role":"assistant","content":" there"},"done":false}',
+        '{"model":"deepseek-coder","done":true,"done_reason":"stop"}'
+    ]
+
+    async def aiter_lines():
+        for line in lines:
+            yield line
+
+    mock_response = MagicMock()
+    mock_response.aiter_lines = aiter_lines
+    mock_response.aclose = AsyncMock()
+    mock_response.raise_for_status.return_value = None
+    mock_send.return_value = mock_response
+
+    response = client.post(
+        "/v1/chat/completions",
+        headers={"Authorization": "Bearer dev-key-123"},
+        json={"messages": [{"role": "user", "content": "Hello"}], "stream": True}
+    )
+
+    assert response.status_code == 200
+    assert "text/event-stream" in response.headers["content-type"]
+    frames = parse_frames(response.text)
+    content = "".join(f["choices"][0]["delta"].get("content", "") for f in frames)
+    assert content == "Hello there"
+    assert frames[-1]["choices"][0]["finish_reason"] == "stop"
+    assert len({f["id"] for f in frames}) == 1
+    mock_response.aclose.assert_awaited()
+
+    sent = json.loads(mock_send.call_args.args[0].content)
+    assert sent["stream"] is True
@@ -0,0 +1,125 @@
+# tests/test_timing.py
+import json
+import logging
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from gateway.main import app
+from gateway.timing import RequestTiming
+
+client = TestClient(app)
+
+OLLAMA_RESPONSE = {
+    "model": "llama3",
+    "message": {"role": "assistant", "content": "Hi"},
+    "done": True,
+    "total_duration": 3_000_000_000,
+    "load_duration": 1_500_000_000,
+    "prompt_eval_count": 26,
+    "prompt_eval_duration": 500_000_000,
+    "eval_count": 50,
+    "eval_duration": 1_000_000_000,
+}
+
+
+def parse_server_timing(header):
+    timings = {}
+    for part in header.split(", "):
+        name, _, rest = part.partition(";")
+        timings[name] = rest
+    return timings
+
+
+def test_ollama_durations_and_upstream_overhead():
+    """Test that Ollama's durations are taken and subtracted from the round trip."""
+    timing = RequestTiming(received=0.0)
+    timing.phases["upstream"] = 3.25
+    timing.ollama(OLLAMA_RESPONSE)
+
+    assert timing.phases["load"] == 1.5
+    assert timing.phases["prompt_eval"] == 0.5
+    assert timing.phases["eval"] == 1.0
+    assert timing.phases["upstream"] == pytest.approx(0.25)
+    assert timing.fields["tokens_per_sec"] == 50.0
+
+    header = parse_server_timing(timing.header())
+    assert header["load"] == "dur=1500.0"
+    assert header["tps"] == 'desc="50.0"'
+    assert "total" in header
+
+
+def test_emit_logs_one_event(caplog):
+    """Test that the structured event is logged once per request."""
+    timing = RequestTiming()
+    timing.mark("parse")
+    with caplog.at_level(logging.INFO, logger="gateway.events"):
+        timing.emit(status=200, model="llama3")
+        timing.emit(status=500)
+
+    events = [json.loads(r.message) for r in caplog.records if r.name == "gateway.events"]
+    assert len(events) == 1
+    assert events[0]["status"] == 200
+    assert "parse" in events[0]["timings_ms"]
+
+
+@patch('gateway.main.httpx.AsyncClient.post')
+def test_chat_returns_server_timing(mock_post, caplog):
+    """Test the header and the event for a non-streamed completion."""
+    mock_response = MagicMock()
+    mock_response.json.return_value = OLLAMA_RESPONSE
+    mock_response.raise_for_status = MagicMock()
+    mock_post.return_value = mock_response
+
+    with caplog.at_level(logging.INFO, logger="gateway.events"):
+        response = client.post(
+            "/v1/chat/completions",
+            headers={"Authorization": "Bearer creative-key-456", "X-Gateway-Cache": "bypass"},
+            json={"messages": [{"role": "user", "content": "Hello"}]}
+        )
+
+    assert response.status_code == 200
+    timings = parse_server_timing(response.headers["Server-Timing"])
+    for phase in ("parse", "auth", "queue", "upstream", "load", "prompt_eval", "eval", "serialize", "total"):
+        assert phase in timings
+
+    event = [json.loads(r.message) for r in caplog.records if r.name == "gateway.events"][-1]
+    assert event["status"] == 200
+    assert event["model"] == "llama3"
+    assert event["completion_tokens"] == 50
+    assert event["timings_ms"]["load"] == 1500.0
+    assert "creative-key-456" not in json.dumps(event)
+
+
+@patch('gateway.main.httpx.AsyncClient.send')
+def test_stream_event_includes_ollama_durations(mock_send, caplog):
+    """Test that a stream's event is logged after the final chunk."""
+    lines = [
+        json.dumps({"model": "llama3", "message": {"content": "Hi"}, "done": False}),
+        json.dumps({**OLLAMA_RESPONSE, "message": {"content": ""}}),
+    ]
+
+    async def aiter_lines():
+        for line in lines:
+            yield line
+
+    mock_response = MagicMock()
+    mock_response.aiter_lines = aiter_lines
+    mock_response.raise_for_status = MagicMock()
+    mock_response.aclose = AsyncMock()
+    mock_send.return_value = mock_response
+
+    with caplog.at_level(logging.INFO, logger="gateway.events"):
+        response = client.post(
+            "/v1/chat/completions",
+            headers={"Authorization": "Bearer creative-key-456"},
+            json={"messages": [{"role": "user", "content": "Stream timing"}], "stream": True}
+        )
+
+    assert response.status_code == 200
+    assert "connect" in parse_server_timing(response.headers["Server-Timing"])
+    event = [json.loads(r.message) for r in caplog.records if r.name == "gateway.events"][-1]
+    assert event["stream"] is True
+    assert event["timings_ms"]["eval"] == 1000.0
+    assert event["tokens_per_sec"] == 50.0
@@ -0,0 +1,102 @@
+# tests/test_token_budget.py
+import asyncio
+import json
+
+import pytest
+
+from gateway.streaming import stream_chat_completion
+from gateway.token_budget import TokenBudget, TokenBudgetExceeded, estimate_tokens
+
+MESSAGES = [{"role": "user", "content": "x" * 400}]
+
+
+class EndlessStream:
+    """Stand-in for UpstreamStream that generates tokens until closed."""
+
+    def __init__(self):
+        self.closed = False
+
+    async def aiter_lines(self):
+        while True:
+            yield json.dumps({"model": "llama3", "message": {"content": "tok"}, "done": False})
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_estimate_tokens():
+    """Test that the estimate counts characters, not whitespace words."""
+    assert estimate_tokens(MESSAGES) == 104
+    assert estimate_tokens([{"role": "user", "content": None}]) == 4
+
+
+def test_reserve_then_refuse():
+    """Test that reservations draw down the bucket until it is empty."""
+    budget = TokenBudget(tokens_per_minute=1000)
+    budget.reserve("key", MESSAGES, max_tokens=296, now=0.0)
+    budget.reserve("key", MESSAGES, max_tokens=296, now=0.0)
+
+    with pytest.raises(TokenBudgetExceeded) as exc:
+        budget.reserve("key", MESSAGES, max_tokens=296, now=0.0)
+    assert exc.value.status_code == 429
+    assert exc.value.retry_after == 12
+
+    # 200 tokens remain plus 200 refilled after 12 seconds.
+    assert budget.reserve("key", MESSAGES, max_tokens=296, now=12.0) is not None
+
+
+def test_settle_refunds_and_charges():
+    """Test that settling corrects the bucket with Ollama's counters."""
+    budget = TokenBudget(tokens_per_minute=1000)
+
+    reservation = budget.reserve("key", MESSAGES, max_tokens=296)
+    assert budget.remaining("key") == pytest.approx(600, abs=1)
+    reservation.settle({"prompt_eval_count": 100, "eval_count": 50})
+    assert budget.remaining("key") == pytest.approx(850, abs=1)
+
+    reservation = budget.reserve("key", MESSAGES, max_tokens=100)
+    reservation.settle({"prompt_eval_count": 100, "eval_count": 900})
+    assert budget.remaining("key") == pytest.approx(-150, abs=1)
+
+    # Settling twice is a no-op.
+    assert reservation.settle({"eval_count": 10}) == 0
+
+
+def test_no_limit_means_no_reservation():
+    """Test that keys without an allowance are not tracked."""
+    budget = TokenBudget()
+    assert budget.reserve("key", MESSAGES) is None
+    assert budget.reserve("key", MESSAGES, tokens_per_minute=500) is not None
+
+
+def test_stream_is_cut_off_when_budget_runs_out():
+    """Test that a stream ends cleanly with finish_reason length mid-way."""
+    budget = TokenBudget(tokens_per_minute=200)
+    reservation = budget.reserve("key", MESSAGES, max_tokens=50)
+    stream = EndlessStream()
+
+    async def run():
+        return [f async for f in stream_chat_completion(stream, "llama3", allow_chunk=reservation.allow_chunk)]
+
+    raw = asyncio.run(run())
+    assert raw[-1] == b"data: [DONE]\n\n"
+    frames = [json.loads(f[6:]) for f in raw[:-1]]
+
+    assert frames[-1]["choices"][0]["finish_reason"] == "length"
+    assert all(f["choices"][0]["finish_reason"] is None for f in frames[:-1])
+    # 50 reserved plus the 46 left after the 154-token reservation.
+    assert 90 <= len(frames) - 1 <= 100
+    assert stream.closed
+
+    reservation.settle()
+    assert budget.remaining("key") < 5
+
+
+def test_evict_idle_buckets():
+    """Test that refilled buckets are dropped."""
+    budget = TokenBudget(tokens_per_minute=600)
+    budget.reserve("old", MESSAGES, now=0.0)
+    budget.reserve("active", MESSAGES, now=55.0)
+
+    assert budget.evict_idle(now=60.0) == 1
+    assert list(budget.buckets) == ["active"]
@@ -0,0 +1,43 @@
+# tests/test_transform.py
+import json
+
+from gateway.transform import (
+    ChunkTemplate,
+    dumps,
+    ollama_chunk_to_openai,
+    ollama_response_to_openai,
+    transform_openai_to_ollama,
+)
+
+
+def test_template_frames_match_full_serialization():
+    """Test that spliced frames decode to the same chunk as the dict path."""
+    template = ChunkTemplate("chatcmpl-1", 123, "llama3")
+    for content in ["Hello", ' "quoted"\n', "naïve ✓", "</script>", ""]:
+        chunk = {"model": "llama3", "message": {"content": content}, "done": False}
+        frame = template.frame(content)
+        assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+        assert json.loads(frame[6:]) == ollama_chunk_to_openai(chunk, "chatcmpl-1", 123, "llama3")
+
+
+def test_request_options_and_response_usage():
+    """Test sampling options mapping and the usage block of a completion."""
+    request = transform_openai_to_ollama({
+        "model": "llama3",
+        "messages": [{"role": "user", "content": "Hi"}],
+        "top_p": 0.9,
+        "stop": "\n",
+        "seed": 7,
+        "max_tokens": 10,
+    })
+    assert request["options"] == {"top_p": 0.9, "stop": ["\n"], "seed": 7, "num_predict": 10}
+    assert request["stream"] is False
+
+    completion = ollama_response_to_openai(
+        {"model": "llama3", "message": {"role": "assistant", "content": "Hi"}, "done": True,
+         "done_reason": "length", "prompt_eval_count": 3, "eval_count": 5},
+        "chatcmpl-1", 123, "llama3"
+    )
+    assert completion["choices"][0]["finish_reason"] == "length"
+    assert completion["usage"] == {"prompt_tokens": 3, "completion_tokens": 5, "total_tokens": 8}
+    assert json.loads(dumps(completion)) == completion
@@ -0,0 +1,68 @@
+# tests/test_upstream.py
+import asyncio
+from unittest.mock import MagicMock, patch
+
+from gateway.upstream import UpstreamClient, UpstreamSettings, normalize_host
+
+
+def test_settings_from_env():
+    """Test that pool limits and timeouts are read from the environment."""
+    settings = UpstreamSettings.from_env({
+        "OLLAMA_HOST": "remote-node:11434",
+        "OLLAMA_TIMEOUT": "90",
+        "OLLAMA_CONNECT_TIMEOUT": "2",
+        "OLLAMA_POOL_SIZE": "50",
+        "OLLAMA_POOL_KEEPALIVE": "10",
+        "OLLAMA_PER_HOST_LIMIT": "4",
+    })
+
+    assert settings.host == "http://remote-node:11434"
+    assert settings.max_connections == 50
+    assert settings.max_keepalive_connections == 10
+    assert settings.max_connections_per_host == 4
+
+    timeout = settings.httpx_timeout()
+    assert timeout.connect == 2
+    assert timeout.read == 90
+
+
+def test_normalize_host():
+    """Test that OLLAMA_HOST values are turned into base URLs."""
+    assert normalize_host("localhost:11434") == "http://localhost:11434"
+    assert normalize_host("https://ollama.internal/") == "https://ollama.internal"
+
+
+def test_client_is_reused():
+    """Test that one pooled client serves every request."""
+    upstream = UpstreamClient(UpstreamSettings())
+    first = upstream.client
+    assert upstream.client is first
+    asyncio.run(upstream.aclose())
+    assert upstream.client is not first
+
+
+@patch('gateway.upstream.httpx.AsyncClient.post')
+def test_per_host_limit(mock_post):
+    """Test that no more than max_connections_per_host requests run at once."""
+    upstream = UpstreamClient(UpstreamSettings(max_connections_per_host=2))
+    active = 0
+    peak = 0
+
+    async def slow_post(url, json=None):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        response = MagicMock()
+        response.json.return_value = {"done": True}
+        return response
+
+    mock_post.side_effect = slow_post
+
+    async def run():
+        url = upstream.url("/api/chat")
+        await asyncio.gather(*(upstream.post_json(url, {}) for _ in range(6)))
+
+    asyncio.run(run())
+    assert peak == 2
@@ -0,0 +1,177 @@
+# tests/test_usage.py
+import asyncio
+import json
+import threading
+
+import pytest
+
+from gateway.usage import JsonlSink, RedisSink, SQLiteSink, UsageAggregator, estimate_cost
+
+
+class MemorySink:
+    def __init__(self):
+        self.batches = []
+
+    def write(self, batch):
+        self.batches.append({k: list(v) for k, v in batch.items()})
+
+    def close(self):
+        pass
+
+
+class FlakySink(MemorySink):
+    def __init__(self):
+        super().__init__()
+        self.fail = True
+
+    def write(self, batch):
+        if self.fail:
+            self.fail = False
+            raise ConnectionError("sink down")
+        super().write(batch)
+
+
+def summed(batches):
+    totals = {}
+    for batch in batches:
+        for key, counters in batch.items():
+            entry = totals.setdefault(key, [0, 0, 0, 0.0])
+            for i, value in enumerate(counters):
+                entry[i] += value
+    return totals
+
+
+def test_estimate_cost():
+    """Test the per-token cost lookup, including tagged model names."""
+    assert estimate_cost("llama3", 1000) == pytest.approx(0.002)
+    assert estimate_cost("llama3:70b", 1000) == pytest.approx(0.02)
+    assert estimate_cost("llama3:latest", 1000) == pytest.approx(0.002)
+    assert estimate_cost("unknown", 1000) == 0
+
+
+def test_no_increments_lost_under_concurrency():
+    """Test that concurrent recorders and flushes account for every request."""
+    sink = MemorySink()
+    usage = UsageAggregator(sink, flush_interval=0.001, flush_events=50)
+
+    def worker(n):
+        for i in range(2000):
+            usage.record(f"key-{n % 3}", "llama3", 10, 5)
+
+    async def run():
+        runner = asyncio.create_task(usage.run())
+
+        async def tasks(n):
+            for i in range(500):
+                usage.record("async-key", "llama3", 1, 1)
+                if i % 50 == 0:
+                    await asyncio.sleep(0)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+        for t in threads:
+            t.start()
+        await asyncio.gather(*(tasks(n) for n in range(8)))
+        while any(t.is_alive() for t in threads):
+            await asyncio.sleep(0.001)
+        runner.cancel()
+        await usage.close()
+
+    asyncio.run(run())
+
+    totals = summed(sink.batches)
+    assert len(sink.batches) > 1
+    assert sum(totals[(f"key-{n}", "llama3")][0] for n in range(3)) == 12_000
+    assert totals[("key-0", "llama3")][1:3] == [40_000, 20_000]
+    assert totals[("async-key", "llama3")][0] == 4000
+    assert {k: v[:3] for k, v in totals.items()} == {k: v[:3] for k, v in usage.totals.items()}
+
+
+def test_failed_flush_is_retried():
+    """Test that a batch the sink rejects is merged back and written later."""
+    sink = FlakySink()
+    usage = UsageAggregator(sink)
+    usage.record("key", "llama3", 10, 5)
+
+    async def run():
+        assert await usage.flush() == 0
+        usage.record("key", "llama3", 10, 5)
+        assert await usage.flush() == 1
+
+    asyncio.run(run())
+    assert usage.failures == 1
+    assert sink.batches == [{("key", "llama3"): [2, 20, 10, pytest.approx(0.00006)]}]
+
+
+def test_pending_buffer_is_bounded():
+    """Test that new pairs past max_pending are dropped and counted."""
+    usage = UsageAggregator(MemorySink(), max_pending=2)
+    for key in ("a", "b", "c", "a"):
+        usage.record(key, "llama3", 1, 1)
+
+    assert usage.dropped == 1
+    assert usage.snapshot()["usage"]["a"]["llama3"]["requests"] == 2
+    assert "c" not in usage.snapshot()["usage"]
+
+
+def test_sqlite_sink_keeps_running_totals(tmp_path):
+    """Test that SQLite rows accumulate across flushes."""
+    sink = SQLiteSink(str(tmp_path / "usage.db"))
+    sink.write({("key", "llama3"): [1, 10, 5, 0.1]})
+    sink.write({("key", "llama3"): [2, 20, 10, 0.2], ("key", "phi"): [1, 1, 1, 0.0]})
+
+    totals = sink.totals()
+    assert totals[("key", "llama3")][:3] == (3, 30, 15)
+    assert totals[("key", "llama3")][3] == pytest.approx(0.3)
+    assert totals[("key", "phi")] == (1, 1, 1, 0.0)
+    sink.close()
+
+
+def test_jsonl_sink_appends_lines(tmp_path):
+    """Test that each flush appends one line per key and model."""
+    path = tmp_path / "usage.jsonl"
+    sink = JsonlSink(str(path))
+    sink.write({("key", "llama3"): [1, 10, 5, 0.0]})
+    sink.write({("key", "llama3"): [1, 2, 3, 0.0]})
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["prompt_tokens"] for line in lines] == [10, 2]
+    assert lines[0]["key"] == "key"
+
+
+def test_redis_sink_uses_one_pipeline():
+    """Test that a batch lands as hash increments in a single pipeline."""
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    sink = RedisSink(client)
+    sink.write({("key", "llama3"): [2, 10, 5, 0.00003], ("key", "phi"): [1, 1, 1, 0.0]})
+    sink.write({("key", "llama3"): [1, 1, 1, 0.0]})
+
+    usage = client.hgetall("usage:key")
+    assert usage[b"llama3:requests"] == b"3"
+    assert usage[b"llama3:tokens"] == b"17"
+    assert float(usage[b"llama3:cost"]) == pytest.approx(0.00003)
+    assert usage[b"phi:completion_tokens"] == b"1"
+
+
+def test_chat_usage_is_recorded_by_key_id():
+    """Test that usage is keyed by the policy id, never by the bearer token."""
+    from unittest.mock import patch
+
+    from fastapi.testclient import TestClient
+
+    import gateway.main as gateway_main
+
+    reply = {"model": "llama3", "message": {"role": "assistant", "content": "ok"}, "done": True,
+             "prompt_eval_count": 3, "eval_count": 2}
+    aggregator = UsageAggregator(MemorySink())
+    with patch("gateway.main.usage", aggregator), patch("gateway.main.upstream.post_json", return_value=reply):
+        response = TestClient(gateway_main.app).post(
+            "/v1/chat/completions",
+            headers={"Authorization": "Bearer dev-key-123", "X-Gateway-Cache": "bypass"},
+            json={"messages": [{"role": "user", "content": "hi"}]},
+        )
+
+    assert response.status_code == 200
+    policy = gateway_main.keys.lookup("dev-key-123")
+    assert list(aggregator.snapshot()["usage"]) == [policy.id]
+    assert policy.id != "dev-key-123"